@@ -1,12 +1,28 @@
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 from typing import List, Optional, Dict, Any
 from pydantic import BaseModel
-import shutil
 import os
 import uuid
 import json
-from models.multimodal import process_multimodal_input
+import time
+import asyncio
+import functools
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
+from starlette.concurrency import run_in_threadpool
+from starlette.exceptions import HTTPException as StarletteHTTPException
+from python_multipart.multipart import MultipartParser, parse_options_header
+from models.multimodal import process_multimodal_input_async, stream_multimodal_events, process_streamed_input_async, get_llm_client
+from models.bulk import iter_bulk_async, BULK_CHUNK_SIZE
+from models.registry import registry, preload_from_env
+from models.batching import batching_stats, env_int, env_float
+from models.cache import cache_stats
+from models.session_store import session_store
+from models.executors import (
+    admission, AdmissionRejected, abandoned_stages, after_abandoned_stages, inference_executor, run_in_inference_pool,
+)
+from models.metrics import metrics, requests_total, request_seconds, start_trace, span
+from models.streaming import StreamingAnalyzer, STREAM_MAX_DURATION_S
 
 os.environ["TRANSFORMERS_CACHE"] = os.path.join(os.path.dirname(__file__), "hf_cache")
 
@@ -15,6 +31,27 @@ app = FastAPI(title="Multimodal Mental Health API")
 UPLOAD_DIR = "temp_uploads"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
+# Uploads are parsed from the request body as it arrives (parse_upload_form). Those
+# up to UPLOAD_MEMORY_MAX_BYTES are analysed straight from memory and never touch
+# UPLOAD_DIR; larger ones are streamed to disk, and each kind has a hard limit.
+UPLOAD_MEMORY_MAX_BYTES = env_int("UPLOAD_MEMORY_MAX_BYTES", 8 * 1024 * 1024)
+UPLOAD_MAX_BYTES = {
+    "image": env_int("UPLOAD_MAX_IMAGE_BYTES", 10 * 1024 * 1024),
+    "audio": env_int("UPLOAD_MAX_AUDIO_BYTES", 50 * 1024 * 1024),
+    "video": env_int("UPLOAD_MAX_VIDEO_BYTES", 500 * 1024 * 1024),
+    "manifest": env_int("UPLOAD_MAX_MANIFEST_BYTES", 50 * 1024 * 1024),
+}
+UPLOAD_MAX_REQUEST_BYTES = env_int("UPLOAD_MAX_REQUEST_BYTES", 600 * 1024 * 1024)
+# Form field name -> upload kind; text fields are capped at FORM_FIELD_MAX_BYTES.
+UPLOAD_FIELDS = {"images": "image", "audio": "audio", "video": "video", "manifest": "manifest"}
+FORM_FIELD_MAX_BYTES = 1024 * 1024
+
+# A /ws/analyze client that sends nothing for this long is disconnected.
+STREAM_IDLE_TIMEOUT_S = env_float("STREAM_IDLE_TIMEOUT_S", 30.0)
+# Open streams hold no admission slot while recording, so they are capped on their own.
+STREAM_MAX_SESSIONS = env_int("STREAM_MAX_SESSIONS", 16)
+active_streams = 0
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -23,20 +60,250 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-def save_file(file: UploadFile) -> str:
-    ext = os.path.splitext(file.filename)[1].lower()
-    unique_filename = f"{uuid.uuid4()}{ext}"
-    path = os.path.join(UPLOAD_DIR, unique_filename)
+@app.on_event("startup")
+async def preload_models():
+    # PRELOAD_MODELS=text,image,audio (or "all") warms models in the background;
+    # anything not listed loads on the first request that needs it.
+    preload_from_env(background=True)
 
+@app.middleware("http")
+async def record_request_metrics(request, call_next):
+    start = time.perf_counter()
+    status = 500
     try:
-        with open(path, "wb") as f:
-            shutil.copyfileobj(file.file, f)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error saving file: {str(e)}")
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        path = getattr(route, "path", "unmatched")
+        requests_total.inc(route=path, method=request.method, status=status)
+        # Streaming responses are timed to their first byte.
+        request_seconds.observe(time.perf_counter() - start, route=path)
+
+def collect_gauges():
+    # Sampled at scrape time from the components' own stats.
+    stats = admission.stats()
+    yield "admission_in_flight", "Pipeline requests running.", {}, stats["in_flight"]
+    yield "admission_queued", "Pipeline requests waiting for a slot.", {}, stats["queued"]
+    yield "stream_sessions", "Open /ws/analyze streams.", {}, active_streams
+    yield "abandoned_stages", "Timed-out stages still running on the inference pool.", {}, abandoned_stages()
+    for status, count in stats["rejected"].items():
+        yield "admission_rejected", "Pipeline requests rejected since start.", {"status": status}, count
+
+    for name, batcher in batching_stats().items():
+        yield "batch_queue_depth", "Items waiting for a batched model call.", {"model": name}, batcher["queue_depth"]
+        yield "batch_mean_size", "Mean items per batched model call.", {"model": name}, batcher["mean_batch_size"]
+
+    models = registry.stats()
+    yield "process_rss_bytes", "Resident memory of this process.", {}, models["process_rss_bytes"]
+    for name, model in models["models"].items():
+        yield "model_loaded", "1 when the model is loaded.", {"model": name}, int(model.get("status") == "loaded")
+        yield "model_parameter_bytes", "Bytes held by model parameters.", {"model": name}, model.get("parameter_bytes")
+        yield "model_rss_delta_bytes", "Process RSS growth while loading the model.", {"model": name}, model.get("rss_delta_bytes")
+
+    for name, cache in cache_stats().items():
+        for field in ("hits", "disk_hits", "misses", "evictions"):
+            yield f"cache_{field}", f"Result cache {field.replace('_', ' ')} since start.", {"cache": name}, cache[field]
+
+    sessions = session_store.stats()
+    yield "sessions", "Stored sessions.", {}, sessions["sessions"]
+    yield "session_bytes", "Serialized size of stored sessions.", {}, sessions["bytes"]
+
+    llm = get_llm_client().stats()
+    for field in ("calls", "failures", "retries", "hedges"):
+        yield f"llm_{field}", f"LLM client {field} since start.", {"backend": llm["backend"]}, llm[field]
+    yield "llm_circuit_open", "1 while the LLM circuit breaker rejects calls.", {}, int(llm["breaker"]["state"] == "open")
+
+metrics.add_collector(collect_gauges)
+
+@app.middleware("http")
+async def limit_request_size(request, call_next):
+    # Refuse oversized bodies from the Content-Length header before reading any of
+    # them. Chunked bodies are capped by parse_upload_form as they arrive.
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > UPLOAD_MAX_REQUEST_BYTES:
+        return JSONResponse(
+            status_code=413,
+            content={"detail": f"Request body exceeds {UPLOAD_MAX_REQUEST_BYTES} bytes"},
+        )
+    return await call_next(request)
+
+@app.exception_handler(AdmissionRejected)
+async def admission_rejected_handler(request, exc: AdmissionRejected):
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"detail": exc.detail},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+class _UploadPart:
+    """One part of a multipart body: kept in memory, or spilled to UPLOAD_DIR once
+    it outgrows UPLOAD_MEMORY_MAX_BYTES (videos always, since OpenCV opens them by path)."""
+
+    def __init__(self, name: str, filename: Optional[str], kind: Optional[str]):
+        self.name = name
+        self.filename = filename
+        self.kind = kind
+        # Files in fields no endpoint reads are skipped, as FastAPI's form handling did.
+        self.ignored = filename is not None and kind is None
+        if kind is None:
+            self.limit = FORM_FIELD_MAX_BYTES
+            self.memory_limit = FORM_FIELD_MAX_BYTES
+        else:
+            self.limit = UPLOAD_MAX_BYTES[kind]
+            self.memory_limit = 0 if kind == "video" else UPLOAD_MEMORY_MAX_BYTES
+        self.size = 0
+        self.chunks = []
+        self.path = None
+        self._out = None
+
+    def add(self, data: bytes) -> None:
+        if self.ignored:
+            return
+        self.size += len(data)
+        if self.size > self.limit:
+            what = f"{self.kind.capitalize()} upload" if self.kind else f"Form field '{self.name}'"
+            raise HTTPException(status_code=413, detail=f"{what} exceeds {self.limit} bytes")
+        self.chunks.append(data)
+
+    def spill(self, saved: List[str]) -> None:
+        # Runs in the threadpool: moves the buffered chunks to disk once over the memory limit.
+        if self.path is None:
+            if self.size <= self.memory_limit:
+                return
+            ext = os.path.splitext(self.filename or "")[1].lower()
+            self.path = os.path.join(UPLOAD_DIR, f"{uuid.uuid4()}{ext}")
+            saved.append(self.path)
+            self._out = open(self.path, "wb")
+        self._out.writelines(self.chunks)
+        self.chunks = []
+
+    def close(self) -> None:
+        if self._out is not None:
+            self._out.close()
+            self._out = None
+
+    @property
+    def value(self):
+        if self.path is not None:
+            return self.path
+        data = b"".join(self.chunks)
+        return data if self.kind else data.decode("utf-8", errors="replace")
+
+
+class UploadForm:
+    """Text fields and uploads of a form, as parsed by parse_upload_form."""
+
+    def __init__(self):
+        self.fields: Dict[str, str] = {}
+        self.uploads: Dict[str, List[Any]] = {}
 
-    return path
+    def get(self, name: str, default: Optional[str] = None) -> Optional[str]:
+        return self.fields.get(name, default)
+
+    def files(self, name: str) -> List[Any]:
+        return self.uploads.get(name, [])
+
+
+async def parse_upload_form(request: Request, saved: List[str]) -> UploadForm:
+    """Parse a form body as it arrives from the client, enforcing the size limits.
+
+    Uploads in the fields of UPLOAD_FIELDS come back as bytes or, past
+    UPLOAD_MEMORY_MAX_BYTES, as paths in UPLOAD_DIR that are appended to `saved`
+    so the caller can clean up even on failure. A part or request over its limit
+    is refused with 413 at the chunk that crosses it; nothing beyond that chunk
+    is read or written.
+    """
+    form = UploadForm()
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data":
+        # Text-only clients may post URL-encoded forms; those carry no uploads.
+        try:
+            fields = await request.form(max_part_size=FORM_FIELD_MAX_BYTES)
+        except StarletteHTTPException as e:
+            raise HTTPException(status_code=e.status_code, detail=e.detail)
+        form.fields = {key: value for key, value in fields.items() if isinstance(value, str)}
+        return form
+
+    boundary = params.get(b"boundary")
+    if not boundary:
+        raise HTTPException(status_code=400, detail="Missing multipart boundary")
+
+    parts = []
+    current = {"part": None, "header_field": b"", "header_value": b"", "disposition": b""}
+
+    def on_part_begin():
+        current["disposition"] = b""
+
+    def on_header_field(data, start, end):
+        current["header_field"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        current["header_value"] += data[start:end]
+
+    def on_header_end():
+        if current["header_field"].lower() == b"content-disposition":
+            current["disposition"] = current["header_value"]
+        current["header_field"] = b""
+        current["header_value"] = b""
+
+    def on_headers_finished():
+        _, options = parse_options_header(current["disposition"])
+        name = options.get(b"name", b"").decode("utf-8", errors="replace")
+        filename = options.get(b"filename")
+        filename = filename.decode("utf-8", errors="replace") if filename is not None else None
+        kind = UPLOAD_FIELDS.get(name) if filename is not None else None
+        current["part"] = _UploadPart(name, filename, kind)
+        parts.append(current["part"])
+
+    def on_part_data(data, start, end):
+        current["part"].add(data[start:end])
+
+    parser = MultipartParser(boundary, {
+        "on_part_begin": on_part_begin,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+    })
+
+    received = 0
+    try:
+        async for chunk in request.stream():
+            received += len(chunk)
+            if received > UPLOAD_MAX_REQUEST_BYTES:
+                raise HTTPException(status_code=413, detail=f"Request body exceeds {UPLOAD_MAX_REQUEST_BYTES} bytes")
+            parser.write(chunk)
+            for part in parts:
+                if part.kind and part.chunks and (part.path is not None or part.size > part.memory_limit):
+                    await run_in_threadpool(part.spill, saved)
+        parser.finalize()
+    finally:
+        for part in parts:
+            part.close()
+
+    for part in parts:
+        if part.ignored:
+            continue
+        if part.kind is None:
+            form.fields[part.name] = part.value
+        elif part.filename and part.size:
+            # Browsers send an empty part for a file input left blank.
+            form.uploads.setdefault(part.name, []).append(part.value)
+    return form
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
 
 def cleanup_files(file_paths: List[str]) -> None:
+    # Stages that timed out may still be reading these files; they are removed
+    # once those stages finish.
+    after_abandoned_stages(_remove_files, list(file_paths))
+
+def _remove_files(file_paths: List[str]) -> None:
     for path in file_paths:
         if path and os.path.exists(path):
             try:
@@ -51,22 +318,45 @@ class UserContext(BaseModel):
     mental_health_history: Optional[Dict[str, Any]] = None
     demographics: Optional[Dict[str, Any]] = None
 
+def parse_user_context(user_context_json: Optional[str]) -> Optional[Dict[str, Any]]:
+    if not user_context_json:
+        return None
+    try:
+        user_context_data = json.loads(user_context_json)
+        return UserContext(**user_context_data).dict()
+    except json.JSONDecodeError as e:
+        print(f"Error parsing user context JSON: {e}")
+    except Exception as e:
+        print(f"Error creating user context: {e}")
+    return None
+
+def form_uploads(form: UploadForm):
+    # Small uploads are bytes, larger ones paths in UPLOAD_DIR.
+    audio = form.files("audio")
+    video = form.files("video")
+    return form.files("images") or None, audio[0] if audio else None, video[0] if video else None
+
 @app.post("/analyze")
-async def analyze(
-    text: Optional[str] = Form(None),
-    images: Optional[List[UploadFile]] = File(None),
-    audio: Optional[UploadFile] = File(None),
-    video: Optional[UploadFile] = File(None),
-    user_context_json: Optional[str] = Form(None),
-    session_id: Optional[str] = Form(None),
-    is_assessment_mode: Optional[str] = Form("false")
-):
-    image_paths = []
-    audio_path = None
-    video_path = None
-    user_context = None
+async def analyze(request: Request):
+    # Form fields: text, images (repeatable), audio, video, user_context_json,
+    # session_id, is_assessment_mode, debug.
+    saved_paths = []
+    start = time.perf_counter()
+
+    # debug=true adds per-stage timings (in milliseconds) to the response. The
+    # flag is a form field, so tracing starts before the body is parsed.
+    spans = start_trace()
 
     try:
+        with span("upload"):
+            form = await parse_upload_form(request, saved_paths)
+        if form.get("debug", "false").lower() != "true":
+            spans = None
+        text = form.get("text")
+        session_id = form.get("session_id")
+        is_assessment_mode = form.get("is_assessment_mode", "false")
+        user_context_json = form.get("user_context_json")
+
         # Convert string to boolean for is_assessment_mode
         assessment_mode = is_assessment_mode.lower() == 'true'
         print(f"Assessment mode: {assessment_mode} for session: {session_id}")
@@ -75,45 +365,323 @@ async def analyze(
             session_id = str(uuid.uuid4())
             print(f"Generated new session ID: {session_id}")
        
-        if user_context_json:
-            try:
-                user_context_data = json.loads(user_context_json)
-                user_context = UserContext(**user_context_data)
-            except json.JSONDecodeError as e:
-                print(f"Error parsing user context JSON: {e}")
-            except Exception as e:
-                print(f"Error creating user context: {e}")
+        user_context = parse_user_context(user_context_json)
        
-        if images:
-            for img in images:
-                if img.filename:
-                    image_paths.append(save_file(img))
-
-        if audio and audio.filename:
-            audio_path = save_file(audio)
-
-        if video and video.filename:
-            video_path = save_file(video)
-
-        result = process_multimodal_input(
-            text=text,
-            image_paths=image_paths if image_paths else None,
-            audio_path=audio_path,
-            video_path=video_path,
-            user_context=user_context.dict() if user_context else None,
-            session_id=session_id,
-            is_assessment_mode=assessment_mode  # Fixed variable name
-        )
+        image_paths, audio_path, video_path = form_uploads(form)
+        async with admission.slot(session_id):
+            result = await process_multimodal_input_async(
+                text=text,
+                image_paths=image_paths,
+                audio_path=audio_path,
+                video_path=video_path,
+                user_context=user_context,
+                session_id=session_id,
+                is_assessment_mode=assessment_mode
+            )
 
+        if spans is not None:
+            result["timings"] = {"total_ms": round((time.perf_counter() - start) * 1000.0, 2), "spans": spans}
         return result
 
+    except (AdmissionRejected, HTTPException):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Processing error: {str(e)}")
 
     finally:
-        all_paths = image_paths + [audio_path, video_path]
-        cleanup_files([p for p in all_paths if p is not None])
+        cleanup_files(saved_paths)
+
+class ReleasingStreamingResponse(StreamingResponse):
+    """StreamingResponse that calls `release` once the response is over, however it ended.
+
+    A body generator's own `finally` never runs if the client disconnects before
+    the first chunk is pulled, so an admission slot or upload files held for the
+    stream are released here instead.
+    """
+
+    def __init__(self, content, release, **kwargs):
+        super().__init__(content, **kwargs)
+        self.release = release
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.release()
+
+def sse_event(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+@app.post("/analyze/stream")
+async def analyze_stream(request: Request):
+    # Server-Sent Events: per-modality "sentiment" events as each analyzer finishes,
+    # "combined", streamed "token" chunks of the reply, then the full "result".
+    # Takes the same form fields as /analyze, except debug.
+    saved_paths = []
+    try:
+        with span("upload"):
+            form = await parse_upload_form(request, saved_paths)
+        text = form.get("text")
+        assessment_mode = form.get("is_assessment_mode", "false").lower() == 'true'
+        session_id = form.get("session_id") or str(uuid.uuid4())
+        user_context = parse_user_context(form.get("user_context_json"))
+        image_paths, audio_path, video_path = form_uploads(form)
+
+        # Admission is decided before the response starts so a rejection is a plain 429/503.
+        slot = admission.slot(session_id)
+        await slot.__aenter__()
+    except BaseException:
+        cleanup_files(saved_paths)
+        raise
+
+    async def release():
+        cleanup_files(saved_paths)
+        await slot.__aexit__(None, None, None)
+
+    async def events():
+        try:
+            async for event, data in stream_multimodal_events(
+                text=text,
+                image_paths=image_paths,
+                audio_path=audio_path,
+                video_path=video_path,
+                user_context=user_context,
+                session_id=session_id,
+                is_assessment_mode=assessment_mode
+            ):
+                yield sse_event(event, data)
+        except Exception as e:
+            print(f"Error in streaming analysis: {e}")
+            yield sse_event("error", {"detail": f"Processing error: {str(e)}"})
+
+    return ReleasingStreamingResponse(
+        events(),
+        release,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.post("/analyze/batch")
+async def analyze_batch(request: Request):
+    # Bulk re-scoring: a JSONL manifest in (see models/bulk.py), one JSON result
+    # per line out (NDJSON) as items finish. No sessions are created or updated.
+    # Every item takes its own admission slot, and at most max_in_flight items
+    # of a batch are in the system at once.
+    # Form fields: manifest (file), include_llm.
+    saved_paths = []
+    try:
+        form = await parse_upload_form(request, saved_paths)
+        manifest = form.files("manifest")
+        if not manifest:
+            raise HTTPException(status_code=422, detail="A manifest file is required")
+        data = manifest[0]
+        if isinstance(data, str):
+            data = await run_in_threadpool(_read_file, data)
+    finally:
+        cleanup_files(saved_paths)
+
+    results = iter_bulk_async(
+        data.splitlines(),
+        llm=form.get("include_llm", "false").lower() == "true",
+        concurrency=min(BULK_CHUNK_SIZE, admission.max_in_flight),
+        admit=lambda: admission.slot(None),
+    )
+    lines = (json.dumps(record, default=str) + "\n" async for record in results)
+    # Closing the generator cancels the items still pending if the client goes away.
+    return ReleasingStreamingResponse(lines, results.aclose, media_type="application/x-ndjson")
+
+@app.websocket("/ws/analyze")
+async def analyze_websocket(websocket: WebSocket):
+    # Real-time analysis while the user is still speaking (see models/streaming.py).
+    #   client: {"type": "start", "session_id", "is_assessment_mode", "user_context",
+    #            "sample_rate": 16000, "encoding": "f32le" | "s16le"}   (optional, first)
+    #           binary messages: mono PCM audio in that encoding
+    #           {"type": "frame", "data": "<base64 image>"}, {"type": "text", "text": "..."}
+    #           {"type": "end", "text": "..."}
+    #   server: "ready", then "estimate" messages as windows and frames are classified,
+    #           and finally "result" with the same shape /analyze returns.
+    # Only the final fusion and LLM reply take an admission slot; while recording,
+    # at most one audio window and one frame per stream are on the inference pool,
+    # and frames arriving while one is being classified are dropped. At most
+    # STREAM_MAX_SESSIONS streams are open at once.
+    global active_streams
+    await websocket.accept()
+    if active_streams >= STREAM_MAX_SESSIONS:
+        await websocket.send_text(json.dumps({"type": "error", "detail": "Too many open streams, please retry shortly", "status": 503}))
+        await websocket.close(code=1013)
+        return
+    active_streams += 1
+
+    send_lock = asyncio.Lock()
+    error_reports = set()
+
+    async def send(message):
+        async with send_lock:
+            await websocket.send_text(json.dumps(message, default=str))
+
+    async def send_error(detail):
+        try:
+            await send({"type": "error", "detail": detail})
+        except Exception:
+            pass
+
+    def report_failure(modality, task):
+        # Reading the exception here also keeps it from being logged as never retrieved.
+        if task.cancelled() or task.exception() is None:
+            return
+        print(f"Error classifying streamed {modality}: {task.exception()}")
+        report = asyncio.ensure_future(send_error(f"Processing error ({modality}): {task.exception()}"))
+        error_reports.add(report)
+        report.add_done_callback(error_reports.discard)
+
+    def start(coro, modality):
+        task = asyncio.ensure_future(coro)
+        task.add_done_callback(functools.partial(report_failure, modality))
+        return task
+
+    analyzer = None
+    options = {}
+    text_parts = []
+    audio_task = None
+    frame_task = None
+
+    async def classify_audio(window):
+        probabilities = await run_in_inference_pool(analyzer.classify_window, window)
+        result = analyzer.record_window(window, probabilities)
+        if result is not None:
+            await send({"type": "estimate", "modality": "audio", "window": result, **analyzer.estimate()})
+
+    async def classify_frame(data):
+        result = await run_in_inference_pool(analyzer.classify_frame, data)
+        if result is not None:
+            await send({"type": "estimate", "modality": "images", "frame": result, **analyzer.estimate()})
+
+    try:
+        while True:
+            try:
+                message = await asyncio.wait_for(websocket.receive(), timeout=STREAM_IDLE_TIMEOUT_S)
+            except asyncio.TimeoutError:
+                await send({"type": "error", "detail": "Stream idle for too long"})
+                await websocket.close(code=1001)
+                return
+            if message["type"] == "websocket.disconnect":
+                return
+
+            control = None
+            if message.get("text") is not None:
+                try:
+                    control = json.loads(message["text"])
+                    if not isinstance(control, dict):
+                        raise ValueError("not a JSON object")
+                except ValueError as e:
+                    await send({"type": "error", "detail": f"Invalid message: {e}"})
+                    continue
+
+            if analyzer is None:
+                if control is not None and control.get("type") == "start":
+                    options = control
+                try:
+                    analyzer = StreamingAnalyzer(
+                        sample_rate=options.get("sample_rate", 16000),
+                        encoding=options.get("encoding", "f32le"),
+                    )
+                except (TypeError, ValueError) as e:
+                    await send({"type": "error", "detail": str(e)})
+                    await websocket.close(code=1003)
+                    return
+                options["session_id"] = options.get("session_id") or str(uuid.uuid4())
+                await send({"type": "ready", "session_id": options["session_id"]})
+                if control is not None and control.get("type") == "start":
+                    continue
+
+            if control is None:
+                analyzer.add_audio(message.get("bytes") or b"")
+                if analyzer.duration_s >= STREAM_MAX_DURATION_S:
+                    control = {"type": "end"}
+                elif analyzer.window_due() and (audio_task is None or audio_task.done()):
+                    audio_task = start(classify_audio(analyzer.take_window()), "audio")
+                    continue
+                else:
+                    continue
+
+            kind = control.get("type")
+            if kind == "frame" and control.get("data"):
+                if frame_task is None or frame_task.done():
+                    frame_task = start(classify_frame(control["data"]), "images")
+            elif kind == "text" and control.get("text"):
+                text_parts.append(control["text"])
+            elif kind == "end":
+                if control.get("text"):
+                    text_parts.append(control["text"])
+                break
+            else:
+                await send({"type": "error", "detail": f"Unknown message type: {kind}"})
+
+        # Let in-flight work land, then classify whatever audio the last window missed.
+        await asyncio.gather(*(task for task in (audio_task, frame_task) if task is not None), return_exceptions=True)
+        window = analyzer.take_window(final=True)
+        if window is not None:
+            await classify_audio(window)
+
+        session_id = options["session_id"]
+        async with admission.slot(session_id):
+            result = await process_streamed_input_async(
+                analyzer,
+                text=" ".join(text_parts) or None,
+                user_context=UserContext(**options["user_context"]).dict() if options.get("user_context") else None,
+                session_id=session_id,
+                is_assessment_mode=str(options.get("is_assessment_mode", "false")).lower() == "true",
+            )
+        await send({"type": "result", **result})
+        await websocket.close()
+
+    except WebSocketDisconnect:
+        return
+    except AdmissionRejected as e:
+        await send({"type": "error", "detail": e.detail, "status": e.status_code})
+        await websocket.close(code=1013)
+    except Exception as e:
+        print(f"Error in WebSocket analysis: {e}")
+        try:
+            await send({"type": "error", "detail": f"Processing error: {str(e)}"})
+            await websocket.close(code=1011)
+        except Exception:
+            pass
+    finally:
+        active_streams -= 1
+        for task in (audio_task, frame_task):
+            if task is not None and not task.done():
+                task.cancel()
 
 @app.get("/")
 async def root():
-    return {"status": "healthy", "service": "Multimodal Mental Health API"}
\ No newline at end of file
+    return {"status": "healthy", "service": "Multimodal Mental Health API"}
+
+@app.get("/health")
+async def health():
+    return {
+        "status": "healthy",
+        "admission": admission.stats(),
+        "inference_workers": inference_executor.max_workers,
+        "abandoned_stages": abandoned_stages(),
+        "sessions": await run_in_threadpool(session_store.stats),
+        "llm": get_llm_client().stats(),
+    }
+
+@app.get("/models")
+async def models_status():
+    return registry.stats()
+
+@app.get("/batching")
+async def batching_status():
+    return batching_stats()
+
+@app.get("/cache")
+async def cache_status():
+    return cache_stats()
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    # Prometheus text exposition format. Rendered off the loop: the session gauges
+    # read the session store.
+    return PlainTextResponse(await run_in_threadpool(metrics.render), media_type="text/plain; version=0.0.4")
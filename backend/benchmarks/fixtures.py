@@ -0,0 +1,76 @@
+import io
+import os
+import wave
+
+import cv2
+import numpy as np
+from PIL import Image
+
+SAMPLING_RATE = 16000
+
+TEXTS = [
+    "I feel great today and everything is going well.",
+    "I can't sleep and I'm worried all the time.",
+    "It was an ordinary day, nothing special happened.",
+    "Nothing I do seems to matter anymore and I'm exhausted.",
+    "I had a good talk with a friend and it helped a lot.",
+    "Work has been stressful but I'm managing, mostly.",
+]
+
+
+def images(count=4, size=224, seed=0):
+    """RGB test images: smooth gradients with noise, as PIL images. They contain no faces."""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:size, 0:size]
+    result = []
+    for i in range(count):
+        base = np.stack([(x + 40 * i) % 256, (y + 80 * i) % 256, (x + y) // 2 % 256], axis=-1)
+        noise = rng.integers(-20, 20, base.shape)
+        result.append(Image.fromarray(np.clip(base + noise, 0, 255).astype(np.uint8)))
+    return result
+
+
+def image_bytes(image, format="PNG"):
+    buffer = io.BytesIO()
+    image.save(buffer, format=format)
+    return buffer.getvalue()
+
+
+def audio(duration_s=5.0, seed=0):
+    """Speech-like float32 mono signal: a few harmonics with a slow amplitude envelope."""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(duration_s * SAMPLING_RATE)) / SAMPLING_RATE
+    pitch = 140 + 40 * np.sin(2 * np.pi * 0.5 * t)
+    phase = 2 * np.pi * np.cumsum(pitch) / SAMPLING_RATE
+    signal = sum(np.sin(k * phase) / k for k in range(1, 5))
+    envelope = 0.5 + 0.5 * np.sin(2 * np.pi * 2.0 * t) ** 2
+    signal = 0.2 * envelope * signal + 0.01 * rng.standard_normal(len(t))
+    return signal.astype(np.float32)
+
+
+def wav_bytes(samples, sampling_rate=SAMPLING_RATE):
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sampling_rate)
+        f.writeframes((np.clip(samples, -1, 1) * 32767).astype(np.int16).tobytes())
+    return buffer.getvalue()
+
+
+def video(path, duration_s=4.0, fps=15, size=(320, 240)):
+    """Write a silent MJPEG .avi of moving shapes (no faces) to `path` and return the path."""
+    width, height = size
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), fps, size)
+    try:
+        for i in range(int(duration_s * fps)):
+            frame = np.full((height, width, 3), 30 + (i * 3) % 100, dtype=np.uint8)
+            cx = int(width / 2 + width / 3 * np.sin(i / fps * 2))
+            cv2.circle(frame, (cx, height // 2), 40, (200, 180, 160), -1)
+            cv2.rectangle(frame, (10, 10), (10 + i % 60, 40), (0, 120, 255), -1)
+            writer.write(frame)
+    finally:
+        writer.release()
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        raise RuntimeError("OpenCV could not write the benchmark video (no MJPG encoder?)")
+    return path
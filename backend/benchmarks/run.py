@@ -0,0 +1,334 @@
+"""Benchmarks for the analysis pipeline.
+
+Run from backend/:
+
+    python -m benchmarks.run micro                       # each analyzer on its own
+    python -m benchmarks.run load -c 8 -n 200            # concurrent /analyze requests
+    python -m benchmarks.run all --output benchmarks/results/latest.json
+    python -m benchmarks.run all --save-baseline benchmarks/baseline.json
+    python -m benchmarks.run all --baseline benchmarks/baseline.json --tolerance 0.2
+
+Result caches are disabled and the LLM is stubbed (unless --real-llm), so repeated
+runs measure the same work and need no API key. The synthetic images and video
+contain no faces, so face detection is turned off (FACE_DETECTION=0) and the
+emotion classifier sees every image and frame; the setting is recorded in the
+report. A server benchmarked with --url keeps its own setting. With --baseline the run exits 1
+when any metric regresses by more than --tolerance. No baseline is checked in:
+numbers only compare on the same machine, so record one there first.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+import numpy as np
+
+MICRO_CASES = ("text", "image", "audio", "frames", "fusion")
+LOAD_KINDS = ("text", "image", "audio", "video")
+
+# Metrics compared against a baseline, and which direction is better.
+LOWER_IS_BETTER = ("p50_ms", "p95_ms", "p99_ms", "error_rate", "peak_rss_bytes")
+HIGHER_IS_BETTER = ("throughput_per_s",)
+
+
+def _configure_environment(real_llm):
+    # Must run before any models.* import: these are read at import time.
+    os.environ["RESULT_CACHE_SIZE"] = "0"
+    os.environ["RESULT_CACHE_DIR"] = ""
+    # With detection on, the faceless fixtures would stop at the detector and
+    # never reach the image model.
+    os.environ["FACE_DETECTION"] = "0"
+    if not real_llm:
+        os.environ["LLM_BACKEND"] = "stub"
+        os.environ.setdefault("LLM_STUB_LATENCY_MS", "50")
+
+
+def summarize(latencies, elapsed):
+    latencies_ms = np.asarray(latencies) * 1000.0
+    return {
+        "count": int(len(latencies_ms)),
+        "mean_ms": round(float(latencies_ms.mean()), 3),
+        "p50_ms": round(float(np.percentile(latencies_ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(latencies_ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(latencies_ms, 99)), 3),
+        "throughput_per_s": round(len(latencies_ms) / elapsed, 3) if elapsed > 0 else 0.0,
+    }
+
+
+class PeakRSS:
+    """Samples the resident set size in the background; ru_maxrss alone never resets."""
+
+    def __init__(self, interval=0.05):
+        from models.registry import current_rss
+        self._current_rss = current_rss
+        self.interval = interval
+        self.peak = current_rss() or 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, self._current_rss() or 0)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self._current_rss() or 0)
+        return False
+
+
+def _micro_cases(workdir):
+    from benchmarks import fixtures
+    from models.text_model import analyze_text_sentiment
+    from models.image_model import analyze_image_emotion
+    from models.open_ai_whisper import predict_emotion
+    from models.video_model import extract_frames
+    from models.combine_sentiment import combine_sentiment
+
+    texts = fixtures.TEXTS
+    images = fixtures.images(8)
+    clips = [fixtures.audio(5.0, seed=i) for i in range(4)]
+    video_path = fixtures.video(os.path.join(workdir, "bench.avi"))
+
+    rng = np.random.default_rng(0)
+    labels = ("angry", "disgust", "fear", "happy", "neutral", "sad", "surprise")
+    frame_predictions = [
+        [{"label": label, "score": float(p)} for label, p in zip(labels, rng.dirichlet(np.ones(len(labels))))]
+        for _ in range(300)
+    ]
+    text_prediction = {"label": "NEGATIVE", "score": 0.8, "scores": {"NEGATIVE": 0.8, "POSITIVE": 0.2}}
+    audio_prediction = {"label": "sad", "score": 0.6, "scores": {"sad": 0.6, "neutral": 0.3, "fearful": 0.1}}
+
+    return {
+        "text": (lambda i: analyze_text_sentiment(texts[i % len(texts)]), 30),
+        "image": (lambda i: analyze_image_emotion(images[i % len(images)]), 20),
+        "audio": (lambda i: predict_emotion(clips[i % len(clips)]), 5),
+        "frames": (lambda i: extract_frames(video_path), 10),
+        "fusion": (lambda i: combine_sentiment(text_prediction, frame_predictions, audio_prediction), 200),
+    }
+
+
+def run_micro(cases, iterations=None, warmup=2):
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        available = _micro_cases(workdir)
+        for name in cases:
+            fn, default_iterations = available[name]
+            for i in range(warmup):
+                # First calls load models and build caches; keep them out of the numbers.
+                fn(i)
+            count = iterations or default_iterations
+            latencies = []
+            with PeakRSS() as rss:
+                start = time.perf_counter()
+                for i in range(count):
+                    t0 = time.perf_counter()
+                    fn(i)
+                    latencies.append(time.perf_counter() - t0)
+                elapsed = time.perf_counter() - start
+            results[name] = {**summarize(latencies, elapsed), "peak_rss_bytes": rss.peak}
+            print(f"micro {name}: {results[name]}")
+    return results
+
+
+def _load_payloads(kinds, workdir):
+    from benchmarks import fixtures
+
+    image_files = [fixtures.image_bytes(image, "JPEG") for image in fixtures.images(4)]
+    audio_files = [fixtures.wav_bytes(fixtures.audio(5.0, seed=i)) for i in range(2)]
+    video_path = fixtures.video(os.path.join(workdir, "load.avi"))
+    with open(video_path, "rb") as f:
+        video_file = f.read()
+
+    payloads = []
+    for i, kind in enumerate(kinds):
+        data = {"text": fixtures.TEXTS[i % len(fixtures.TEXTS)]}
+        files = None
+        if kind == "image":
+            files = [("images", ("face.jpg", image_files[i % len(image_files)], "image/jpeg"))]
+        elif kind == "audio":
+            files = [("audio", ("voice.wav", audio_files[i % len(audio_files)], "audio/wav"))]
+        elif kind == "video":
+            files = [("video", ("clip.avi", video_file, "video/x-msvideo"))]
+        payloads.append((kind, data, files))
+    return payloads
+
+
+async def _load(url, kinds, concurrency, total, warmup):
+    import httpx
+
+    if url:
+        client = httpx.AsyncClient(base_url=url, timeout=600.0)
+    else:
+        from api import app
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=600.0)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        payloads = _load_payloads(kinds, workdir)
+        async with client:
+            async def send(index):
+                kind, data, files = payloads[index % len(payloads)]
+                # A fresh session per request so the per-session limit does not throttle the run.
+                data = {**data, "session_id": f"bench-{uuid.uuid4()}"}
+                t0 = time.perf_counter()
+                response = await client.post("/analyze", data=data, files=files)
+                latency = time.perf_counter() - t0
+                if response.status_code == 200 and response.json().get("partial"):
+                    # A stage timed out or failed: answered, but not with the full analysis.
+                    return kind, "partial", latency
+                return kind, response.status_code, latency
+
+            for i in range(warmup):
+                await send(i)
+
+            next_index = 0
+            outcomes = []
+
+            async def worker():
+                nonlocal next_index
+                while next_index < total:
+                    index = next_index
+                    next_index += 1
+                    outcomes.append(await send(index))
+
+            with PeakRSS() as rss:
+                start = time.perf_counter()
+                await asyncio.gather(*(worker() for _ in range(concurrency)))
+                elapsed = time.perf_counter() - start
+
+    ok = [latency for _, status, latency in outcomes if status == 200]
+    statuses = {}
+    for _, status, _ in outcomes:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+
+    result = {
+        **(summarize(ok, elapsed) if ok else {"count": 0, "throughput_per_s": 0.0}),
+        "concurrency": concurrency,
+        "requests": total,
+        "statuses": statuses,
+        "error_rate": round(1 - len(ok) / max(1, len(outcomes)), 4),
+        "peak_rss_bytes": rss.peak if not url else None,
+    }
+    per_kind = {}
+    for kind in dict.fromkeys(kinds):
+        latencies = [latency for k, status, latency in outcomes if k == kind and status == 200]
+        if latencies:
+            per_kind[kind] = summarize(latencies, elapsed)
+    result["by_kind"] = per_kind
+    return result
+
+
+def run_load(url=None, kinds=LOAD_KINDS, concurrency=8, total=100, warmup=4):
+    result = asyncio.run(_load(url, list(kinds), concurrency, total, warmup))
+    print(f"load: { {k: v for k, v in result.items() if k != 'by_kind'} }")
+    return result
+
+
+def _flatten(results):
+    flat = {}
+    for name, metrics in results.get("micro", {}).items():
+        for key, value in metrics.items():
+            flat[f"micro.{name}.{key}"] = value
+    for key, value in (results.get("load") or {}).items():
+        if not isinstance(value, dict):
+            flat[f"load.{key}"] = value
+    return flat
+
+
+def compare(results, baseline, tolerance):
+    """List (metric, baseline, current, change) for metrics worse than baseline by more than `tolerance`."""
+    current = _flatten(results)
+    reference = _flatten(baseline)
+    regressions = []
+    for key, base in reference.items():
+        value = current.get(key)
+        if not isinstance(base, (int, float)) or not isinstance(value, (int, float)):
+            continue
+        metric = key.rsplit(".", 1)[-1]
+        if metric in LOWER_IS_BETTER:
+            worse = value > base * (1 + tolerance) if base > 0 else value > 0
+            change = (value - base) / base if base else float("inf")
+        elif metric in HIGHER_IS_BETTER:
+            worse = value < base * (1 - tolerance)
+            change = (value - base) / base if base else 0.0
+        else:
+            continue
+        if worse:
+            regressions.append((key, base, value, change))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the analyzers and the /analyze endpoint.")
+    parser.add_argument("mode", choices=("micro", "load", "all"))
+    parser.add_argument("--cases", default=",".join(MICRO_CASES), help="micro benchmarks to run")
+    parser.add_argument("--iterations", type=int, default=None, help="override per-case iteration counts")
+    parser.add_argument("--url", default=None, help="benchmark a running server instead of the in-process app")
+    parser.add_argument("--kinds", default=",".join(LOAD_KINDS), help="request mix for the load test")
+    parser.add_argument("-c", "--concurrency", type=int, default=8)
+    parser.add_argument("-n", "--requests", type=int, default=100)
+    parser.add_argument("--real-llm", action="store_true", help="call the configured LLM instead of the stub")
+    parser.add_argument("--output", default=None, help="write results as JSON")
+    parser.add_argument("--baseline", default=None, help="compare against a saved results file")
+    parser.add_argument("--save-baseline", default=None, help="write these results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression")
+    args = parser.parse_args()
+
+    _configure_environment(args.real_llm)
+    from models.backends import INFERENCE_BACKEND
+    import torch
+
+    results = {
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "torch_threads": torch.get_num_threads(),
+            "inference_backend": INFERENCE_BACKEND,
+            "face_detection": "server setting" if args.url else "off",
+            "llm": "real" if args.real_llm else "stub",
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+    }
+    if args.mode in ("micro", "all"):
+        cases = [c.strip() for c in args.cases.split(",") if c.strip()]
+        unknown = set(cases) - set(MICRO_CASES)
+        if unknown:
+            parser.error(f"unknown cases: {', '.join(sorted(unknown))}")
+        results["micro"] = run_micro(cases, args.iterations)
+    if args.mode in ("load", "all"):
+        kinds = [k.strip() for k in args.kinds.split(",") if k.strip()]
+        results["load"] = run_load(args.url, kinds, args.concurrency, args.requests)
+    results["environment"]["max_rss_bytes"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            with open(path, "w") as f:
+                json.dump(results, f, indent=2)
+            print(f"Wrote {path}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for key, base, value, change in regressions:
+            print(f"REGRESSION {key}: {base} -> {value} ({change:+.0%})")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions beyond {args.tolerance:.0%} against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""Adaptive frame sampling for facial emotion in videos without audio.
+
+Instead of classifying a frame every second, a few frames spread over the whole
+video are classified first. Between neighbouring samples whose predicted
+emotion differs, or where a face appears or disappears, the midpoint is
+classified next, widest gaps first. Sampling stops when:
+
+- "converged": the fused distribution of the classified frames moved less
+  than VIDEO_ADAPTIVE_TOLERANCE (largest per-emotion change) in a round,
+- "refined": no gap with a change is wider than VIDEO_ADAPTIVE_MIN_GAP_S,
+- "frame_budget": VIDEO_ADAPTIVE_MAX_FRAMES frames were evaluated, or
+- "time_budget": VIDEO_ADAPTIVE_TIME_BUDGET_S passed (0 disables it).
+
+A video whose expression never changes therefore costs the coarse pass only.
+"""
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from PIL import Image
+
+from models.batching import env_float, env_int
+from models.combine_sentiment import EMOTIONS, fuse, to_distribution
+from models.face_detector import FACE_DETECTION, detect_faces, crop_face
+from models.image_model import image_batcher
+from models.video_model import FrameReader, VIDEO_MAX_FRAMES
+
+VIDEO_ADAPTIVE_COARSE_FRAMES = env_int("VIDEO_ADAPTIVE_COARSE_FRAMES", 8)
+VIDEO_ADAPTIVE_MAX_FRAMES = env_int("VIDEO_ADAPTIVE_MAX_FRAMES", VIDEO_MAX_FRAMES)
+VIDEO_ADAPTIVE_TOLERANCE = env_float("VIDEO_ADAPTIVE_TOLERANCE", 0.05)
+VIDEO_ADAPTIVE_MIN_GAP_S = env_float("VIDEO_ADAPTIVE_MIN_GAP_S", 1.0)
+VIDEO_ADAPTIVE_TIME_BUDGET_S = env_float("VIDEO_ADAPTIVE_TIME_BUDGET_S", 0.0)
+
+ADAPTIVE_VERSION = (
+    f"adaptive:{VIDEO_ADAPTIVE_COARSE_FRAMES}:{VIDEO_ADAPTIVE_MAX_FRAMES}:"
+    f"{VIDEO_ADAPTIVE_TOLERANCE}:{VIDEO_ADAPTIVE_MIN_GAP_S}"
+)
+
+
+def _classify_frames(reader: FrameReader, indices: List[int]) -> Dict[int, Optional[Any]]:
+    # Frames of one round are queued together so they share batched forward passes.
+    # A frame that cannot be read or has no face maps to None. Like uniform
+    # sampling, only the largest face of a frame is classified.
+    results = {}
+    pending = {}
+    for index in sorted(indices):
+        frame = reader.read(index)
+        if frame is None:
+            results[index] = None
+            continue
+        if FACE_DETECTION:
+            boxes = detect_faces(frame)
+            if not boxes:
+                results[index] = None
+                continue
+            frame = crop_face(frame, boxes[0])
+        pending[index] = image_batcher.submit(Image.fromarray(frame))
+
+    for index, future in pending.items():
+        try:
+            results[index] = future.result()
+        except Exception as e:
+            print(f"Error in image emotion analysis: {e}")
+            results[index] = {"error": str(e), "emotion": "unknown"}
+    return results
+
+
+def _label(result) -> Optional[str]:
+    distribution = to_distribution(result) if result is not None else None
+    return EMOTIONS[int(np.argmax(distribution))] if distribution is not None else None
+
+
+def _fused(results: Dict[int, Optional[Any]]) -> Optional[np.ndarray]:
+    # The same fusion combine_sentiment applies to the frames, so convergence is
+    # judged on what the response will report.
+    rows = [d for d in (to_distribution(r) for r in results.values() if r is not None) if d is not None]
+    fused = fuse(np.vstack(rows)) if rows else None
+    return fused["distribution"] if fused else None
+
+
+def analyze_video_adaptive(video_path) -> Optional[Dict[str, Any]]:
+    """Facial emotion of a video from adaptively chosen frames.
+
+    Returns {"image_sentiments": [...], "sampling": {...}} with the results in
+    time order and how many frames were evaluated, or None when the frame count
+    is unknown and the caller should sample uniformly instead.
+    """
+    start = time.perf_counter()
+    with FrameReader(video_path) as reader:
+        total = reader.frame_count
+        if total <= 0:
+            return None
+        min_gap = max(1, int(round(VIDEO_ADAPTIVE_MIN_GAP_S * reader.fps)))
+        budget = max(1, VIDEO_ADAPTIVE_MAX_FRAMES)
+        per_round = max(1, min(budget, VIDEO_ADAPTIVE_COARSE_FRAMES, -(-total // min_gap)))
+
+        coarse = sorted({int(i) for i in np.linspace(0, total - 1, per_round).round()})
+        results = _classify_frames(reader, coarse)
+        labels = {index: _label(result) for index, result in results.items()}
+        previous = _fused(results)
+        rounds = 1
+        stop_reason = None
+
+        while stop_reason is None:
+            if len(results) >= budget:
+                stop_reason = "frame_budget"
+                break
+            if VIDEO_ADAPTIVE_TIME_BUDGET_S and time.perf_counter() - start >= VIDEO_ADAPTIVE_TIME_BUDGET_S:
+                stop_reason = "time_budget"
+                break
+
+            evaluated = sorted(results)
+            gaps = sorted(
+                ((b - a, a, b) for a, b in zip(evaluated, evaluated[1:]) if b - a > min_gap and labels[a] != labels[b]),
+                reverse=True,
+            )
+            if not gaps:
+                stop_reason = "refined"
+                break
+
+            midpoints = [(a + b) // 2 for _, a, b in gaps[:min(per_round, budget - len(results))]]
+            round_results = _classify_frames(reader, midpoints)
+            results.update(round_results)
+            labels.update((index, _label(result)) for index, result in round_results.items())
+            rounds += 1
+
+            current = _fused(results)
+            if previous is not None and current is not None and np.abs(current - previous).max() < VIDEO_ADAPTIVE_TOLERANCE:
+                stop_reason = "converged"
+            previous = current
+
+        fps = reader.fps
+
+    ordered = sorted(results)
+    sampling = {
+        "strategy": "adaptive",
+        "frames_evaluated": len(results),
+        "frames_classified": sum(1 for index in ordered if results[index] is not None),
+        "frames_total": total,
+        "duration_s": round(total / fps, 2),
+        "rounds": rounds,
+        "stop_reason": stop_reason,
+        "elapsed_ms": round((time.perf_counter() - start) * 1000.0, 1),
+        "timeline": [{"time_s": round(index / fps, 2), "label": labels[index]} for index in ordered],
+    }
+    print(f"Adaptive video sampling: {len(results)} of {total} frames evaluated in {rounds} rounds ({stop_reason})")
+    return {
+        "image_sentiments": [results[index] for index in ordered if results[index] is not None],
+        "sampling": sampling,
+    }
@@ -0,0 +1,171 @@
+"""Local phrasings for the templated assessment turns.
+
+With ASSESSMENT_FAST_PATH=1 the intro and the next-question turns of the
+assessment are answered from this bank instead of asking Gemini to rephrase a
+fixed question; the final summary and regular chat still go to the LLM. The
+variant is chosen by the detected mood and, deterministically, by the session
+and question, so a session sees the same wording on a retry.
+
+The built-in bank wraps each question in a short mood-matched opener. A bank
+pre-generated with the LLM can be loaded from ASSESSMENT_BANK_PATH:
+
+    python -m models.assessment_bank -o assessment_bank.json --variants 3
+
+    {"questions": {"0": {"negative": ["...", ...], "neutral": [...], "positive": [...]}, ...}}
+
+Questions or moods missing from the file fall back to the built-in phrasings.
+"""
+import argparse
+import functools
+import hashlib
+import json
+import os
+from typing import Any, Dict, List, Optional
+
+ASSESSMENT_FAST_PATH = os.getenv("ASSESSMENT_FAST_PATH", "0").lower() in ("1", "true", "yes")
+ASSESSMENT_BANK_PATH = os.getenv("ASSESSMENT_BANK_PATH") or None
+
+MOODS = ("negative", "neutral", "positive")
+# Fused emotion labels (see combine_sentiment.EMOTIONS) to the mood a phrasing is picked for.
+EMOTION_MOODS = {
+    "happy": "positive",
+    "surprise": "positive",
+    "neutral": "neutral",
+    "sad": "negative",
+    "angry": "negative",
+    "fear": "negative",
+    "disgust": "negative",
+}
+
+INTRO_OPENERS = {
+    "negative": [
+        "Hi, I'm MindScope. I'm sorry things feel heavy right now, and I'm glad you reached out.",
+        "Hello, I'm MindScope. It sounds like this might be a hard time, so let's take it one step at a time.",
+    ],
+    "neutral": [
+        "Hi, I'm MindScope. I'd like to ask you a few short questions about how you've been.",
+        "Hello, I'm MindScope. Let's start with a few questions to understand how you're doing.",
+    ],
+    "positive": [
+        "Hi, I'm MindScope. It's good to hear from you; let's check in on how things have been.",
+        "Hello, I'm MindScope. Glad you're here, let's go through a few quick questions together.",
+    ],
+}
+
+QUESTION_OPENERS = {
+    "negative": [
+        "Thank you for sharing that; it sounds like it's been difficult.",
+        "I hear you, and I appreciate you being open with me.",
+        "That sounds hard. Take your time with the next one.",
+    ],
+    "neutral": [
+        "Thank you for sharing.",
+        "Thanks, that's helpful to know.",
+        "I appreciate you telling me that.",
+    ],
+    "positive": [
+        "That's good to hear.",
+        "Thanks, I'm glad some things are going well.",
+        "It's great that you noticed that.",
+    ],
+}
+
+
+def mood_of(sentiment_data: Optional[Dict[str, Any]]) -> str:
+    label = str((sentiment_data or {}).get("final_sentiment", "neutral")).lower()
+    return EMOTION_MOODS.get(label, label if label in MOODS else "neutral")
+
+
+def _pick(options: List[str], *key) -> str:
+    digest = hashlib.sha1(":".join(str(k) for k in key).encode("utf-8")).digest()
+    return options[int.from_bytes(digest[:4], "big") % len(options)]
+
+
+@functools.lru_cache(maxsize=None)
+def load_bank(path: Optional[str] = ASSESSMENT_BANK_PATH) -> Dict[int, Dict[str, List[str]]]:
+    """Pre-generated phrasings from `path` as {question index: {mood: [phrasing, ...]}}."""
+    if not path:
+        return {}
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Could not load assessment bank {path}: {e}")
+        return {}
+    bank = {}
+    for index, moods in (data.get("questions") or {}).items():
+        bank[int(index)] = {mood: [p for p in phrasings if p] for mood, phrasings in moods.items() if phrasings}
+    print(f"Loaded assessment bank {path}: {len(bank)} questions")
+    return bank
+
+
+def phrase_question(questions: List[str], index: int, sentiment_data=None, session_id=None, intro=False) -> str:
+    """Question `index`, phrased for the detected mood."""
+    mood = mood_of(sentiment_data)
+    phrasings = load_bank().get(index, {}).get(mood)
+    if phrasings:
+        return _pick(phrasings, session_id, index, mood)
+    openers = INTRO_OPENERS if intro else QUESTION_OPENERS
+    return f"{_pick(openers[mood], session_id, index, mood)} {questions[index]}"
+
+
+def fast_path_reply(questions: List[str], assessment_state, sentiment_data=None, session_id=None) -> Optional[str]:
+    """Local reply for a templated assessment turn, or None when the turn needs the LLM.
+
+    The turn is classified the same way create_mental_health_prompt does it.
+    """
+    if not ASSESSMENT_FAST_PATH or not assessment_state or not assessment_state.get("is_assessment_mode"):
+        return None
+    if assessment_state["is_first_interaction"]:
+        return phrase_question(questions, 0, sentiment_data, session_id, intro=True)
+    if not assessment_state["assessment_complete"]:
+        return phrase_question(questions, assessment_state["current_question_index"], sentiment_data, session_id)
+    return None
+
+
+GENERATION_PROMPT = """
+Rephrase this mental health check-in question for a user whose current mood appears {mood}.
+{intro}Acknowledge their mood briefly and warmly, then ask the question. One or two sentences.
+Reply with the phrasing only.
+
+QUESTION: {question}
+"""
+
+
+def generate_bank(questions: List[str], variants: int = 3) -> Dict[str, Any]:
+    """Ask the LLM for `variants` phrasings of every question and mood."""
+    from models.multimodal import get_llm_client
+
+    client = get_llm_client()
+    bank = {}
+    for index, question in enumerate(questions):
+        intro = "This is the first question; briefly introduce yourself as MindScope first.\n" if index == 0 else ""
+        bank[str(index)] = {}
+        for mood in MOODS:
+            prompt = GENERATION_PROMPT.format(mood=mood, intro=intro, question=question)
+            phrasings = []
+            for _ in range(variants):
+                text = client.generate(prompt).text.strip()
+                if text and text not in phrasings:
+                    phrasings.append(text)
+            bank[str(index)][mood] = phrasings
+            print(f"Question {index + 1}/{len(questions)} ({mood}): {len(phrasings)} phrasings")
+    return {"questions": bank}
+
+
+def main():
+    from models.multimodal import MENTAL_HEALTH_QUESTIONS
+
+    parser = argparse.ArgumentParser(description="Pre-generate the assessment phrasing bank with the LLM.")
+    parser.add_argument("-o", "--output", required=True, help="JSON file to write; point ASSESSMENT_BANK_PATH at it")
+    parser.add_argument("--variants", type=int, default=3, help="phrasings per question and mood")
+    args = parser.parse_args()
+
+    bank = generate_bank(MENTAL_HEALTH_QUESTIONS, variants=args.variants)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(bank, f, indent=2, ensure_ascii=False)
+    print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+import argparse
+import os
+import re
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import torch
+import transformers
+from transformers import (
+    AutoConfig,
+    AutoModelForAudioClassification,
+    AutoModelForImageClassification,
+    AutoModelForSequenceClassification,
+)
+
+# "torch" (eager fp32), "quantized" (dynamic int8 Linear layers) or "onnx" (ONNX Runtime via optimum).
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "torch").lower()
+MODEL_CACHE_DIR = os.getenv("MODEL_CACHE_DIR", os.path.join(os.path.dirname(os.path.dirname(__file__)), "model_cache"))
+
+BACKENDS = ("torch", "quantized", "onnx")
+
+_threads_configured_pid = None
+
+
+def configure_torch_threads() -> None:
+    """Apply TORCH_INTRA_OP_THREADS / TORCH_INTER_OP_THREADS once per process."""
+    global _threads_configured_pid
+    if _threads_configured_pid == os.getpid():
+        return
+    _threads_configured_pid = os.getpid()
+
+    intra = os.getenv("TORCH_INTRA_OP_THREADS")
+    inter = os.getenv("TORCH_INTER_OP_THREADS")
+    if intra:
+        torch.set_num_threads(int(intra))
+    if inter:
+        try:
+            torch.set_num_interop_threads(int(inter))
+        except RuntimeError as e:
+            # Only allowed before the first inter-op parallel work in this process.
+            print(f"Could not set inter-op threads: {e}")
+
+
+_TORCH_CLASSES = {
+    "text-classification": AutoModelForSequenceClassification,
+    "image-classification": AutoModelForImageClassification,
+    "audio-classification": AutoModelForAudioClassification,
+}
+
+_ORT_CLASSES = {
+    "text-classification": "ORTModelForSequenceClassification",
+    "image-classification": "ORTModelForImageClassification",
+    "audio-classification": "ORTModelForAudioClassification",
+}
+
+
+def _cache_path(model_id: str, backend: str) -> str:
+    return os.path.join(MODEL_CACHE_DIR, re.sub(r"[^A-Za-z0-9_.-]", "--", model_id), backend)
+
+
+def _load_torch(model_id: str, task: str):
+    return _TORCH_CLASSES[task].from_pretrained(model_id).eval()
+
+
+def _quantize(model):
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def _load_quantized(model_id: str, task: str):
+    # Only the int8 state dict is cached, never a pickled module, and it is read
+    # with weights_only=True. It is keyed by the model revision and the torch and
+    # transformers versions, so an update of either re-quantizes from scratch.
+    config = AutoConfig.from_pretrained(model_id)
+    revision = getattr(config, "_commit_hash", None) or "local"
+    path = os.path.join(
+        _cache_path(model_id, "quantized"),
+        f"{revision}-torch{torch.__version__}-transformers{transformers.__version__}.pt",
+    )
+    if os.path.exists(path):
+        try:
+            # The fp32 weights are not needed: quantize the bare architecture and fill it in.
+            model = _quantize(_TORCH_CLASSES[task].from_config(config))
+            model.load_state_dict(torch.load(path, weights_only=True))
+            return model.eval()
+        except Exception as e:
+            print(f"Cached int8 weights for {model_id} unusable ({e}); quantizing again")
+
+    model = _quantize(_load_torch(model_id, task))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    torch.save(model.state_dict(), path)
+    print(f"Cached int8 weights for {model_id} at {path}")
+    return model.eval()
+
+
+def _load_onnx(model_id: str, task: str):
+    try:
+        import optimum.onnxruntime as ort
+    except ImportError as e:
+        raise RuntimeError("The onnx backend needs optimum[onnxruntime]: pip install optimum[onnxruntime]") from e
+
+    model_class = getattr(ort, _ORT_CLASSES[task])
+    path = _cache_path(model_id, "onnx")
+    if os.path.exists(os.path.join(path, "config.json")):
+        return model_class.from_pretrained(path)
+
+    model = model_class.from_pretrained(model_id, export=True)
+    model.save_pretrained(path)
+    print(f"Exported {model_id} to ONNX at {path}")
+    return model
+
+
+_LOADERS = {"torch": _load_torch, "quantized": _load_quantized, "onnx": _load_onnx}
+
+
+def load_model(model_id: str, task: str, backend: Optional[str] = None):
+    """Load `model_id` for `task` through the configured inference backend.
+
+    Converted artifacts are cached under MODEL_CACHE_DIR. If the requested
+    backend cannot handle a model, fall back to plain torch rather than fail.
+    """
+    backend = (backend or INFERENCE_BACKEND).lower()
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown inference backend: {backend}")
+    configure_torch_threads()
+
+    try:
+        model = _LOADERS[backend](model_id, task)
+        model.inference_backend = backend
+        return model
+    except Exception as e:
+        if backend == "torch":
+            raise
+        print(f"Backend '{backend}' unavailable for {model_id} ({e}); falling back to torch")
+        model = _load_torch(model_id, task)
+        model.inference_backend = "torch"
+        return model
+
+
+def model_backend(model: Any) -> str:
+    return getattr(getattr(model, "model", model), "inference_backend", "torch")
+
+
+def resolved_backend(name: str) -> str:
+    """Backend the registry's model `name` runs on, for result cache keys.
+
+    The configured backend until the model is loaded, then the one actually in
+    use, since load_model may have fallen back to torch.
+    """
+    from models.registry import registry
+    if registry.is_loaded(name):
+        return model_backend(registry.get(name))
+    return INFERENCE_BACKEND
+
+
+def _probabilities(model, inputs: Dict[str, Any]) -> np.ndarray:
+    with torch.no_grad():
+        logits = model(**inputs).logits
+    if not isinstance(logits, torch.Tensor):
+        logits = torch.from_numpy(np.asarray(logits))
+    return torch.softmax(logits.float(), dim=-1).cpu().numpy()
+
+
+def check_parity(model_id: str, task: str, inputs: Dict[str, Any], backend: Optional[str] = None) -> Dict[str, Any]:
+    """Compare softmax outputs of `backend` against the eager torch model on the same inputs."""
+    backend = backend or INFERENCE_BACKEND
+    reference = _probabilities(_load_torch(model_id, task), inputs)
+    candidate_model = load_model(model_id, task, backend)
+    candidate = _probabilities(candidate_model, inputs)
+
+    return {
+        "model": model_id,
+        "backend": model_backend(candidate_model),
+        "samples": int(reference.shape[0]),
+        "max_abs_diff": float(np.max(np.abs(reference - candidate))),
+        "mean_abs_diff": float(np.mean(np.abs(reference - candidate))),
+        "top1_agreement": float(np.mean(reference.argmax(-1) == candidate.argmax(-1))),
+    }
+
+
+def _parity_inputs(name: str, images: List[str], audio: List[str]) -> Dict[str, Any]:
+    if name == "text":
+        from transformers import AutoTokenizer
+        from models.text_model import TEXT_MODEL_ID
+        samples = [
+            "I feel great today and everything is going well.",
+            "I can't sleep and I'm worried all the time.",
+            "It was an ordinary day.",
+            "Nothing I do seems to matter anymore.",
+        ]
+        tokenizer = AutoTokenizer.from_pretrained(TEXT_MODEL_ID)
+        return tokenizer(samples, padding=True, truncation=True, return_tensors="pt")
+
+    if name == "image":
+        from PIL import Image
+        from transformers import AutoImageProcessor
+        from models.image_model import IMAGE_MODEL_ID
+        if images:
+            samples = [Image.open(path).convert("RGB") for path in images]
+        else:
+            rng = np.random.default_rng(0)
+            samples = [Image.fromarray(rng.integers(0, 255, (224, 224, 3), dtype=np.uint8)) for _ in range(4)]
+        return AutoImageProcessor.from_pretrained(IMAGE_MODEL_ID)(samples, return_tensors="pt")
+
+    if name == "audio":
+        from transformers import AutoFeatureExtractor
+        from models.open_ai_whisper import model_id as AUDIO_MODEL_ID, AUDIO_SAMPLING_RATE, load_audio_array
+        if audio:
+            samples = [load_audio_array(path)[: 30 * AUDIO_SAMPLING_RATE] for path in audio]
+        else:
+            t = np.arange(3 * AUDIO_SAMPLING_RATE) / AUDIO_SAMPLING_RATE
+            samples = [(0.1 * np.sin(2 * np.pi * f * t)).astype(np.float32) for f in (220, 440)]
+        feature_extractor = AutoFeatureExtractor.from_pretrained(AUDIO_MODEL_ID, do_normalize=True)
+        return feature_extractor(samples, sampling_rate=AUDIO_SAMPLING_RATE, return_tensors="pt")
+
+    raise ValueError(f"Unknown model: {name}")
+
+
+def main():
+    from models.text_model import TEXT_MODEL_ID
+    from models.image_model import IMAGE_MODEL_ID
+    from models.open_ai_whisper import model_id as AUDIO_MODEL_ID
+
+    models = {
+        "text": (TEXT_MODEL_ID, "text-classification"),
+        "image": (IMAGE_MODEL_ID, "image-classification"),
+        "audio": (AUDIO_MODEL_ID, "audio-classification"),
+    }
+
+    parser = argparse.ArgumentParser(description="Convert emotion models and check accuracy parity against PyTorch.")
+    parser.add_argument("models", nargs="*", default=list(models), choices=list(models))
+    parser.add_argument("--backend", default=INFERENCE_BACKEND, choices=BACKENDS)
+    parser.add_argument("--images", nargs="*", default=[], help="image files to use as parity samples")
+    parser.add_argument("--audio", nargs="*", default=[], help="audio files to use as parity samples")
+    parser.add_argument("--max-diff", type=float, default=0.05, help="fail if any probability differs by more than this")
+    args = parser.parse_args()
+
+    failed = False
+    for name in args.models:
+        model_id, task = models[name]
+        report = check_parity(model_id, task, _parity_inputs(name, args.images, args.audio), args.backend)
+        ok = report["max_abs_diff"] <= args.max_diff and report["top1_agreement"] == 1.0
+        failed = failed or not ok
+        print(f"{name}: {'OK' if ok else 'DRIFT'} {report}")
+
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Sequence
+
+from models.metrics import metrics
+
+batch_seconds = metrics.histogram("model_batch_seconds", "Wall time of one batched model call.")
+
+
+def env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+class MicroBatcher:
+    """Collects items from concurrent callers and runs them through `batch_fn` together.
+
+    A batch is dispatched as soon as `max_batch_size` items are waiting, or
+    `max_wait_ms` after the first item of the batch arrived. `batch_fn` receives
+    a list of items and must return one result per item, in order.
+    """
+
+    def __init__(self, name: str, batch_fn: Callable[[List[Any]], Sequence[Any]],
+                 max_batch_size: int = 8, max_wait_ms: float = 10.0):
+        self.name = name
+        self.batch_fn = batch_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self._queue: "queue.Queue[tuple]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._batches = 0
+        self._items = 0
+        self._errors = 0
+        self._histogram: Dict[int, int] = {}
+
+    def _ensure_worker(self) -> None:
+        # Threads do not survive fork(), so a forked worker starts its own.
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            if self._pid != os.getpid():
+                self._queue = queue.Queue()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name=f"batcher-{self.name}", daemon=True)
+            self._thread.start()
+
+    def submit(self, item: Any) -> Future:
+        self._ensure_worker()
+        future: Future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def submit_many(self, items: Sequence[Any]) -> List[Future]:
+        return [self.submit(item) for item in items]
+
+    def __call__(self, item: Any) -> Any:
+        return self.submit(item).result()
+
+    def map(self, items: Sequence[Any]) -> List[Any]:
+        return [f.result() for f in self.submit_many(items)]
+
+    def _collect(self) -> List[tuple]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._collect()
+            items = [item for item, _ in batch]
+            futures = [future for _, future in batch]
+            start = time.perf_counter()
+            try:
+                results = self.batch_fn(items)
+                if len(results) != len(items):
+                    raise RuntimeError(f"{self.name} batch returned {len(results)} results for {len(items)} items")
+            except Exception as e:
+                self._errors += 1
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+            else:
+                for future, result in zip(futures, results):
+                    if not future.done():
+                        future.set_result(result)
+            batch_seconds.observe(time.perf_counter() - start, model=self.name)
+            self._record(len(items))
+
+    def _record(self, size: int) -> None:
+        bucket = 1
+        while bucket < size:
+            bucket *= 2
+        with self._lock:
+            self._batches += 1
+            self._items += size
+            self._histogram[bucket] = self._histogram.get(bucket, 0) + 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "queue_depth": self._queue.qsize(),
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000.0,
+                "batches": self._batches,
+                "items": self._items,
+                "errors": self._errors,
+                "mean_batch_size": (self._items / self._batches) if self._batches else 0.0,
+                "batch_size_histogram": {f"le_{k}": v for k, v in sorted(self._histogram.items())},
+            }
+
+
+batchers: Dict[str, MicroBatcher] = {}
+
+
+def create_batcher(name: str, batch_fn: Callable[[List[Any]], Sequence[Any]]) -> MicroBatcher:
+    """Build a batcher configured from <NAME>_BATCH_MAX_SIZE / <NAME>_BATCH_MAX_WAIT_MS,
+    falling back to BATCH_MAX_SIZE / BATCH_MAX_WAIT_MS."""
+    prefix = name.upper()
+    max_size = env_int(f"{prefix}_BATCH_MAX_SIZE", env_int("BATCH_MAX_SIZE", 8))
+    max_wait = env_float(f"{prefix}_BATCH_MAX_WAIT_MS", env_float("BATCH_MAX_WAIT_MS", 10.0))
+    batcher = MicroBatcher(name, batch_fn, max_batch_size=max_size, max_wait_ms=max_wait)
+    batchers[name] = batcher
+    return batcher
+
+
+def batching_stats() -> Dict[str, Any]:
+    return {name: b.stats() for name, b in batchers.items()}
@@ -0,0 +1,285 @@
+"""Bulk re-scoring of JSONL manifests through the sentiment analyzers.
+
+Each manifest line is one item:
+
+    {"id": "chat-42", "text": "...", "images": ["a.jpg"], "audio": "a.wav", "video": "v.mp4"}
+    {"id": "chat-43", "messages": [{"role": "user", "text": "..."}, {"role": "ai", "text": "..."}]}
+    {"request_id": "user-001", "title": "...", "body": "..."}
+
+"messages" is an exported Chat document; each user message is scored and the
+conversation is fused as a whole. `id` falls back to `_id`, `request_id`, then
+the line number. Results are appended to the output as JSONL as they finish, so
+an interrupted run resumes where it stopped:
+
+    python -m models.bulk manifest.jsonl -o results.jsonl --workers 4 [--llm]
+"""
+import argparse
+import asyncio
+import functools
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncContextManager, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from models.batching import env_int
+from models.executors import AdmissionRejected
+
+# Items analysed at once per process; concurrent items are what fill the model batches.
+BULK_CHUNK_SIZE = env_int("BULK_CHUNK_SIZE", 16)
+# Directory the /analyze/batch endpoint may read media from; unset means text only.
+BULK_MEDIA_ROOT = os.getenv("BULK_MEDIA_ROOT") or None
+
+
+def read_manifest(lines: Iterable[str]) -> Iterator[Tuple[int, Any]]:
+    """Yield (line number, item) for each non-blank line; unparsable lines yield the error message."""
+    for line_no, line in enumerate(lines, start=1):
+        if isinstance(line, bytes):
+            line = line.decode("utf-8")
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            item = json.loads(line)
+            if not isinstance(item, dict):
+                raise ValueError("manifest line is not a JSON object")
+            yield line_no, item
+        except ValueError as e:
+            yield line_no, f"Invalid manifest line: {e}"
+
+
+def item_id(item: Any, line_no: int) -> str:
+    if isinstance(item, dict):
+        for field in ("id", "_id", "request_id"):
+            if item.get(field) is not None:
+                return str(item[field])
+    return f"line-{line_no}"
+
+
+def _as_list(value: Any) -> List[Any]:
+    if not value:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def _check_media(path: str, media_root: Optional[str]) -> str:
+    # Manifests sent over HTTP may only name files under media_root, so they cannot
+    # read arbitrary server files. The CLI trusts its manifest.
+    resolved = os.path.realpath(os.path.join(media_root, path))
+    if os.path.commonpath([resolved, os.path.realpath(media_root)]) != os.path.realpath(media_root):
+        raise ValueError(f"Media path outside the allowed directory: {path}")
+    return resolved
+
+
+def analyze_item(item: Dict[str, Any], llm: bool = False, restrict_media: bool = False,
+                 media_root: Optional[str] = None) -> Dict[str, Any]:
+    """Sentiment analysis of one manifest item, without sessions; the LLM reply is optional."""
+    from models.multimodal import (
+        plan_stages, merge_stage_results, get_input_sources, run_stages, STAGE_TIMEOUTS,
+        build_regular_chat_prompt, get_llm_client,
+    )
+    from models.text_model import analyze_text_sentiments
+
+    text = item.get("text") or item.get("body")
+    messages = [m.get("text", "") for m in _as_list(item.get("messages")) if isinstance(m, dict) and m.get("role") == "user"]
+    images = _as_list(item.get("images") or item.get("image"))
+    audio = item.get("audio")
+    video = item.get("video")
+
+    if restrict_media and (images or audio or video):
+        if not media_root:
+            raise ValueError("Media items are disabled; set BULK_MEDIA_ROOT to allow them")
+        images = [_check_media(path, media_root) for path in images]
+        audio = _check_media(audio, media_root) if audio else None
+        video = _check_media(video, media_root) if video else None
+
+    texts = ([text] if text else []) + [m for m in messages if m]
+    stages = plan_stages(None, images or None, audio, video)
+    if texts:
+        stages["text"] = functools.partial(analyze_text_sentiments, texts)
+
+    input_sources = get_input_sources(texts or None, images or None, audio, video)
+    analysis = merge_stage_results(input_sources, run_stages(stages, STAGE_TIMEOUTS))
+    text_results = analysis.pop("text_sentiment") or []
+
+    result = {
+        **analysis,
+        "text_sentiment": text_results[0] if text and text_results else None,
+        "message_sentiments": text_results[1:] if text else text_results,
+    }
+    if not messages:
+        result.pop("message_sentiments")
+
+    if llm:
+        user_input = text or (messages[-1] if messages else None)
+        prompt = build_regular_chat_prompt(user_input, analysis["combined_sentiment"], input_sources)
+        try:
+            result["llm_response"] = get_llm_client().generate(prompt).text
+        except Exception as e:
+            result["llm_response"] = None
+            result["llm_error"] = str(e)
+    return result
+
+
+def _process(entry: Tuple[int, Any], llm: bool, restrict_media: bool, media_root: Optional[str]) -> Dict[str, Any]:
+    line_no, item = entry
+    record = {"id": item_id(item, line_no), "line": line_no}
+    if isinstance(item, str):
+        return {**record, "error": item}
+    start = time.perf_counter()
+    try:
+        record.update(analyze_item(item, llm=llm, restrict_media=restrict_media, media_root=media_root))
+    except Exception as e:
+        record["error"] = str(e)
+    record["elapsed_ms"] = round((time.perf_counter() - start) * 1000.0, 1)
+    return record
+
+
+def process_chunk(entries: List[Tuple[int, Any]], llm: bool = False) -> List[Dict[str, Any]]:
+    """Analyse a chunk of manifest entries concurrently in this process (pool worker entry point)."""
+    with ThreadPoolExecutor(max_workers=max(1, len(entries)), thread_name_prefix="bulk") as pool:
+        return list(pool.map(functools.partial(_process, llm=llm, restrict_media=False, media_root=None), entries))
+
+
+async def _process_admitted(process, entry: Tuple[int, Any], admit: Optional[Callable[[], AsyncContextManager]]):
+    if admit is None:
+        return await asyncio.to_thread(process, entry)
+    try:
+        async with admit():
+            return await asyncio.to_thread(process, entry)
+    except AdmissionRejected as e:
+        line_no, item = entry
+        return {"id": item_id(item, line_no), "line": line_no, "error": e.detail}
+
+
+async def iter_bulk_async(lines: Iterable[str], llm: bool = False, concurrency: int = BULK_CHUNK_SIZE,
+                          media_root: Optional[str] = BULK_MEDIA_ROOT,
+                          admit: Optional[Callable[[], AsyncContextManager]] = None):
+    """Analyse manifest lines with up to `concurrency` items in flight, yielding
+    records in completion order. Media must live under `media_root`.
+
+    With `admit`, every item runs inside the context it returns (an admission
+    slot); an item whose slot is rejected is recorded as an error.
+    """
+    process = functools.partial(_process, llm=llm, restrict_media=True, media_root=media_root)
+    pending = set()
+    try:
+        for entry in read_manifest(lines):
+            if len(pending) >= concurrency:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield task.result()
+            pending.add(asyncio.ensure_future(_process_admitted(process, entry, admit)))
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+def completed_ids(output_path: str) -> Set[str]:
+    """Ids already written to `output_path` without an error, so a resumed run
+    retries failed items. A line cut off by an interruption is removed."""
+    if not os.path.exists(output_path):
+        return set()
+    with open(output_path, "rb+") as f:
+        data = f.read()
+        if data and not data.endswith(b"\n"):
+            f.truncate(data.rfind(b"\n") + 1)
+            data = data[:data.rfind(b"\n") + 1]
+    done = set()
+    for line in data.splitlines():
+        try:
+            record = json.loads(line)
+            if "error" not in record:
+                done.add(str(record["id"]))
+        except (ValueError, KeyError, TypeError):
+            continue
+    return done
+
+
+def _chunks(entries: Iterable[Tuple[int, Any]], size: int) -> Iterator[List[Tuple[int, Any]]]:
+    chunk = []
+    for entry in entries:
+        chunk.append(entry)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def run_bulk(manifest_path: str, output_path: str, workers: int = 1, chunk_size: int = BULK_CHUNK_SIZE,
+             llm: bool = False, resume: bool = True, preload: Optional[List[str]] = None) -> Dict[str, int]:
+    """Score every manifest item not already in `output_path`, appending results as chunks finish."""
+    done = completed_ids(output_path) if resume else set()
+    if not resume and os.path.exists(output_path):
+        os.remove(output_path)
+
+    if preload:
+        # Loaded before forking, the weights are shared copy-on-write by every worker.
+        from models.registry import registry
+        registry.preload(preload, background=False)
+
+    counts = {"skipped": 0, "written": 0, "errors": 0}
+
+    def pending():
+        with open(manifest_path, encoding="utf-8") as f:
+            for line_no, item in read_manifest(f):
+                if item_id(item, line_no) in done:
+                    counts["skipped"] += 1
+                    continue
+                yield line_no, item
+
+    worker = functools.partial(process_chunk, llm=llm)
+    start = time.perf_counter()
+    with open(output_path, "a", encoding="utf-8") as out:
+        if workers > 1:
+            context = multiprocessing.get_context("fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn")
+            with context.Pool(workers) as pool:
+                for records in pool.imap_unordered(worker, _chunks(pending(), chunk_size)):
+                    _write(out, records, counts)
+        else:
+            for chunk in _chunks(pending(), chunk_size):
+                _write(out, worker(chunk), counts)
+
+    elapsed = time.perf_counter() - start
+    print(f"Bulk run: {counts['written']} written ({counts['errors']} errors), "
+          f"{counts['skipped']} already done, {elapsed:.1f}s")
+    return counts
+
+
+def _write(out, records: List[Dict[str, Any]], counts: Dict[str, int]) -> None:
+    for record in records:
+        out.write(json.dumps(record, default=str) + "\n")
+        counts["written"] += 1
+        counts["errors"] += int("error" in record)
+    # Each finished chunk is durable before the next is reported, which is what resume relies on.
+    out.flush()
+    os.fsync(out.fileno())
+    print(f"{counts['written']} items written", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-score a JSONL manifest of conversations or media.")
+    parser.add_argument("manifest", help="JSONL file, one item per line")
+    parser.add_argument("-o", "--output", required=True, help="JSONL results; also the resume checkpoint")
+    parser.add_argument("--workers", type=int, default=1, help="worker processes")
+    parser.add_argument("--chunk-size", type=int, default=BULK_CHUNK_SIZE, help="items analysed together per worker")
+    parser.add_argument("--llm", action="store_true", help="also generate an LLM reply per item")
+    parser.add_argument("--restart", action="store_true", help="discard existing results instead of resuming")
+    parser.add_argument("--preload", default="", help="models to load before forking workers, e.g. text,image")
+    args = parser.parse_args()
+
+    preload = [name.strip() for name in args.preload.split(",") if name.strip()]
+    counts = run_bulk(args.manifest, args.output, workers=args.workers, chunk_size=args.chunk_size,
+                      llm=args.llm, resume=not args.restart, preload=preload)
+    raise SystemExit(1 if counts["errors"] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+from models.batching import env_float, env_int
+
+_MISSING = object()
+
+
+def content_hash(content: Any, version: str = "") -> str:
+    """sha256 over `version` and the content itself.
+
+    Strings are always hashed as text, never opened as paths; bytes, numpy
+    arrays and PIL images are hashed directly. Files go through file_hash.
+    """
+    digest = hashlib.sha256(version.encode("utf-8"))
+    digest.update(b"\0")
+
+    if isinstance(content, np.ndarray):
+        digest.update(f"{content.dtype}{content.shape}".encode("utf-8"))
+        digest.update(np.ascontiguousarray(content).tobytes())
+    elif isinstance(content, (bytes, bytearray, memoryview)):
+        digest.update(content)
+    elif isinstance(content, str):
+        digest.update(content.encode("utf-8"))
+    elif hasattr(content, "tobytes") and hasattr(content, "size"):
+        digest.update(f"{content.mode}{content.size}".encode("utf-8"))
+        digest.update(content.tobytes())
+    else:
+        raise TypeError(f"Cannot hash content of type {type(content).__name__}")
+
+    return digest.hexdigest()
+
+
+def file_hash(path: str, version: str = "") -> str:
+    """sha256 over `version` and the contents of the file at `path`.
+
+    Only for paths the server chose itself (spilled uploads, media under
+    BULK_MEDIA_ROOT); user text must go through content_hash. Gives the same
+    hash as content_hash of the file's bytes.
+    """
+    digest = hashlib.sha256(version.encode("utf-8"))
+    digest.update(b"\0")
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """Bounded LRU of JSON-serialisable results with TTL, plus an optional on-disk tier."""
+
+    def __init__(self, namespace: str, max_entries: int = 1024, ttl: float = 3600.0, disk_dir: Optional[str] = None):
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk_dir = os.path.join(disk_dir, namespace) if disk_dir else None
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 or self.disk_dir is not None
+
+    def get(self, key: str, default: Any = None) -> Any:
+        if not self.enabled:
+            return default
+        now = time.time()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+
+        value = self._disk_get(key, now)
+        with self._lock:
+            if value is _MISSING:
+                self.misses += 1
+                return default
+            self.disk_hits += 1
+        self._memory_set(key, value, now + self.ttl)
+        return value
+
+    def set(self, key: str, value: Any) -> None:
+        if not self.enabled:
+            return
+        expires_at = time.time() + self.ttl
+        self._memory_set(key, value, expires_at)
+        self._disk_set(key, value, expires_at)
+
+    def _memory_set(self, key: str, value: Any, expires_at: float) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key[:2], f"{key}.json")
+
+    def _disk_get(self, key: str, now: float) -> Any:
+        if not self.disk_dir:
+            return _MISSING
+        path = self._disk_path(key)
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return _MISSING
+        if entry.get("expires_at", 0) <= now:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return _MISSING
+        return entry["value"]
+
+    def _disk_set(self, key: str, value: Any, expires_at: float) -> None:
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"expires_at": expires_at, "value": value}, f)
+            os.replace(tmp_path, path)
+        except (OSError, TypeError, ValueError) as e:
+            print(f"Error writing {self.namespace} cache entry: {e}")
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_s": self.ttl,
+                "disk": self.disk_dir is not None,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+caches: Dict[str, ResultCache] = {}
+
+
+def create_cache(namespace: str) -> ResultCache:
+    """Cache configured from RESULT_CACHE_SIZE, RESULT_CACHE_TTL_S and RESULT_CACHE_DIR
+    (no disk tier unless set). RESULT_CACHE_SIZE=0 with no directory disables caching."""
+    cache = ResultCache(
+        namespace,
+        max_entries=env_int("RESULT_CACHE_SIZE", 1024),
+        ttl=env_float("RESULT_CACHE_TTL_S", 3600.0),
+        disk_dir=os.getenv("RESULT_CACHE_DIR") or None,
+    )
+    caches[namespace] = cache
+    return cache
+
+
+def cache_stats() -> Dict[str, Any]:
+    return {name: cache.stats() for name, cache in caches.items()}
@@ -1,64 +1,139 @@
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from models.batching import env_float
+
+# Shared emotion space. Facial and speech models are mapped onto it by label;
+# the binary SST-2 text model is spread over it with SENTIMENT_TO_EMOTION.
+EMOTIONS = ("angry", "disgust", "fear", "happy", "neutral", "sad", "surprise")
+EMOTION_INDEX = {label: i for i, label in enumerate(EMOTIONS)}
+
+LABEL_ALIASES = {
+    "fearful": "fear",
+    "surprised": "surprise",
+    "anger": "angry",
+    "happiness": "happy",
+    "joy": "happy",
+    "sadness": "sad",
+    "calm": "neutral",
+}
+
+SENTIMENT_TO_EMOTION = {
+    "positive": {"happy": 0.8, "surprise": 0.1, "neutral": 0.1},
+    "negative": {"sad": 0.5, "angry": 0.2, "fear": 0.2, "disgust": 0.1},
+}
+
+MODALITY_WEIGHTS = {
+    "text": env_float("FUSION_WEIGHT_TEXT", 0.3),
+    "image": env_float("FUSION_WEIGHT_IMAGE", 0.2),
+    "audio": env_float("FUSION_WEIGHT_AUDIO", 0.5),
+}
+# Each frame, segment or modality counts in proportion to confidence ** FUSION_CONFIDENCE_POWER
+# (0 ignores confidence); predictions less confident than FUSION_MIN_CONFIDENCE are dropped.
+CONFIDENCE_POWER = env_float("FUSION_CONFIDENCE_POWER", 1.0)
+MIN_CONFIDENCE = env_float("FUSION_MIN_CONFIDENCE", 0.0)
+
+
+def _label_matrix() -> Dict[str, np.ndarray]:
+    identity = np.eye(len(EMOTIONS))
+    vectors = {label: identity[i] for label, i in EMOTION_INDEX.items()}
+    for alias, label in LABEL_ALIASES.items():
+        vectors[alias] = vectors[label]
+    for sentiment, spread in SENTIMENT_TO_EMOTION.items():
+        vector = np.zeros(len(EMOTIONS))
+        for label, weight in spread.items():
+            vector[EMOTION_INDEX[label]] = weight
+        vectors[sentiment] = vector
+    return vectors
+
+
+LABEL_VECTORS = _label_matrix()
+
+
+def to_distribution(prediction: Any) -> Optional[np.ndarray]:
+    """Map one model output onto the shared emotion space.
+
+    Accepts {'scores': {label: p}}, a pipeline list of {'label', 'score'} (all
+    classes or top-k), or a single top-1 {'label', 'score'}. Mass not covered by
+    the given labels is spread evenly. Returns None for errors and unknown labels.
+    """
+    if isinstance(prediction, dict) and prediction.get("scores"):
+        pairs = prediction["scores"].items()
+    elif isinstance(prediction, dict) and "label" in prediction:
+        pairs = [(prediction["label"], prediction["score"])]
+    elif isinstance(prediction, list):
+        pairs = [(p["label"], p["score"]) for p in prediction if isinstance(p, dict) and "label" in p]
+    else:
+        return None
+
+    distribution = np.zeros(len(EMOTIONS))
+    for label, score in pairs:
+        vector = LABEL_VECTORS.get(str(label).lower())
+        if vector is not None:
+            distribution += float(score) * vector
+
+    covered = distribution.sum()
+    if covered <= 0:
+        return None
+    if covered < 1.0:
+        distribution += (1.0 - covered) / len(EMOTIONS)
+    return distribution / distribution.sum()
+
+
+def _stack(predictions: List[Any]) -> np.ndarray:
+    rows = [d for d in (to_distribution(p) for p in predictions) if d is not None]
+    return np.vstack(rows) if rows else np.zeros((0, len(EMOTIONS)))
+
+
+def fuse(distributions: np.ndarray) -> Optional[Dict[str, Any]]:
+    """Confidence-weighted mean of an (N, len(EMOTIONS)) array of distributions."""
+    if distributions.size == 0:
+        return None
+    confidences = distributions.max(axis=1)
+    weights = np.where(confidences >= MIN_CONFIDENCE, confidences ** CONFIDENCE_POWER, 0.0)
+    if weights.sum() <= 0:
+        return None
+    return {
+        "distribution": weights @ distributions / weights.sum(),
+        "confidence": float(np.average(confidences, weights=weights)),
+        "count": int(np.count_nonzero(weights)),
+    }
+
+
 def combine_sentiment(text_sentiment=None, image_sentiments=None, audio_sentiment=None):
+    # Each modality is first reduced to one distribution (frames and audio
+    # segments in a single weighted array operation), then the modalities are
+    # blended by MODALITY_WEIGHTS scaled by their own confidence. Text and audio
+    # may each be one prediction or a list of them (chat messages, segments).
+    def predictions(value):
+        if isinstance(value, list):
+            return value
+        return [value] if value else []
+
+    text_predictions = predictions(text_sentiment)
+    audio_predictions = predictions(audio_sentiment)
+
+    modalities = {
+        "text": fuse(_stack(text_predictions)),
+        "image": fuse(_stack(list(image_sentiments or []))),
+        "audio": fuse(_stack(audio_predictions)),
+    }
+    modalities = {name: fused for name, fused in modalities.items() if fused is not None}
+    if not modalities:
+        return {"final_sentiment": "neutral", "confidence": 0.0, "distribution": {}}
 
-   
-    text_weight = 0.3
-    image_weight = 0.2         
-    audio_weight = 0.5
-    sentiments = []
-    confidences = []
-
-    emotion_scores = {}
-    
-    
-    if image_sentiments:
-        for img in image_sentiments:
-            
-            if isinstance(img, list) and len(img) > 0:
-               
-                img_data = img[0]
-                label = img_data['label'].lower()
-                score = img_data['score']
-            else:
-               
-                label = img['label'].lower()
-                score = img['score']
-                
-            emotion_scores[label] = emotion_scores.get(label, 0) + score
-   
-        total_img_score = sum(emotion_scores.values())
-        if total_img_score > 0:
-            for k in emotion_scores:
-                emotion_scores[k] = (emotion_scores[k] / image_weight*total_img_score) 
-
-    
-    if text_sentiment:
-        label = text_sentiment['label'].lower()
-        emotion_scores[label] = emotion_scores.get(label, 0) +  text_weight*text_sentiment['score']
-
-   
-    if audio_sentiment:
-    
-        if isinstance(audio_sentiment, dict):
-            label = audio_sentiment['label'].lower()
-            emotion_scores[label] = emotion_scores.get(label, 0) +  audio_weight*audio_sentiment['score']
-        
-        
-        elif isinstance(audio_sentiment, list):
-            for audio_result in audio_sentiment:
-                label = audio_result['label'].lower()
-                emotion_scores[label] = emotion_scores.get(label, 0) +  audio_result['score']
-
-    
-    total = sum(emotion_scores.values())
-    if total > 0:
-        for k in emotion_scores:
-            emotion_scores[k] /= total
-
-   
-    final_sentiment = max(emotion_scores, key=emotion_scores.get)
+    names = list(modalities)
+    stacked = np.vstack([modalities[name]["distribution"] for name in names])
+    weights = np.array([MODALITY_WEIGHTS[name] * modalities[name]["confidence"] ** CONFIDENCE_POWER for name in names])
+    if weights.sum() <= 0:
+        weights = np.ones(len(names))
+    combined = weights @ stacked / weights.sum()
 
+    best = int(np.argmax(combined))
     return {
-        "final_sentiment": final_sentiment,
-        "confidence": emotion_scores[final_sentiment],
-        "distribution": emotion_scores
-    }
\ No newline at end of file
+        "final_sentiment": EMOTIONS[best],
+        "confidence": float(combined[best]),
+        "distribution": {label: float(p) for label, p in zip(EMOTIONS, combined)},
+        "modality_weights": {name: float(w) for name, w in zip(names, weights / weights.sum())},
+    }
@@ -0,0 +1,129 @@
+from typing import Any, Dict, List, Optional, Tuple
+
+from models.batching import env_int
+
+# Sent once per request as the model's system instruction instead of being
+# repeated inside every user turn of the history.
+SYSTEM_INSTRUCTION = """
+You are MindScope, a calm and compassionate AI that helps users understand and regulate emotions.
+Speak naturally, like a thoughtful therapist and caring friend.
+
+Each user turn gives you what the user said, the sentiment detected from their text, voice or face,
+the input sources used, and a task for this turn. Follow the task for the turn.
+
+Guidelines:
+- Be warm, empathetic, and supportive
+- Respond directly to what the user is sharing
+- Keep responses conversational and natural
+""".strip()
+
+SUMMARY_INSTRUCTION = """
+Summarise this conversation between a user and MindScope, a supportive mental-health companion.
+Keep what matters for continuing it: how the user has been feeling, what they shared, answers to
+any assessment questions, and any suggestions already given. Write at most 120 words.
+""".strip()
+
+# Once the stored history is estimated above this many tokens, everything but the
+# most recent messages is folded into the running summary.
+HISTORY_TOKEN_BUDGET = env_int("LLM_HISTORY_TOKEN_BUDGET", 2000)
+KEEP_RECENT_MESSAGES = env_int("LLM_KEEP_RECENT_MESSAGES", 6)
+
+
+def estimate_tokens(text: str) -> int:
+    # Roughly four characters per token for English; good enough for budgeting.
+    return max(1, len(text) // 4) if text else 0
+
+
+def _message(role: str, text: str) -> Dict[str, Any]:
+    return {"role": role, "parts": [text]}
+
+
+def _message_text(message: Dict[str, Any]) -> str:
+    return " ".join(str(part) for part in message.get("parts", []))
+
+
+def history_tokens(session: Dict[str, Any]) -> int:
+    return estimate_tokens(session.get("summary") or "") + sum(
+        estimate_tokens(_message_text(m)) for m in session.get("chat_history") or []
+    )
+
+
+def build_contents(session: Dict[str, Any], prompt: str) -> List[Dict[str, Any]]:
+    """Summary of compacted turns, then recent history, then this turn's prompt."""
+    contents = []
+    summary = session.get("summary")
+    if summary:
+        contents.append(_message("user", f"Summary of our conversation so far: {summary}"))
+        contents.append(_message("model", "Understood."))
+    contents.extend(session.get("chat_history") or [])
+    contents.append(_message("user", prompt))
+    return contents
+
+
+def record_turn(session: Dict[str, Any], prompt: str, reply: str, usage: Optional[Any] = None) -> None:
+    prompt_tokens = getattr(usage, "prompt_token_count", None)
+    response_tokens = getattr(usage, "candidates_token_count", None)
+    if prompt_tokens is None:
+        prompt_tokens = estimate_tokens(SYSTEM_INSTRUCTION) + sum(
+            estimate_tokens(_message_text(m)) for m in build_contents(session, prompt)
+        )
+    if response_tokens is None:
+        response_tokens = estimate_tokens(reply)
+
+    history = session.setdefault("chat_history", [])
+    history.append(_message("user", prompt))
+    history.append(_message("model", reply))
+
+    totals = session.setdefault("token_usage", {"prompt_tokens": 0, "response_tokens": 0, "turns": 0})
+    totals["prompt_tokens"] += prompt_tokens
+    totals["response_tokens"] += response_tokens
+    totals["turns"] += 1
+    totals["last_prompt_tokens"] = prompt_tokens
+
+
+def record_local_turn(session: Dict[str, Any], prompt: str, reply: str) -> None:
+    """Add a turn answered without the LLM to the history; it is not counted as LLM usage."""
+    history = session.setdefault("chat_history", [])
+    history.append(_message("user", prompt))
+    history.append(_message("model", reply))
+    totals = session.setdefault("token_usage", {"prompt_tokens": 0, "response_tokens": 0, "turns": 0})
+    totals["local_turns"] = totals.get("local_turns", 0) + 1
+
+
+def compaction_plan(session: Dict[str, Any]) -> Optional[Tuple[int, str]]:
+    """If the history is over budget, return (messages to fold, summarisation prompt)."""
+    history = session.get("chat_history") or []
+    if history_tokens(session) <= HISTORY_TOKEN_BUDGET or len(history) <= KEEP_RECENT_MESSAGES:
+        return None
+
+    # Fold whole user/model pairs so the kept history still starts with a user turn.
+    count = len(history) - KEEP_RECENT_MESSAGES
+    count -= count % 2
+    if count <= 0:
+        return None
+
+    lines = []
+    if session.get("summary"):
+        lines.append(f"Earlier summary: {session['summary']}")
+    for message in history[:count]:
+        speaker = "User turn" if message["role"] == "user" else "MindScope"
+        lines.append(f"{speaker}: {_message_text(message)}")
+    return count, SUMMARY_INSTRUCTION + "\n\n" + "\n".join(lines)
+
+
+def apply_summary(session: Dict[str, Any], count: int, summary: Optional[str]) -> None:
+    history = session.get("chat_history") or []
+    if not summary:
+        # Summariser unavailable: keep a clipped transcript so context is not lost outright.
+        folded = " | ".join(_message_text(m).strip()[:120] for m in history[:count])
+        summary = ((session.get("summary") or "") + " " + folded).strip()[-2000:]
+    session["summary"] = summary.strip()
+    session["chat_history"] = history[count:]
+    usage = session.setdefault("token_usage", {"prompt_tokens": 0, "response_tokens": 0, "turns": 0})
+    usage["compactions"] = usage.get("compactions", 0) + 1
+
+
+def token_usage(session: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    usage = dict((session or {}).get("token_usage") or {"prompt_tokens": 0, "response_tokens": 0, "turns": 0})
+    usage["history_tokens"] = history_tokens(session or {})
+    return usage
@@ -0,0 +1,277 @@
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+from typing import Any, AsyncIterator, Callable, Dict, Optional
+
+from models.batching import env_int
+from models.metrics import span, timed
+
+DEFAULT_STAGE_TIMEOUT = 60.0
+
+
+class _PerProcessExecutor:
+    """ThreadPoolExecutor created on first use and re-created after fork()."""
+
+    def __init__(self, name: str, max_workers: int):
+        self.name = name
+        self.max_workers = max(1, max_workers)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def get(self) -> ThreadPoolExecutor:
+        if self._executor is None or self._pid != os.getpid():
+            with self._lock:
+                if self._executor is None or self._pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=self.name)
+                    self._pid = os.getpid()
+        return self._executor
+
+    def submit(self, fn: Callable, *args, **kwargs):
+        # Run in a copy of the caller's context so request-scoped state (metric traces) follows the work.
+        context = contextvars.copy_context()
+        return self.get().submit(context.run, fn, *args, **kwargs)
+
+
+# CPU-bound work (decoding, feature extraction, waiting on batched forward passes).
+inference_executor = _PerProcessExecutor(
+    "inference", env_int("INFERENCE_WORKERS", min(4, os.cpu_count() or 1))
+)
+
+
+async def run_in_inference_pool(fn: Callable, *args, **kwargs) -> Any:
+    return await asyncio.wrap_future(inference_executor.submit(fn, *args, **kwargs))
+
+
+# Timed-out stages that had already started: cancel() cannot stop them, so they
+# keep an inference worker busy and may still read the request's upload files.
+_abandoned = set()
+_abandoned_lock = threading.Lock()
+
+
+def _abandon(future) -> None:
+    if future.cancel():
+        return
+    with _abandoned_lock:
+        _abandoned.add(future)
+    future.add_done_callback(_forget_abandoned)
+
+
+def _forget_abandoned(future) -> None:
+    with _abandoned_lock:
+        _abandoned.discard(future)
+
+
+def abandoned_stages() -> int:
+    """Timed-out stages still running on the inference pool."""
+    with _abandoned_lock:
+        return len(_abandoned)
+
+
+def after_abandoned_stages(fn: Callable, *args) -> None:
+    """Call fn(*args) now, or once every stage abandoned so far has finished.
+
+    Used to delete upload files only after timed-out stages stopped reading them.
+    """
+    with _abandoned_lock:
+        pending = list(_abandoned)
+    if not pending:
+        fn(*args)
+        return
+
+    remaining = [len(pending)]
+    lock = threading.Lock()
+
+    def finished(_future):
+        with lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last:
+            fn(*args)
+
+    for future in pending:
+        future.add_done_callback(finished)
+
+
+class AdmissionRejected(Exception):
+
+    def __init__(self, status_code: int, detail: str, retry_after: int = 1):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Bounds how many pipeline requests run and wait at once.
+
+    Up to `max_in_flight` requests run concurrently and up to `max_queued` more
+    wait for a slot; beyond that requests are rejected with 503. A single session
+    may have at most `max_per_session` requests in the system (429 otherwise).
+    Must be used from one event loop.
+    """
+
+    def __init__(self, max_in_flight: int, max_queued: int, max_per_session: int):
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_queued = max(0, max_queued)
+        self.max_per_session = max(1, max_per_session)
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._in_flight = 0
+        self._queued = 0
+        self._per_session: Dict[str, int] = {}
+        self.rejected = {"429": 0, "503": 0}
+        self.admitted = 0
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        return self._semaphore
+
+    def slot(self, session_id: Optional[str] = None) -> "_AdmissionSlot":
+        return _AdmissionSlot(self, session_id)
+
+    async def _acquire(self, session_id: Optional[str]) -> None:
+        if session_id and self._per_session.get(session_id, 0) >= self.max_per_session:
+            self.rejected["429"] += 1
+            raise AdmissionRejected(429, "Too many concurrent requests for this session")
+
+        semaphore = self._get_semaphore()
+        if semaphore.locked() and self._queued >= self.max_queued:
+            self.rejected["503"] += 1
+            raise AdmissionRejected(503, "Server is busy, please retry shortly")
+
+        if session_id:
+            self._per_session[session_id] = self._per_session.get(session_id, 0) + 1
+        self._queued += 1
+        try:
+            with span("queue_wait"):
+                await semaphore.acquire()
+        except BaseException:
+            self._release_session(session_id)
+            raise
+        finally:
+            self._queued -= 1
+        self._in_flight += 1
+        self.admitted += 1
+
+    def _release(self, session_id: Optional[str]) -> None:
+        self._in_flight -= 1
+        self._get_semaphore().release()
+        self._release_session(session_id)
+
+    def _release_session(self, session_id: Optional[str]) -> None:
+        if not session_id:
+            return
+        remaining = self._per_session.get(session_id, 1) - 1
+        if remaining > 0:
+            self._per_session[session_id] = remaining
+        else:
+            self._per_session.pop(session_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": self._in_flight,
+            "queued": self._queued,
+            "max_in_flight": self.max_in_flight,
+            "max_queued": self.max_queued,
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+        }
+
+
+class _AdmissionSlot:
+
+    def __init__(self, controller: AdmissionController, session_id: Optional[str]):
+        self.controller = controller
+        self.session_id = session_id
+
+    async def __aenter__(self):
+        await self.controller._acquire(self.session_id)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.controller._release(self.session_id)
+        return False
+
+
+admission = AdmissionController(
+    max_in_flight=env_int("PIPELINE_MAX_IN_FLIGHT", inference_executor.max_workers),
+    max_queued=env_int("PIPELINE_MAX_QUEUED", 16),
+    max_per_session=env_int("PIPELINE_MAX_PER_SESSION", 2),
+)
+
+
+def run_stages(stages: Dict[str, Callable[[], Any]], timeouts: Dict[str, float]) -> Dict[str, Any]:
+    """Run independent stages concurrently on the inference pool.
+
+    Each stage gets its own deadline measured from the start of the fan-out.
+    Returns {"results": {...}, "timed_out": [...], "failed": [...]}. A stage that
+    times out keeps running in its worker thread; only its result is dropped,
+    and it is tracked until it finishes (see after_abandoned_stages).
+    """
+    start = time.monotonic()
+    futures = {name: inference_executor.submit(timed(name, fn)) for name, fn in stages.items()}
+    results, timed_out, failed = {}, [], []
+
+    for name, future in futures.items():
+        remaining = start + timeouts.get(name, DEFAULT_STAGE_TIMEOUT) - time.monotonic()
+        try:
+            results[name] = future.result(timeout=max(0.0, remaining))
+        except FuturesTimeoutError:
+            _abandon(future)
+            timed_out.append(name)
+            print(f"Stage '{name}' timed out")
+        except Exception as e:
+            print(f"Stage '{name}' failed: {e}")
+            failed.append(name)
+
+    return {"results": results, "timed_out": timed_out, "failed": failed}
+
+
+async def iter_stages_async(stages: Dict[str, Callable[[], Any]], timeouts: Dict[str, float]) -> AsyncIterator[tuple]:
+    """Run stages concurrently on the inference pool and yield (name, result, error)
+    in completion order; `error` is None, "timed_out" or "failed"."""
+
+    futures = {}
+
+    async def _run(name, fn):
+        future = futures[name] = inference_executor.submit(timed(name, fn))
+        try:
+            result = await asyncio.wait_for(asyncio.wrap_future(future), timeouts.get(name, DEFAULT_STAGE_TIMEOUT))
+            return name, result, None
+        except asyncio.TimeoutError:
+            _abandon(future)
+            print(f"Stage '{name}' timed out")
+            return name, None, "timed_out"
+        except Exception as e:
+            print(f"Stage '{name}' failed: {e}")
+            return name, None, "failed"
+
+    tasks = [asyncio.ensure_future(_run(name, fn)) for name, fn in stages.items()]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        # The consumer stopped early: stages still on the pool are tracked like
+        # timed-out ones, so their input files outlive them.
+        for task in tasks:
+            task.cancel()
+        for future in futures.values():
+            if not future.done():
+                _abandon(future)
+
+
+async def run_stages_async(stages: Dict[str, Callable[[], Any]], timeouts: Dict[str, float]) -> Dict[str, Any]:
+    """Awaitable counterpart of run_stages for use on the event loop."""
+    results, timed_out, failed = {}, [], []
+    async for name, result, error in iter_stages_async(stages, timeouts):
+        if error == "timed_out":
+            timed_out.append(name)
+        elif error == "failed":
+            failed.append(name)
+        else:
+            results[name] = result
+    return {"results": results, "timed_out": timed_out, "failed": failed}
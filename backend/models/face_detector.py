@@ -0,0 +1,99 @@
+import os
+import threading
+
+import cv2
+import numpy as np
+
+# FACE_DETECTION=0 sends whole images and frames to the emotion classifier, as before.
+FACE_DETECTION = os.getenv("FACE_DETECTION", "1").lower() not in ("0", "false", "no")
+
+# Frames are shrunk to at most this many pixels on the long side before detection.
+DETECT_MAX_SIDE = 320
+FACE_MARGIN = 0.2
+
+# A face counts as unchanged from the previous frame when the boxes overlap at least
+# this much and the grayscale thumbnails differ by less than this (0-255 scale).
+TRACK_IOU_THRESHOLD = 0.5
+TRACK_CHANGE_THRESHOLD = 8.0
+
+_face_cascade = threading.local()
+
+
+def _cascade():
+    # CascadeClassifier is not thread-safe; keep one per thread.
+    cascade = getattr(_face_cascade, "value", None)
+    if cascade is None:
+        cascade = cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_frontalface_default.xml")
+        _face_cascade.value = cascade
+    return cascade
+
+
+def detect_faces(image_rgb):
+    """Face boxes (x, y, w, h) in `image_rgb` coordinates, largest first."""
+    height, width = image_rgb.shape[:2]
+    scale = min(1.0, DETECT_MAX_SIDE / max(height, width))
+    gray = cv2.cvtColor(image_rgb, cv2.COLOR_RGB2GRAY)
+    if scale < 1.0:
+        gray = cv2.resize(gray, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+
+    min_side = max(20, int(min(gray.shape[:2]) * 0.08))
+    faces = _cascade().detectMultiScale(gray, scaleFactor=1.2, minNeighbors=5, minSize=(min_side, min_side))
+    boxes = [tuple(int(round(v / scale)) for v in face) for face in faces]
+    return sorted(boxes, key=lambda box: box[2] * box[3], reverse=True)
+
+
+def crop_face(image_rgb, box, margin=FACE_MARGIN):
+    """Square crop around `box`, padded by `margin` of the box size and clipped to the image."""
+    x, y, w, h = box
+    side = int(max(w, h) * (1 + 2 * margin))
+    cx, cy = x + w // 2, y + h // 2
+    height, width = image_rgb.shape[:2]
+    x0, y0 = max(0, cx - side // 2), max(0, cy - side // 2)
+    x1, y1 = min(width, x0 + side), min(height, y0 + side)
+    return np.ascontiguousarray(image_rgb[y0:y1, x0:x1])
+
+
+def _iou(a, b):
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    iw = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+    ih = max(0, min(ay + ah, by + bh) - max(ay, by))
+    inter = iw * ih
+    union = aw * ah + bw * bh - inter
+    return inter / union if union else 0.0
+
+
+def _thumbnail(face_rgb):
+    gray = cv2.cvtColor(face_rgb, cv2.COLOR_RGB2GRAY)
+    return cv2.resize(gray, (24, 24), interpolation=cv2.INTER_AREA).astype(np.float32)
+
+
+class FaceTracker:
+    """Follows the main face across consecutive frames.
+
+    `update` returns True when the face is the same one as in the previous frame
+    and looks unchanged, so its previous classification can be reused.
+    """
+
+    def __init__(self, iou_threshold=TRACK_IOU_THRESHOLD, change_threshold=TRACK_CHANGE_THRESHOLD):
+        self.iou_threshold = iou_threshold
+        self.change_threshold = change_threshold
+        self._box = None
+        self._thumbnail = None
+
+    def update(self, box, face_rgb):
+        thumbnail = _thumbnail(face_rgb)
+        unchanged = (
+            self._box is not None
+            and _iou(self._box, box) >= self.iou_threshold
+            and float(np.mean(np.abs(thumbnail - self._thumbnail))) < self.change_threshold
+        )
+        self._box = box
+        if not unchanged:
+            # Only re-anchor on a new appearance, so slow drift still triggers a reclassification.
+            self._thumbnail = thumbnail
+        return unchanged
+
+    def reset(self):
+        self._box = None
+        self._thumbnail = None
@@ -1,40 +1,156 @@
-from transformers import pipeline
+from transformers import pipeline, AutoImageProcessor
 import requests
 from PIL import Image
-import tempfile
-import os
+from io import BytesIO
+import numpy as np
+from models.registry import registry, get_model
+from models.backends import load_model, resolved_backend
+from models.batching import create_batcher
+from models.cache import create_cache, content_hash, file_hash
+from models.metrics import span
+from models.face_detector import FACE_DETECTION, FaceTracker, detect_faces, crop_face
 
-emotion_classifier = pipeline(
-    task="image-classification",
-    model="dima806/facial_emotions_image_detection"
-)
+IMAGE_MODEL_ID = "dima806/facial_emotions_image_detection"
+
+def image_model_version():
+    return f"{IMAGE_MODEL_ID}:{resolved_backend('image')}:scores{':faces' if FACE_DETECTION else ''}"
+
+def load_image_pipeline():
+    model = load_model(IMAGE_MODEL_ID, "image-classification")
+    return pipeline(task="image-classification", model=model, image_processor=AutoImageProcessor.from_pretrained(IMAGE_MODEL_ID))
+
+registry.register("image", load_image_pipeline)
+
+def _classify_images(images):
+    # top_k=None returns every emotion's probability, not just the top five.
+    emotion_classifier = get_model("image")
+    return emotion_classifier(images, batch_size=len(images), top_k=None)
+
+image_batcher = create_batcher("image", _classify_images)
+image_cache = create_cache("image")
+
+def _is_url(image_input):
+    return isinstance(image_input, str) and image_input.startswith(('http://', 'https://'))
+
+def load_image(image_input):
+    
+    if isinstance(image_input, Image.Image):
+        return image_input.convert("RGB")
+
+    if isinstance(image_input, np.ndarray):
+        # Video frames arrive as RGB arrays straight from the decoder.
+        return Image.fromarray(image_input)
+
+    if isinstance(image_input, (bytes, bytearray, memoryview)):
+        # Uploads are handed over as in-memory bytes.
+        return Image.open(BytesIO(image_input)).convert("RGB")
+
+    if _is_url(image_input):
+        response = requests.get(image_input, timeout=10)
+        response.raise_for_status()
+        return Image.open(BytesIO(response.content)).convert("RGB")
+
+    return Image.open(image_input).convert("RGB")
+
+def face_crop(image):
+    # The classifier was trained on face crops; use the largest face when there is one.
+    frame = np.asarray(image)
+    boxes = detect_faces(frame)
+    if not boxes:
+        return None
+    return Image.fromarray(crop_face(frame, boxes[0]))
 
 def analyze_image_emotion(image_input):
   
-    try:
-        
-        if isinstance(image_input, str) and image_input.startswith(('http://', 'https://')):
-            
-            response = requests.get(image_input, timeout=10)
-            response.raise_for_status()
-            
-           
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as tmp_file:
-                tmp_file.write(response.content)
-                temp_path = tmp_file.name
-            
-            results = emotion_classifier(temp_path)
-        
-       
-            os.unlink(temp_path)
-            
-            return results
-        
-       
+    return analyze_image_emotions([image_input])[0]
+
+def _image_digest(image_input):
+    # Strings that reach the analyzer are upload or media paths chosen by the server.
+    if isinstance(image_input, str):
+        return file_hash(image_input)
+    return content_hash(image_input)
+
+def analyze_image_emotions(image_inputs):
+    # Decode everything first so all images of a request are queued together
+    # and can share one batched forward pass. Files, arrays and decoded images
+    # already seen are answered from the cache; URLs are hashed after download.
+    version = image_model_version()
+    pending = []
+    for image_input in image_inputs:
+        try:
+            digest = None if _is_url(image_input) else _image_digest(image_input)
+            cached = image_cache.get(content_hash(digest, version)) if digest else None
+            if cached is None:
+                with span("decode_image"):
+                    image = load_image(image_input)
+                if digest is None:
+                    digest = content_hash(image)
+                    cached = image_cache.get(content_hash(digest, version))
+            if cached is not None:
+                pending.append(("cached", cached, None))
+            else:
+                face = face_crop(image) if FACE_DETECTION else None
+                if face is not None:
+                    # A still with no detectable face is still classified whole.
+                    image = face
+                pending.append(("future", image_batcher.submit(image), digest))
+        except Exception as e:
+            print(f"Error loading image for emotion analysis: {e}")
+            pending.append(("error", e, None))
+
+    results = []
+    for kind, value, digest in pending:
+        if kind == "cached":
+            results.append(value)
+        elif kind == "error":
+            results.append({"error": str(value), "emotion": "unknown"})
         else:
-            results = emotion_classifier(image_input)
-            return results
-            
-    except Exception as e:
-        print(f"Error in image emotion analysis: {e}")
-        return {"error": str(e), "emotion": "unknown"}
+            try:
+                result = value.result()
+            except Exception as e:
+                print(f"Error in image emotion analysis: {e}")
+                results.append({"error": str(e), "emotion": "unknown"})
+                continue
+            # Keyed by the backend the model actually loaded with.
+            image_cache.set(content_hash(digest, image_model_version()), result)
+            results.append(result)
+    return results
+
+def analyze_frame_emotions(frames):
+    """Facial emotion for consecutive video frames.
+
+    `frames` are RGB arrays, or (frame, boxes) pairs from
+    iter_frames(with_boxes=True) so faces found while sampling are not detected
+    again. Frames without a detectable face are skipped. Only the largest face
+    of each frame is classified: the analysis is about the user in front of the
+    camera, and FaceTracker follows one face. It is cropped and queued for
+    batched classification, unless the tracker sees the same, unchanged face as
+    in the previous frame; then that frame's result is reused instead of
+    running the classifier again.
+    """
+    if not FACE_DETECTION:
+        return analyze_image_emotions([frame[0] if isinstance(frame, tuple) else frame for frame in frames])
+
+    tracker = FaceTracker()
+    pending = []
+    for frame in frames:
+        frame, boxes = frame if isinstance(frame, tuple) else (frame, None)
+        if boxes is None:
+            boxes = detect_faces(frame)
+        if not boxes:
+            tracker.reset()
+            continue
+        face = crop_face(frame, boxes[0])
+        if tracker.update(boxes[0], face) and pending:
+            pending.append(pending[-1])
+            continue
+        pending.append(image_batcher.submit(Image.fromarray(face)))
+
+    results = []
+    for future in pending:
+        try:
+            results.append(future.result())
+        except Exception as e:
+            print(f"Error in image emotion analysis: {e}")
+            results.append({"error": str(e), "emotion": "unknown"})
+    return results
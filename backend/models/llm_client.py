@@ -0,0 +1,418 @@
+import asyncio
+import contextlib
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+from typing import Any, AsyncIterator, Dict, List, NamedTuple, Optional, Tuple
+
+from models.batching import env_float, env_int
+from models.executors import _PerProcessExecutor
+from models.metrics import span
+
+
+class LLMResponse(NamedTuple):
+    text: str
+    usage: Any = None
+
+
+class LLMUnavailable(Exception):
+    """Raised when the LLM cannot answer in time; callers fall back to canned replies."""
+
+
+class CircuitBreaker:
+    """Opens after `failure_threshold` consecutive failures and rejects calls for
+    `reset_timeout` seconds, then lets a single trial call through (half-open)."""
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half_open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def release_trial(self) -> None:
+        """Let the next call try again after a half-open trial was abandoned
+        (cancelled) without an outcome; it counts as neither success nor failure."""
+        with self._lock:
+            if self.state == "half_open":
+                self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._failures >= self.failure_threshold:
+                if self._opened_at is None or self.state == "half_open":
+                    print(f"LLM circuit breaker opened after {self._failures} failures")
+                self._opened_at = time.monotonic()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"state": self.state, "consecutive_failures": self._failures, "rejected": self.rejected}
+
+
+class _Usage(NamedTuple):
+    prompt_token_count: int
+    candidates_token_count: int
+
+
+class GeminiBackend:
+    name = "gemini"
+
+    def __init__(self, model_name: str, system_instruction: Optional[str] = None):
+        import google.generativeai as genai
+        genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+        # One model object per process: the SDK keeps its transport (and
+        # connections) on it, so every request reuses them.
+        self.model = genai.GenerativeModel(model_name, system_instruction=system_instruction)
+
+    def generate(self, contents: Any, timeout: float) -> LLMResponse:
+        response = self.model.generate_content(contents, request_options={"timeout": timeout})
+        return LLMResponse(response.text, getattr(response, "usage_metadata", None))
+
+    async def generate_async(self, contents: Any, timeout: float) -> LLMResponse:
+        response = await self.model.generate_content_async(contents, request_options={"timeout": timeout})
+        return LLMResponse(response.text, getattr(response, "usage_metadata", None))
+
+    async def stream_async(self, contents: Any, timeout: float) -> AsyncIterator[Tuple[str, Any]]:
+        response = await self.model.generate_content_async(contents, stream=True, request_options={"timeout": timeout})
+        async for chunk in response:
+            yield chunk.text, getattr(chunk, "usage_metadata", None)
+
+
+class StubBackend:
+    """Offline backend for load tests: canned replies after a configurable delay.
+
+    LLM_STUB_LATENCY_MS sets the delay (default 50 ms) and LLM_STUB_FAILURE_RATE
+    the fraction of calls that raise, to exercise retries and the breaker.
+    """
+
+    name = "stub"
+
+    def __init__(self, latency_ms: float = 50.0, failure_rate: float = 0.0):
+        self.latency = max(0.0, latency_ms) / 1000.0
+        self.failure_rate = failure_rate
+
+    def _reply(self, contents: Any) -> str:
+        if isinstance(contents, str):
+            prompt = contents
+        else:
+            parts = contents[-1].get("parts", []) if contents else []
+            prompt = " ".join(str(p) for p in parts)
+        for line in prompt.splitlines():
+            if "QUESTION" in line and ":" in line:
+                return f"Thanks for sharing. {line.split(':', 1)[1].strip()}"
+        return "I'm here to listen. Could you tell me a bit more about how you've been feeling lately?"
+
+    def _check_latency(self, timeout: float) -> None:
+        if self.latency > timeout:
+            raise TimeoutError("stub LLM timed out")
+
+    def _maybe_fail(self) -> None:
+        if self.failure_rate and random.random() < self.failure_rate:
+            raise RuntimeError("stub LLM failure")
+
+    def _usage(self, contents: Any, reply: str) -> Dict[str, int]:
+        from models.conversation import estimate_tokens
+        return {"prompt_token_count": estimate_tokens(str(contents)), "candidates_token_count": estimate_tokens(reply)}
+
+    def generate(self, contents: Any, timeout: float) -> LLMResponse:
+        time.sleep(min(self.latency, timeout))
+        self._check_latency(timeout)
+        self._maybe_fail()
+        reply = self._reply(contents)
+        return LLMResponse(reply, _Usage(**self._usage(contents, reply)))
+
+    async def generate_async(self, contents: Any, timeout: float) -> LLMResponse:
+        await asyncio.sleep(min(self.latency, timeout))
+        self._check_latency(timeout)
+        self._maybe_fail()
+        reply = self._reply(contents)
+        return LLMResponse(reply, _Usage(**self._usage(contents, reply)))
+
+    async def stream_async(self, contents: Any, timeout: float) -> AsyncIterator[Tuple[str, Any]]:
+        await asyncio.sleep(min(self.latency, timeout))
+        self._check_latency(timeout)
+        self._maybe_fail()
+        reply = self._reply(contents)
+        words = reply.split(" ")
+        for i, word in enumerate(words):
+            last = i == len(words) - 1
+            yield (word if last else word + " "), (_Usage(**self._usage(contents, reply)) if last else None)
+
+
+class LLMClient:
+    """Deadlines, bounded retries with jittered backoff, optional hedging and a
+    circuit breaker around one LLM backend.
+
+    Every call either returns within `deadline` seconds or raises LLMUnavailable.
+    With `hedge_after` > 0 a second identical request is started if the first has
+    not answered by then, and whichever finishes first wins.
+    """
+
+    def __init__(self, backend, deadline: float = 20.0, attempt_timeout: float = 10.0, max_retries: int = 2,
+                 backoff_base: float = 0.25, backoff_max: float = 2.0, hedge_after: float = 0.0,
+                 breaker: Optional[CircuitBreaker] = None):
+        self.backend = backend
+        self.deadline = deadline
+        self.attempt_timeout = attempt_timeout
+        self.max_retries = max(0, max_retries)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge_after = hedge_after
+        self.breaker = breaker or CircuitBreaker()
+        self._executor = _PerProcessExecutor("llm", 4)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.failures = 0
+        self.retries = 0
+        self.hedges = 0
+
+    def _backoff(self, attempt: int) -> float:
+        # Full jitter: uniform in [0, min(max, base * 2^attempt)].
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _count(self, field: str) -> None:
+        with self._lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    def _check_breaker(self) -> None:
+        self._count("calls")
+        if not self.breaker.allow():
+            self._count("failures")
+            raise LLMUnavailable("LLM circuit breaker is open")
+
+    @contextlib.contextmanager
+    def _releasing_trial(self):
+        # A call cancelled part-way (task cancellation, or GeneratorExit when a
+        # client disconnects from a stream) never records an outcome; without
+        # this a half-open trial would block every later call.
+        try:
+            yield
+        except Exception:
+            raise
+        except BaseException:
+            self.breaker.release_trial()
+            raise
+
+    @staticmethod
+    def _retryable(error: BaseException) -> bool:
+        # The Gemini SDK raises ValueError for blocked or empty candidates; retrying will not help.
+        return not isinstance(error, ValueError)
+
+    def _fail(self, error: BaseException) -> LLMUnavailable:
+        self._count("failures")
+        if self._retryable(error):
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return LLMUnavailable(str(error) or type(error).__name__)
+
+    def generate(self, contents: Any) -> LLMResponse:
+        with span("llm"), self._releasing_trial():
+            return self._generate(contents)
+
+    def _generate(self, contents: Any) -> LLMResponse:
+        self._check_breaker()
+        end = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            timeout = min(self.attempt_timeout, end - time.monotonic())
+            try:
+                if timeout <= 0:
+                    raise TimeoutError("LLM deadline exceeded")
+                response = self._generate_hedged(contents, timeout)
+                self.breaker.record_success()
+                return response
+            except Exception as e:
+                delay = self._backoff(attempt)
+                if attempt >= self.max_retries or not self._retryable(e) or time.monotonic() + delay >= end:
+                    raise self._fail(e) from e
+                print(f"LLM attempt {attempt + 1} failed ({e}); retrying in {delay:.2f}s")
+                self._count("retries")
+                time.sleep(delay)
+                attempt += 1
+
+    def _generate_hedged(self, contents: Any, timeout: float) -> LLMResponse:
+        executor = self._executor.get()
+        futures = [executor.submit(self.backend.generate, contents, timeout)]
+        start = time.monotonic()
+
+        if self.hedge_after > 0:
+            done, _ = wait(futures, timeout=min(self.hedge_after, timeout))
+            if not done:
+                self._count("hedges")
+                futures.append(executor.submit(self.backend.generate, contents, timeout - (time.monotonic() - start)))
+
+        error = None
+        pending = set(futures)
+        while pending:
+            remaining = timeout - (time.monotonic() - start)
+            if remaining <= 0:
+                break
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                error = future.exception()
+        if error is not None and not pending:
+            raise error
+        raise TimeoutError("LLM attempt timed out")
+
+    async def generate_async(self, contents: Any) -> LLMResponse:
+        with span("llm"), self._releasing_trial():
+            return await self._generate_async(contents)
+
+    async def _generate_async(self, contents: Any) -> LLMResponse:
+        self._check_breaker()
+        end = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            timeout = min(self.attempt_timeout, end - time.monotonic())
+            try:
+                if timeout <= 0:
+                    raise TimeoutError("LLM deadline exceeded")
+                response = await asyncio.wait_for(self._generate_hedged_async(contents, timeout), timeout)
+                self.breaker.record_success()
+                return response
+            except Exception as e:
+                delay = self._backoff(attempt)
+                if attempt >= self.max_retries or not self._retryable(e) or time.monotonic() + delay >= end:
+                    raise self._fail(e) from e
+                print(f"LLM attempt {attempt + 1} failed ({e!r}); retrying in {delay:.2f}s")
+                self._count("retries")
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    async def _generate_hedged_async(self, contents: Any, timeout: float) -> LLMResponse:
+        tasks = {asyncio.ensure_future(self.backend.generate_async(contents, timeout))}
+        try:
+            if self.hedge_after > 0:
+                done, _ = await asyncio.wait(tasks, timeout=min(self.hedge_after, timeout))
+                if not done:
+                    self._count("hedges")
+                    tasks.add(asyncio.ensure_future(self.backend.generate_async(contents, timeout)))
+
+            error = None
+            pending = tasks
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def stream_async(self, contents: Any) -> AsyncIterator[Tuple[str, Any]]:
+        """Yield (text, usage) chunks. Retries only happen before the first chunk;
+        a failure mid-stream ends the stream with LLMUnavailable."""
+        with span("llm"), self._releasing_trial():
+            stream = self._stream_async(contents)
+            try:
+                async for chunk in stream:
+                    yield chunk
+            finally:
+                await stream.aclose()
+
+    async def _stream_async(self, contents: Any) -> AsyncIterator[Tuple[str, Any]]:
+        self._check_breaker()
+        end = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            started = False
+            try:
+                timeout = min(self.attempt_timeout, end - time.monotonic())
+                if timeout <= 0:
+                    raise TimeoutError("LLM deadline exceeded")
+                stream = self.backend.stream_async(contents, timeout).__aiter__()
+                while True:
+                    remaining = end - time.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutError("LLM deadline exceeded")
+                    # The first chunk must arrive within one attempt timeout; later ones within the deadline.
+                    wait_for = min(timeout, remaining) if not started else remaining
+                    try:
+                        chunk = await asyncio.wait_for(stream.__anext__(), wait_for)
+                    except StopAsyncIteration:
+                        break
+                    started = True
+                    yield chunk
+                self.breaker.record_success()
+                return
+            except Exception as e:
+                delay = self._backoff(attempt)
+                if started or attempt >= self.max_retries or not self._retryable(e) or time.monotonic() + delay >= end:
+                    raise self._fail(e) from e
+                print(f"LLM stream attempt {attempt + 1} failed ({e!r}); retrying in {delay:.2f}s")
+                self._count("retries")
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": self.backend.name,
+            "calls": self.calls,
+            "failures": self.failures,
+            "retries": self.retries,
+            "hedges": self.hedges,
+            "breaker": self.breaker.stats(),
+        }
+
+
+def create_llm_client(system_instruction: Optional[str] = None) -> LLMClient:
+    """Client configured from LLM_BACKEND ("gemini" or "stub") and the LLM_* settings."""
+    backend_name = os.getenv("LLM_BACKEND", "gemini").lower()
+    if backend_name == "stub":
+        backend = StubBackend(
+            latency_ms=env_float("LLM_STUB_LATENCY_MS", 50.0),
+            failure_rate=env_float("LLM_STUB_FAILURE_RATE", 0.0),
+        )
+    elif backend_name == "gemini":
+        backend = GeminiBackend(os.getenv("LLM_MODEL", "gemini-2.0-flash"), system_instruction)
+    else:
+        raise ValueError(f"Unknown LLM backend: {backend_name}")
+
+    return LLMClient(
+        backend,
+        deadline=env_float("LLM_DEADLINE_S", 20.0),
+        attempt_timeout=env_float("LLM_ATTEMPT_TIMEOUT_S", 10.0),
+        max_retries=env_int("LLM_MAX_RETRIES", 2),
+        backoff_base=env_float("LLM_BACKOFF_BASE_S", 0.25),
+        backoff_max=env_float("LLM_BACKOFF_MAX_S", 2.0),
+        hedge_after=env_float("LLM_HEDGE_AFTER_S", 0.0),
+        breaker=CircuitBreaker(
+            failure_threshold=env_int("LLM_BREAKER_FAILURES", 5),
+            reset_timeout=env_float("LLM_BREAKER_RESET_S", 30.0),
+        ),
+    )
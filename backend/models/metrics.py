@@ -0,0 +1,177 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# Spans of the current request, when it asked for them (see start_trace). Context
+# variables follow the request into the inference pool because the executors run
+# submitted work in a copy of the caller's context.
+_trace: contextvars.ContextVar[Optional[List[Dict[str, Any]]]] = contextvars.ContextVar("metrics_trace", default=None)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, Any]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key: LabelKey, extra: Iterable[Tuple[str, str]] = ()) -> str:
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._values: Dict[LabelKey, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = dict(self._values)
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        lines.extend(f"{self.name}{_format_labels(key)} {_format_value(v)}" for key, v in sorted(values.items()))
+        return lines
+
+
+class Histogram:
+
+    def __init__(self, name: str, help: str, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[LabelKey, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            counts, totals = self._values.setdefault(key, [[0] * len(self.buckets), [0, 0.0]])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            totals[0] += 1
+            totals[1] += value
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = {key: ([*counts], [*totals]) for key, (counts, totals) in self._values.items()}
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, (counts, (count, total)) in sorted(values.items()):
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append(f"{self.name}_bucket{_format_labels(key, [('le', _format_value(bound))])} {bucket_count}")
+            lines.append(f"{self.name}_bucket{_format_labels(key, [('le', '+Inf')])} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """Counters and histograms updated in place, plus gauge collectors that are
+    read when /metrics is scraped (queue depths, memory, circuit state...)."""
+
+    def __init__(self, prefix: str = "mindscope_"):
+        self.prefix = prefix
+        self._metrics: Dict[str, Any] = {}
+        self._collectors: List[Callable[[], Iterable[Tuple[str, str, Dict[str, Any], float]]]] = []
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name: str, help: str, **kwargs):
+        name = self.prefix + name
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help, **kwargs)
+            return metric
+
+    def counter(self, name: str, help: str) -> Counter:
+        return self._get(Counter, name, help)
+
+    def histogram(self, name: str, help: str, buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        return self._get(Histogram, name, help, buckets=buckets)
+
+    def add_collector(self, collector: Callable[[], Iterable[Tuple[str, str, Dict[str, Any], float]]]) -> None:
+        """`collector()` yields (name, help, labels, value) gauge samples at scrape time."""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            lines.extend(metric.render())
+
+        gauges: Dict[str, Tuple[str, List[str]]] = {}
+        for collector in self._collectors:
+            try:
+                samples = list(collector())
+            except Exception as e:
+                print(f"Error collecting metrics: {e}")
+                continue
+            for name, help, labels, value in samples:
+                if value is None:
+                    continue
+                name = self.prefix + name
+                gauges.setdefault(name, (help, []))[1].append(
+                    f"{name}{_format_labels(_label_key(labels))} {_format_value(value)}"
+                )
+        for name, (help, samples) in gauges.items():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} gauge")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+stage_seconds = metrics.histogram("stage_seconds", "Wall time of pipeline stages.")
+requests_total = metrics.counter("requests_total", "HTTP requests by route and status.")
+request_seconds = metrics.histogram("request_seconds", "HTTP request latency by route.")
+
+
+def start_trace() -> List[Dict[str, Any]]:
+    """Record every span of the current request (and work it hands to the inference pool)."""
+    spans: List[Dict[str, Any]] = []
+    _trace.set(spans)
+    return spans
+
+
+@contextmanager
+def span(name: str, **labels):
+    """Time a block into stage_seconds{stage=name} and the request trace, if any."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        stage_seconds.observe(elapsed, stage=name, **labels)
+        spans = _trace.get()
+        if spans is not None:
+            spans.append({"stage": name, **labels, "ms": round(elapsed * 1000.0, 2)})
+
+
+def timed(name: str, fn: Callable, **labels) -> Callable:
+    """`fn` wrapped in span(name)."""
+    def _timed(*args, **kwargs):
+        with span(name, **labels):
+            return fn(*args, **kwargs)
+    return _timed
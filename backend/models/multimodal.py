@@ -1,28 +1,32 @@
 from models.text_model import analyze_text_sentiment
-from models.video_model import extract_frames, extract_audio
-from models.image_model import analyze_image_emotion
+from models.video_model import iter_frames, extract_audio_array
+from models.image_model import analyze_image_emotions, analyze_frame_emotions
 from models.combine_sentiment import combine_sentiment
-from models.open_ai_whisper import predict_emotion
-from transformers import AutoModelForAudioClassification, AutoFeatureExtractor
-import numpy as np
+from models.open_ai_whisper import predict_emotion, AUDIO_SAMPLING_RATE, audio_model_version
+from models.executors import run_stages, run_stages_async, iter_stages_async
+from models.batching import env_float
+from models.session_store import session_store
+from models.llm_client import create_llm_client
+from models.conversation import SYSTEM_INSTRUCTION, build_contents, record_turn, record_local_turn, compaction_plan, apply_summary, token_usage
+from models.assessment_bank import fast_path_reply
+from models.cache import create_cache, content_hash, file_hash
+from models.metrics import span
+from models.image_model import image_model_version
+from models.adaptive_video import analyze_video_adaptive, ADAPTIVE_VERSION
 from typing import Optional, Dict, List
 import os
-import google.generativeai as genai
 from dotenv import load_dotenv
-from collections import defaultdict
 import json
 import uuid
+import asyncio
+import functools
+import threading
 
 load_dotenv()
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
 
-model_id = "firdhokk/speech-emotion-recognition-with-openai-whisper-large-v3"
-model = AutoModelForAudioClassification.from_pretrained(model_id)
-feature_extractor = AutoFeatureExtractor.from_pretrained(model_id, do_normalize=True)
-id2label = model.config.id2label
-
-gemini_chat_sessions = defaultdict(lambda: None)
-user_assessment_states = defaultdict(dict)
+# Per-session state (assessment progress, chat history, summary, token usage)
+# lives in session_store; the LLM client is stateless and shared.
+_llm_client = None
 
 
 MENTAL_HEALTH_QUESTIONS = [
@@ -33,8 +37,7 @@ MENTAL_HEALTH_QUESTIONS = [
     "How have you been coping with stress recently? What helps you feel better when you're struggling?"
 ]
 
-def process_multimodal_input(text=None, image_paths=None, audio_path=None, video_path=None, user_context=None, session_id=None, is_assessment_mode=False):
-   
+def prepare_session(session_id=None, is_assessment_mode=False):
 
     if is_assessment_mode is None:
         is_assessment_mode = False
@@ -47,12 +50,23 @@ def process_multimodal_input(text=None, image_paths=None, audio_path=None, video
     else:
         print(f"Using provided session ID: {session_id}")
     
-    
     initialize_session_state(session_id, is_assessment_mode)
-    
-    text_sentiment = None
-    image_sentiments = []
-    audio_sentiment = None
+    return session_id, is_assessment_mode
+
+STAGE_TIMEOUTS = {
+    "text": env_float("STAGE_TIMEOUT_TEXT_S", 10.0),
+    "images": env_float("STAGE_TIMEOUT_IMAGES_S", 30.0),
+    "audio": env_float("STAGE_TIMEOUT_AUDIO_S", 60.0),
+    "video": env_float("STAGE_TIMEOUT_VIDEO_S", 120.0),
+}
+
+video_cache = create_cache("video")
+
+def video_analysis_version(frame_strategy):
+    sampling = ADAPTIVE_VERSION if frame_strategy == "adaptive" else frame_strategy
+    return f"{audio_model_version()}:{image_model_version()}:{os.getenv('VIDEO_MAX_FRAMES', '')}:{sampling}"
+
+def get_input_sources(text=None, image_paths=None, audio_path=None, video_path=None):
    
     input_sources = []  
        
@@ -64,103 +78,258 @@ def process_multimodal_input(text=None, image_paths=None, audio_path=None, video
         input_sources.append("audio")
     if video_path:
         input_sources.append("video")
+    return input_sources
 
-    if text:
-        text_sentiment = analyze_text_sentiment(text)
-
-    if audio_path:
-        audio_sentiment = predict_emotion(audio_path, model, feature_extractor, id2label)
-        
-    if video_path:      
-        audio_path_from_video = extract_audio(video_path, "temp_video_audio.wav")
+def analyze_video(video_path):
+    # A re-uploaded clip skips demuxing and frame decoding entirely.
     
-        if audio_path_from_video:
-            audio_sentiment = predict_emotion(audio_path_from_video, model, feature_extractor, id2label)
-        else:
-            audio_sentiment = None
-            print("No audio in video, skipping audio analysis")
-            
-            frames = extract_frames(video_path)
-            for frame in frames:
-                emotion_result = analyze_image_emotion(frame)
-                image_sentiments.append(emotion_result)
+    frame_strategy = os.getenv("VIDEO_FRAME_STRATEGY", "uniform")
+    digest = file_hash(video_path)
+    cached = video_cache.get(content_hash(digest, video_analysis_version(frame_strategy)))
+    if cached is not None:
+        return cached
+
+    with span("decode_audio"):
+        audio_from_video = extract_audio_array(video_path, sampling_rate=AUDIO_SAMPLING_RATE)
 
+    if audio_from_video is not None and len(audio_from_video) > 0:
+        result = {"audio_sentiment": predict_emotion(audio_from_video), "image_sentiments": []}
+    else:
+        print("No audio in video, skipping audio analysis")
+        adaptive = analyze_video_adaptive(video_path) if frame_strategy == "adaptive" else None
+        if adaptive is not None:
+            result = {"audio_sentiment": None, "image_sentiments": adaptive["image_sentiments"], "frame_sampling": adaptive["sampling"]}
+        else:
+            # Adaptive sampling needs the frame count; without it, sample uniformly.
+            frames = iter_frames(
+                video_path, strategy="uniform" if frame_strategy == "adaptive" else frame_strategy, with_boxes=True
+            )
+            result = {"audio_sentiment": None, "image_sentiments": analyze_frame_emotions(frames)}
+
+    if not any("error" in r for r in result["image_sentiments"] if isinstance(r, dict)):
+        video_cache.set(content_hash(digest, video_analysis_version(frame_strategy)), result)
+    return result
+
+def plan_stages(text=None, image_paths=None, audio_path=None, video_path=None):
+    # Independent analyzers, keyed by modality; each runs as its own stage.
+    
+    stages = {}
+    if text:
+        stages["text"] = functools.partial(analyze_text_sentiment, text)
+    if audio_path:
+        stages["audio"] = functools.partial(predict_emotion, audio_path)
+    if video_path:
+        stages["video"] = functools.partial(analyze_video, video_path)
     elif image_paths:
-        for img in image_paths:
-            emotion_result = analyze_image_emotion(img)
-            image_sentiments.append(emotion_result)
+        stages["images"] = functools.partial(analyze_image_emotions, image_paths)
+    return stages
+
+def merge_stage_results(input_sources, stage_outcome):
+    
+    results = stage_outcome["results"]
+    text_sentiment = results.get("text")
+    audio_sentiment = results.get("audio")
+    image_sentiments = list(results.get("images") or [])
+
+    video = results.get("video")
+    if video:
+        if video["audio_sentiment"]:
+            audio_sentiment = video["audio_sentiment"]
+        image_sentiments.extend(video["image_sentiments"])
+    video_sampling = video.get("frame_sampling") if video else None
 
     if text_sentiment or image_sentiments or audio_sentiment:
-        combined = combine_sentiment(text_sentiment, image_sentiments, audio_sentiment)
+        with span("fusion"):
+            combined = combine_sentiment(text_sentiment, image_sentiments, audio_sentiment)
     else:
         combined = {"final_sentiment": "neutral", "confidence": 0.0}
 
+    return {
+        "input_sources": input_sources,
+        "text_sentiment": text_sentiment,
+        "image_sentiments": image_sentiments,
+        "audio_sentiment": audio_sentiment,
+        "combined_sentiment": combined,
+        "partial": bool(stage_outcome["timed_out"] or stage_outcome["failed"]),
+        "timed_out_modalities": stage_outcome["timed_out"],
+        "failed_modalities": stage_outcome["failed"],
+        "video_sampling": video_sampling,
+    }
+
+def analyze_modalities(text=None, image_paths=None, audio_path=None, video_path=None):
+    
+    stages = plan_stages(text, image_paths, audio_path, video_path)
+    stage_outcome = run_stages(stages, STAGE_TIMEOUTS)
+    return merge_stage_results(get_input_sources(text, image_paths, audio_path, video_path), stage_outcome)
+
+async def analyze_modalities_async(text=None, image_paths=None, audio_path=None, video_path=None):
+    
+    stages = plan_stages(text, image_paths, audio_path, video_path)
+    stage_outcome = await run_stages_async(stages, STAGE_TIMEOUTS)
+    return merge_stage_results(get_input_sources(text, image_paths, audio_path, video_path), stage_outcome)
+
+def build_result(session_id, analysis, llm_response):
+    return {
+        "session_id": session_id,
+        "text_sentiment": analysis["text_sentiment"],
+        "image_sentiments": analysis["image_sentiments"],
+        "audio_sentiment": analysis["audio_sentiment"],
+        "combined_sentiment": analysis["combined_sentiment"],
+        "llm_response": llm_response,
+        "assessment_progress": get_assessment_progress(session_id),
+        "token_usage": get_token_usage(session_id),
+        "partial": analysis["partial"],
+        "timed_out_modalities": analysis["timed_out_modalities"],
+        "failed_modalities": analysis["failed_modalities"],
+        "video_sampling": analysis["video_sampling"],
+    }
+
+def process_multimodal_input(text=None, image_paths=None, audio_path=None, video_path=None, user_context=None, session_id=None, is_assessment_mode=False):
+   
+    session_id, is_assessment_mode = prepare_session(session_id, is_assessment_mode)
+
+    analysis = analyze_modalities(text, image_paths, audio_path, video_path)
+
     llm_response = generate_mental_health_response(
         user_input=text or "",
-        sentiment_data=combined,
-        input_sources=input_sources,
+        sentiment_data=analysis["combined_sentiment"],
+        input_sources=analysis["input_sources"],
+        user_context=user_context,
+        session_id=session_id,
+        is_assessment_mode=is_assessment_mode
+    )
+
+    return build_result(session_id, analysis, llm_response)
+
+async def process_multimodal_input_async(text=None, image_paths=None, audio_path=None, video_path=None, user_context=None, session_id=None, is_assessment_mode=False):
+    # Same pipeline as process_multimodal_input, but the analyzers run on the bounded
+    # inference pool, session store calls on worker threads and the Gemini call is
+    # awaited, so the event loop never blocks.
+   
+    session_id, is_assessment_mode = await asyncio.to_thread(prepare_session, session_id, is_assessment_mode)
+
+    analysis = await analyze_modalities_async(text, image_paths, audio_path, video_path)
+
+    prompt, assessment_state = await asyncio.to_thread(
+        build_llm_prompt,
+        user_input=text or "",
+        sentiment_data=analysis["combined_sentiment"],
+        input_sources=analysis["input_sources"],
+        user_context=user_context,
+        session_id=session_id,
+        is_assessment_mode=is_assessment_mode
+    )
+    llm_response = await call_llm_api_async(prompt, session_id, assessment_state, analysis["combined_sentiment"])
+
+    return await asyncio.to_thread(build_result, session_id, analysis, llm_response)
+
+async def stream_multimodal_events(text=None, image_paths=None, audio_path=None, video_path=None, user_context=None, session_id=None, is_assessment_mode=False):
+    # Yields (event, data) pairs: one "sentiment" per modality as it finishes,
+    # "combined" once fusion is done, "token" chunks of the LLM reply, and finally
+    # "result" with the same shape process_multimodal_input returns.
+   
+    session_id, is_assessment_mode = await asyncio.to_thread(prepare_session, session_id, is_assessment_mode)
+    yield "session", {"session_id": session_id}
+
+    stages = plan_stages(text, image_paths, audio_path, video_path)
+    stage_outcome = {"results": {}, "timed_out": [], "failed": []}
+    async for name, result, error in iter_stages_async(stages, STAGE_TIMEOUTS):
+        if error == "timed_out":
+            stage_outcome["timed_out"].append(name)
+        elif error == "failed":
+            stage_outcome["failed"].append(name)
+        else:
+            stage_outcome["results"][name] = result
+        yield "sentiment", {"modality": name, "result": result, "error": error}
+
+    analysis = merge_stage_results(get_input_sources(text, image_paths, audio_path, video_path), stage_outcome)
+    yield "combined", analysis["combined_sentiment"]
+
+    prompt, assessment_state = await asyncio.to_thread(
+        build_llm_prompt,
+        user_input=text or "",
+        sentiment_data=analysis["combined_sentiment"],
+        input_sources=analysis["input_sources"],
+        user_context=user_context,
+        session_id=session_id,
+        is_assessment_mode=is_assessment_mode
+    )
+    chunks = []
+    try:
+        async for chunk in stream_llm_api_async(prompt, session_id, assessment_state, analysis["combined_sentiment"]):
+            chunks.append(chunk)
+            yield "token", {"text": chunk}
+    except Exception as e:
+        # The reply broke off after some tokens; "result" still carries what was sent.
+        yield "error", {"detail": f"LLM reply interrupted: {str(e)}"}
+
+    yield "result", await asyncio.to_thread(build_result, session_id, analysis, "".join(chunks))
+
+async def process_streamed_input_async(analyzer, text=None, user_context=None, session_id=None, is_assessment_mode=False):
+    # End of a WebSocket stream: audio and frames were already classified while they
+    # arrived (models/streaming.py), so only the text, fusion and the reply remain.
+
+    session_id, is_assessment_mode = await asyncio.to_thread(prepare_session, session_id, is_assessment_mode)
+
+    stage_outcome = await run_stages_async(plan_stages(text), STAGE_TIMEOUTS)
+    stage_outcome["results"]["audio"] = analyzer.audio_result()
+    stage_outcome["results"]["images"] = analyzer.frame_results
+    input_sources = get_input_sources(text, analyzer.frames_received, analyzer.total_samples)
+    analysis = merge_stage_results(input_sources, stage_outcome)
+
+    prompt, assessment_state = await asyncio.to_thread(
+        build_llm_prompt,
+        user_input=text or "",
+        sentiment_data=analysis["combined_sentiment"],
+        input_sources=analysis["input_sources"],
         user_context=user_context,
         session_id=session_id,
         is_assessment_mode=is_assessment_mode
     )
+    llm_response = await call_llm_api_async(prompt, session_id, assessment_state, analysis["combined_sentiment"])
+
+    return await asyncio.to_thread(build_result, session_id, analysis, llm_response)
 
+def new_assessment_state(is_assessment_mode):
     return {
-        "session_id": session_id,
-        "text_sentiment": text_sentiment,
-        "image_sentiments": image_sentiments,
-        "audio_sentiment": audio_sentiment,
-        "combined_sentiment": combined,
-        "llm_response": llm_response,
-        "assessment_progress": get_assessment_progress(session_id)
+        "is_assessment_mode": is_assessment_mode,
+        "assessment_phase": "initial" if is_assessment_mode else "none",
+        "questions_asked": 0,
+        "user_responses": [],
+        "current_question_index": 0,
+        "assessment_complete": False,
+        "is_first_interaction": True
     }
 
 def initialize_session_state(session_id, is_assessment_mode):
   
-    if session_id not in user_assessment_states:
-        user_assessment_states[session_id] = {
-            "is_assessment_mode": is_assessment_mode,
-            "assessment_phase": "initial" if is_assessment_mode else "none",
-            "questions_asked": 0,
-            "user_responses": [],
-            "current_question_index": 0,
-            "assessment_complete": False,
-            "is_first_interaction": True
-        }
+    session = session_store.get(session_id) or {"chat_history": []}
+
+    if not session.get("assessment"):
+        session["assessment"] = new_assessment_state(is_assessment_mode)
         print(f"Initialized session {session_id} with assessment_mode: {is_assessment_mode}")
     else:
        
-        current_state = user_assessment_states[session_id]
+        current_state = session["assessment"]
         if current_state["is_assessment_mode"] != is_assessment_mode:
            
             if is_assessment_mode:
-                current_state.update({
-                    "is_assessment_mode": True,
-                    "assessment_phase": "initial",
-                    "questions_asked": 0,
-                    "user_responses": [],
-                    "current_question_index": 0,
-                    "assessment_complete": False,
-                    "is_first_interaction": True
-                })
+                current_state.update(new_assessment_state(True))
             else:
-                current_state.update({
-                    "is_assessment_mode": False,
-                    "assessment_phase": "none",
-                    "questions_asked": 0,
-                    "user_responses": [],
-                    "current_question_index": 0,
-                    "assessment_complete": True,  
-                    "is_first_interaction": True
-                })
+                current_state.update(new_assessment_state(False))
+                current_state["assessment_complete"] = True
             print(f"Updated session {session_id} to assessment_mode: {is_assessment_mode}")
 
-def generate_mental_health_response(user_input, sentiment_data, input_sources, user_context, session_id=None, is_assessment_mode=False):
+    session_store.set(session_id, session)
+
+def build_llm_prompt(user_input, sentiment_data, input_sources, user_context, session_id=None, is_assessment_mode=False):
+    # Returns the prompt for this turn and the assessment state to use for fallbacks
+    # (None for regular chat).
    
     assessment_state = update_assessment_state(session_id, user_input, is_assessment_mode)
     
-    
     if not assessment_state["is_assessment_mode"]:
-        return generate_regular_chat_response(user_input, sentiment_data, input_sources, user_context, session_id)
+        return build_regular_chat_prompt(user_input, sentiment_data, input_sources), None
     
     prompt = create_mental_health_prompt(
         user_input=user_input,
@@ -169,45 +338,42 @@ def generate_mental_health_response(user_input, sentiment_data, input_sources, u
         user_context=user_context,
         assessment_state=assessment_state
     )
+    return prompt, assessment_state
+
+def generate_mental_health_response(user_input, sentiment_data, input_sources, user_context, session_id=None, is_assessment_mode=False):
+   
+    prompt, assessment_state = build_llm_prompt(
+        user_input, sentiment_data, input_sources, user_context, session_id, is_assessment_mode
+    )
     
-    llm_response = call_llm_api(prompt, session_id, assessment_state)
+    llm_response = call_llm_api(prompt, session_id, assessment_state, sentiment_data)
     
     return llm_response
 
-def generate_regular_chat_response(user_input, sentiment_data, input_sources, user_context, session_id):
+def build_regular_chat_prompt(user_input, sentiment_data, input_sources):
    
     prompt = f"""
-You are MindScope, a calm and compassionate AI that helps users understand and regulate emotions.  
-Speak naturally, like a thoughtful therapist and caring friend.
-
 User input: {user_input.strip() if user_input else '(No text input)'}
 Detected sentiment: {sentiment_data['final_sentiment']} (confidence: {sentiment_data.get('confidence', 0.0)})
 Input sources: {', '.join(input_sources)}
 
-This is a regular chat conversation (not mental health assessment mode). 
-
-Respond naturally to the user's input as a supportive AI companion. Provide helpful, empathetic responses without initiating any structured assessment questions.
-
-Guidelines:
-- Be warm, empathetic, and supportive
-- Respond directly to what the user is sharing
-- Don't ask assessment questions unless the user specifically requests it
-- Keep responses conversational and natural
-
-Respond below:
+Task: regular chat (not mental health assessment mode). Respond naturally as a supportive AI companion.
+Don't ask assessment questions unless the user specifically requests it.
 """
     
-    return call_llm_api(prompt, session_id, None)
+    return prompt
 
 def update_assessment_state(session_id, user_input, is_assessment_mode):
     
     if not session_id:
         session_id = "default_session"
     
-    if session_id not in user_assessment_states:
+    session = session_store.get(session_id)
+    if not session or not session.get("assessment"):
         initialize_session_state(session_id, is_assessment_mode)
+        session = session_store.get(session_id)
     
-    current_state = user_assessment_states[session_id]
+    current_state = session["assessment"]
     
    
     if not current_state["is_assessment_mode"]:
@@ -230,14 +396,12 @@ def update_assessment_state(session_id, user_input, is_assessment_mode):
             print(f"Progressed to question {current_state['current_question_index'] + 1} for session: {session_id}")
     
     current_state["is_first_interaction"] = False
+    session_store.set(session_id, session)
     
-    return user_assessment_states[session_id]
+    return current_state
 
 def create_mental_health_prompt(user_input, sentiment_data, input_sources, user_context, assessment_state):
     base_prompt = f"""
-You are MindScope, a calm and compassionate AI that helps users understand and regulate emotions.  
-Speak naturally, like a thoughtful therapist and caring friend.
-
 User input: {user_input.strip() if user_input else '(No text input)'}
 Detected sentiment: {sentiment_data['final_sentiment']} (confidence: {sentiment_data.get('confidence', 0.0)})
 Input sources: {', '.join(input_sources)}
@@ -284,15 +448,6 @@ Provide a warm, supportive summary in 3-4 sentences. Offer 1-2 practical suggest
 
     return prompt
 
-def get_previous_qa_summary(assessment_state):
-    
-    summary = []
-    for i in range(assessment_state["questions_asked"]):
-        if i < len(assessment_state["user_responses"]):
-            summary.append(f"Q{i+1}: {MENTAL_HEALTH_QUESTIONS[i]}")
-            summary.append(f"A{i+1}: {assessment_state['user_responses'][i][:100]}...")  
-    return "\n".join(summary) if summary else "No previous responses yet."
-
 def get_assessment_summary(assessment_state):
     """Create a concise summary"""
     return f"Completed {len(assessment_state['user_responses'])} questions in mental health assessment."
@@ -300,8 +455,9 @@ def get_assessment_summary(assessment_state):
 
 def get_assessment_progress(session_id):
     
-    if session_id in user_assessment_states:
-        state = user_assessment_states[session_id]
+    session = session_store.get(session_id) if session_id else None
+    if session and session.get("assessment"):
+        state = session["assessment"]
         return {
             "questions_asked": state["questions_asked"],
             "total_questions": len(MENTAL_HEALTH_QUESTIONS),
@@ -311,32 +467,194 @@ def get_assessment_progress(session_id):
     return {"questions_asked": 0, "total_questions": len(MENTAL_HEALTH_QUESTIONS), "assessment_complete": False, "current_phase": "initial"}
 
 
-def call_llm_api(prompt: str, session_id: Optional[str] = None, assessment_state: Optional[Dict] = None):
+def get_llm_client():
+    
+    global _llm_client
+    if _llm_client is None:
+        _llm_client = create_llm_client(SYSTEM_INSTRUCTION)
+    return _llm_client
+
+def _llm_fallback_response(assessment_state):
+    
+    if assessment_state and assessment_state.get("is_assessment_mode", False) and not assessment_state["assessment_complete"]:
+        current_question_index = assessment_state["current_question_index"]
+        current_question = MENTAL_HEALTH_QUESTIONS[current_question_index]
+        return f"I'm here to listen and support you. {current_question}"
+    else:
+        return "I'm here to listen. Could you tell me a bit more about how you've been feeling lately?"
+
+# Compaction summarises in the background, after the reply has been returned,
+# so a turn never waits for a second LLM call. At most one runs per session; a
+# turn finishing meanwhile leaves its history for the next compaction.
+_compacting = set()
+_compacting_lock = threading.Lock()
+_compaction_tasks = set()
+
+def _record_llm_turn(session_id, session, prompt, reply, usage):
+    # The turn is applied to the session as stored now rather than to the copy
+    # read before the LLM call, so turns of the same session that finished in
+    # the meantime are kept. Returns the compaction to run, if any.
+
+    state = session_store.update(session_id, lambda latest: record_turn(latest, prompt, reply, usage), session)
+    plan = compaction_plan(state)
+    if not plan:
+        return None
+    with _compacting_lock:
+        if session_id in _compacting:
+            return None
+        _compacting.add(session_id)
+    count, summary_prompt = plan
+    return state["chat_history"][:count], summary_prompt
+
+def _apply_compaction(session_id, folded, summary):
+
+    def apply(latest):
+        # Skipped when a concurrent turn already folded these messages.
+        if (latest.get("chat_history") or [])[:len(folded)] == folded:
+            apply_summary(latest, len(folded), summary)
+
+    try:
+        session_store.update(session_id, apply)
+    finally:
+        with _compacting_lock:
+            _compacting.discard(session_id)
+
+def _compact(session_id, folded, summary_prompt):
+    
+    try:
+        summary = get_llm_client().generate(summary_prompt).text
+    except Exception as e:
+        print(f"[Error summarising history]: {e}")
+        summary = None
+    _apply_compaction(session_id, folded, summary)
+
+async def _compact_async(session_id, folded, summary_prompt):
+    
+    try:
+        summary = (await get_llm_client().generate_async(summary_prompt)).text
+    except Exception as e:
+        print(f"[Error summarising history]: {e}")
+        summary = None
+    await asyncio.to_thread(_apply_compaction, session_id, folded, summary)
+
+def _finish_llm_turn(session_id, session, prompt, reply, usage):
+    
+    compaction = _record_llm_turn(session_id, session, prompt, reply, usage)
+    if compaction:
+        threading.Thread(target=_compact, args=(session_id, *compaction), name="compaction", daemon=True).start()
+
+def _start_compaction_task(session_id, compaction):
+    
+    task = asyncio.ensure_future(_compact_async(session_id, *compaction))
+    _compaction_tasks.add(task)
+    task.add_done_callback(_compaction_tasks.discard)
+
+async def _finish_llm_turn_async(session_id, session, prompt, reply, usage):
+    # The store write runs on a worker thread. The compaction is handed back to
+    # the loop from that thread, so it still starts if this caller is cancelled
+    # while the write is in progress.
+
+    loop = asyncio.get_running_loop()
+
+    def record():
+        compaction = _record_llm_turn(session_id, session, prompt, reply, usage)
+        if compaction:
+            loop.call_soon_threadsafe(_start_compaction_task, session_id, compaction)
+
+    await asyncio.to_thread(record)
+
+def _fast_path_turn(session_id, session, prompt, assessment_state, sentiment_data):
+    # ASSESSMENT_FAST_PATH: intro and next-question turns come from the local phrasing
+    # bank. The turn still joins the history, so later LLM turns see it; compaction
+    # is left to the next LLM turn.
+
+    reply = fast_path_reply(MENTAL_HEALTH_QUESTIONS, assessment_state, sentiment_data, session_id)
+    if reply is None:
+        return None
+    session_store.update(session_id, lambda latest: record_local_turn(latest, prompt, reply), session)
+    print(f"Assessment fast path turn for session: {session_id}")
+    return reply
+
+def call_llm_api(prompt: str, session_id: Optional[str] = None, assessment_state: Optional[Dict] = None, sentiment_data: Optional[Dict] = None):
     
     try:
         if not session_id:
             session_id = "default_session"
-            
-        if gemini_chat_sessions[session_id]:
-            chat = gemini_chat_sessions[session_id]
-            response = chat.send_message(prompt)
-            print(f"Continuing existing chat session: {session_id}")
-        else:
-            model = genai.GenerativeModel("gemini-2.0-flash")
-            chat = model.start_chat(history=[])
-            response = chat.send_message(prompt)
-            gemini_chat_sessions[session_id] = chat
-            print(f"Started new chat session: {session_id}")
+
+        session = session_store.get(session_id) or {"assessment": assessment_state}
+        reply = _fast_path_turn(session_id, session, prompt, assessment_state, sentiment_data)
+        if reply is not None:
+            return reply
+        response = get_llm_client().generate(build_contents(session, prompt))
+        reply = response.text
+        print(f"LLM turn for session: {session_id}")
+
+        _finish_llm_turn(session_id, session, prompt, reply, response.usage)
         
-        return response.text
+        return reply
 
     except Exception as e:
-        print(f"[Error calling Gemini API]: {e}")
-        
+        print(f"[Error calling LLM]: {e}")
+        return _llm_fallback_response(assessment_state)
+
+async def call_llm_api_async(prompt: str, session_id: Optional[str] = None, assessment_state: Optional[Dict] = None, sentiment_data: Optional[Dict] = None):
+    
+    try:
+        if not session_id:
+            session_id = "default_session"
+
+        session = await asyncio.to_thread(session_store.get, session_id) or {"assessment": assessment_state}
+        reply = await asyncio.to_thread(_fast_path_turn, session_id, session, prompt, assessment_state, sentiment_data)
+        if reply is not None:
+            return reply
+        response = await get_llm_client().generate_async(build_contents(session, prompt))
+        reply = response.text
+        print(f"LLM turn for session: {session_id}")
+
+        await _finish_llm_turn_async(session_id, session, prompt, reply, response.usage)
         
-        if assessment_state and assessment_state.get("is_assessment_mode", False) and not assessment_state["assessment_complete"]:
-            current_question_index = assessment_state["current_question_index"]
-            current_question = MENTAL_HEALTH_QUESTIONS[current_question_index]
-            return f"I'm here to listen and support you. {current_question}"
-        else:
-            return "I'm here to listen. Could you tell me a bit more about how you've been feeling lately?"
\ No newline at end of file
+        return reply
+
+    except Exception as e:
+        print(f"[Error calling LLM]: {e}")
+        return _llm_fallback_response(assessment_state)
+
+async def stream_llm_api_async(prompt: str, session_id: Optional[str] = None, assessment_state: Optional[Dict] = None, sentiment_data: Optional[Dict] = None):
+    # Yields the reply in chunks as Gemini produces them. On failure before any
+    # text arrives, the fallback message is yielded instead. A failure part-way
+    # through keeps the partial reply in the history and is then re-raised, so
+    # the caller can tell the client the reply was cut off.
+    
+    if not session_id:
+        session_id = "default_session"
+
+    chunks = []
+    usage = None
+    interrupted = None
+    try:
+        session = await asyncio.to_thread(session_store.get, session_id) or {"assessment": assessment_state}
+        reply = await asyncio.to_thread(_fast_path_turn, session_id, session, prompt, assessment_state, sentiment_data)
+        if reply is not None:
+            yield reply
+            return
+        async for text, chunk_usage in get_llm_client().stream_async(build_contents(session, prompt)):
+            usage = chunk_usage or usage
+            if text:
+                chunks.append(text)
+                yield text
+        print(f"LLM streamed turn for session: {session_id}")
+
+    except Exception as e:
+        print(f"[Error calling LLM]: {e}")
+        if not chunks:
+            yield _llm_fallback_response(assessment_state)
+            return
+        interrupted = e
+
+    await _finish_llm_turn_async(session_id, session, prompt, "".join(chunks), usage)
+    if interrupted is not None:
+        raise interrupted
+
+def get_token_usage(session_id):
+    
+    return token_usage(session_store.get(session_id) if session_id else None)
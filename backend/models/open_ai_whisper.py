@@ -1,16 +1,119 @@
-from transformers import AutoModelForAudioClassification, AutoFeatureExtractor
+from transformers import AutoFeatureExtractor
 import librosa
 import torch
 import numpy as np
+import os
+import tempfile
+from models.registry import registry, get_model
+from models.backends import load_model, model_backend, configure_torch_threads, resolved_backend
+from models.batching import create_batcher, env_float, env_int
+from models.cache import create_cache, content_hash, file_hash
+from models.metrics import span
 
 model_id = "firdhokk/speech-emotion-recognition-with-openai-whisper-large-v3"
-model = AutoModelForAudioClassification.from_pretrained(model_id)
 
-feature_extractor = AutoFeatureExtractor.from_pretrained(model_id, do_normalize=True)
-id2label = model.config.id2label
+# Whisper feature extractors expect 16 kHz mono input.
+AUDIO_SAMPLING_RATE = 16000
 
-def preprocess_audio(audio_path, feature_extractor, max_duration=30.0):
+class AudioInferenceSession:
+    """Audio emotion model placed on its device once and reused for every call."""
+
+    def __init__(self, model, feature_extractor, device=None):
+        configure_torch_threads()
+        self.backend = model_backend(model)
+        if device is None:
+            # int8 and ONNX Runtime models only run on CPU here.
+            use_cuda = self.backend == "torch" and torch.cuda.is_available()
+            device = os.getenv("AUDIO_DEVICE") or ("cuda" if use_cuda else "cpu")
+        self.device = torch.device(device)
+
+        if isinstance(model, torch.nn.Module):
+            model = model.to(self.device).eval()
+        self.model = model
+        self.feature_extractor = feature_extractor
+        self.id2label = model.config.id2label
+        self.labels = [self.id2label[i] for i in range(len(self.id2label))]
+
+    def extract_features(self, audio_arrays):
+        # Whisper's encoder only accepts 30 s of log-mel frames, so the extractor pads
+        # the spectrogram itself; the waveform is never padded here.
+        return self.feature_extractor(
+            audio_arrays,
+            sampling_rate=self.feature_extractor.sampling_rate,
+            return_tensors="pt",
+        )["input_features"]
+
+    def forward(self, input_features):
+        """One forward pass over a (batch, mel, frames) tensor; returns (batch, labels) probabilities."""
+        with torch.inference_mode():
+            logits = self.model(input_features=input_features.to(self.device)).logits
+        if not isinstance(logits, torch.Tensor):
+            logits = torch.from_numpy(np.asarray(logits))
+        return torch.softmax(logits.float(), dim=-1).cpu().numpy()
+
+    def predict(self, audio_arrays):
+        """Classify a list of 16 kHz float32 arrays in a single batched forward pass."""
+        return self.forward(self.extract_features(list(audio_arrays)))
+
+    def result(self, probabilities):
+        predicted_id = int(np.argmax(probabilities))
+        return {
+            'label': self.id2label[predicted_id],
+            'score': float(probabilities[predicted_id]),
+            'scores': {label: float(p) for label, p in zip(self.labels, probabilities)},
+        }
+
+def load_audio_model():
+    model = load_model(model_id, "audio-classification")
+    feature_extractor = AutoFeatureExtractor.from_pretrained(model_id, do_normalize=True)
+    return AudioInferenceSession(model, feature_extractor)
+
+registry.register("audio", load_audio_model)
+
+# "chunked" runs short clips at their real length and long clips as overlapping
+# windows; "fixed" keeps the old pad/truncate-to-max_duration behaviour.
+AUDIO_MODE = os.getenv("AUDIO_MODE", "chunked")
+AUDIO_WINDOW_S = env_float("AUDIO_WINDOW_S", 30.0)
+AUDIO_WINDOW_OVERLAP_S = env_float("AUDIO_WINDOW_OVERLAP_S", 5.0)
+AUDIO_MAX_WINDOWS = env_int("AUDIO_MAX_WINDOWS", 20)
+# Windows quieter than this RMS are treated as silence and not classified.
+AUDIO_SILENCE_RMS = env_float("AUDIO_SILENCE_RMS", 1e-3)
+
+def _is_streamable(data):
+    # WAV, FLAC, Ogg and MP3 can be demuxed from a pipe. MP4/M4A/MOV (phone voice
+    # notes) usually keep their index at the end of the file and need seeking, so
+    # they and any unrecognised container are decoded from a file instead.
+    head = bytes(data[:12])
+    return (
+        (head.startswith(b"RIFF") and head[8:12] == b"WAVE")
+        or head.startswith((b"fLaC", b"OggS", b"ID3"))
+        or (len(head) >= 2 and head[0] == 0xFF and head[1] & 0xE0 == 0xE0)
+    )
+
+def load_audio_array(audio_path, sampling_rate=AUDIO_SAMPLING_RATE):
    
+    if isinstance(audio_path, np.ndarray):
+        # Already decoded (e.g. demuxed from a video) at the extractor's sampling rate.
+        return audio_path.astype(np.float32, copy=False)
+
+    if isinstance(audio_path, (bytes, bytearray, memoryview)):
+        # In-memory upload: streamable formats are decoded by ffmpeg from stdin,
+        # anything else from a temporary file (see _is_streamable).
+        from models.video_model import extract_audio_array
+        if _is_streamable(audio_path):
+            audio_array = extract_audio_array(audio_path, sampling_rate=sampling_rate)
+        else:
+            fd, tmp_path = tempfile.mkstemp(suffix=".audio")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(audio_path)
+                audio_array = extract_audio_array(tmp_path, sampling_rate=sampling_rate)
+            finally:
+                os.remove(tmp_path)
+        if audio_array is None:
+            raise ValueError("Could not decode audio from the uploaded data")
+        return audio_array
+
     if isinstance(audio_path, str) and audio_path.startswith(('http://', 'https://')):
         import requests
         from io import BytesIO
@@ -18,12 +121,16 @@ def preprocess_audio(audio_path, feature_extractor, max_duration=30.0):
         response = requests.get(audio_path)
         response.raise_for_status()
         
-        
-        audio_array, sampling_rate = librosa.load(BytesIO(response.content), sr=feature_extractor.sampling_rate)
-    
+        audio_array, _ = librosa.load(BytesIO(response.content), sr=sampling_rate)
+        return audio_array
     
-    else:
-        audio_array, sampling_rate = librosa.load(audio_path, sr=feature_extractor.sampling_rate)
+    audio_array, _ = librosa.load(audio_path, sr=sampling_rate)
+    return audio_array
+
+def preprocess_audio(audio_path, feature_extractor, max_duration=30.0):
+   
+    with span("decode_audio"):
+        audio_array = load_audio_array(audio_path, feature_extractor.sampling_rate)
     
     max_length = int(feature_extractor.sampling_rate * max_duration)
     if len(audio_array) > max_length:
@@ -40,31 +147,115 @@ def preprocess_audio(audio_path, feature_extractor, max_duration=30.0):
     )
     return inputs
 
-def predict_emotion(audio_path, model, feature_extractor, id2label, max_duration=30.0):
-   
-    if isinstance(audio_path, str):
-        inputs = preprocess_audio(audio_path, feature_extractor, max_duration)
-        
-        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-        model = model.to(device)
-        inputs = {key: value.to(device) for key, value in inputs.items()}
+def segment_audio(audio_array, sampling_rate=AUDIO_SAMPLING_RATE, window_s=None, overlap_s=None, max_windows=None):
+    """Split audio into overlapping (start_s, end_s, samples) windows.
 
-        with torch.no_grad():
-            outputs = model(**inputs)
+    Clips no longer than one window come back as a single segment of their
+    real length. The last window is aligned to the end of the recording so the
+    tail is never dropped.
+    """
+    window_s = AUDIO_WINDOW_S if window_s is None else window_s
+    overlap_s = AUDIO_WINDOW_OVERLAP_S if overlap_s is None else overlap_s
+    max_windows = AUDIO_MAX_WINDOWS if max_windows is None else max_windows
 
-        logits = outputs.logits
-        probabilities = torch.softmax(logits, dim=-1)
-        
-        predicted_id = torch.argmax(logits, dim=-1).item()
-        predicted_label = id2label[predicted_id]
-        confidence = probabilities[0][predicted_id].item()
-        
-        return {'label': predicted_label, 'score': confidence}
+    window = int(window_s * sampling_rate)
+    hop = max(1, int((window_s - overlap_s) * sampling_rate))
+    total = len(audio_array)
+
+    if total <= window:
+        return [(0.0, total / sampling_rate, audio_array)]
+
+    starts = list(range(0, total - window, hop)) + [total - window]
+    if max_windows and len(starts) > max_windows:
+        # Keep coverage of the whole recording by spreading the allowed windows evenly.
+        starts = [int(s) for s in np.linspace(0, total - window, max_windows)]
+
+    return [(start / sampling_rate, (start + window) / sampling_rate, audio_array[start:start + window]) for start in starts]
+
+def _classify_audio_features(features):
+    session = get_model("audio")
+    return list(session.forward(torch.cat(features, dim=0)))
+
+audio_batcher = create_batcher("audio", _classify_audio_features)
+audio_cache = create_cache("audio")
+
+def _submit_chunked(audio_path, session):
+    
+    with span("decode_audio"):
+        audio_array = load_audio_array(audio_path, session.feature_extractor.sampling_rate)
+    segments = segment_audio(audio_array, session.feature_extractor.sampling_rate)
+
+    kept = []
+    for start, end, samples in segments:
+        if len(segments) > 1 and np.sqrt(np.mean(np.square(samples))) < AUDIO_SILENCE_RMS:
+            continue
+        kept.append((start, end, samples))
+
+    if not kept:
+        # Entirely silent long recording: classify the first window so there is a result.
+        kept.append(segments[0])
+
+    # All windows of a recording go through the feature extractor together.
+    features = session.extract_features([samples for _, _, samples in kept])
+    futures = audio_batcher.submit_many(list(features.split(1, dim=0)))
+    return [(start, end) for start, end, _ in kept], futures
+
+def _collect_chunked(kept, futures, session):
     
+    probabilities = [future.result() for future in futures]
+
+    # Weight each window by its duration so a short tail window counts for less.
+    weights = np.array([end - start for start, end in kept], dtype=np.float64)
+    combined = np.average(np.stack(probabilities), axis=0, weights=weights)
+
+    result = session.result(combined)
+    if len(kept) > 1:
+        result["segments"] = [
+            {"start": round(start, 2), "end": round(end, 2), 'label': session.id2label[int(np.argmax(p))], 'score': float(np.max(p))}
+            for (start, end), p in zip(kept, probabilities)
+        ]
+    return result
+
+def audio_model_version(mode=None, max_duration=30.0):
+    return (f"{model_id}:{resolved_backend('audio')}:{mode or AUDIO_MODE}:{max_duration}:"
+            f"{AUDIO_WINDOW_S}:{AUDIO_WINDOW_OVERLAP_S}:{AUDIO_MAX_WINDOWS}")
+
+def _audio_digest(audio_input):
+    # Strings are upload or media paths chosen by the server; URLs are not cached.
+    if isinstance(audio_input, str):
+        if audio_input.startswith(('http://', 'https://')):
+            return None
+        return file_hash(audio_input)
+    return content_hash(audio_input)
+
+def predict_emotion(audio_path, session=None, max_duration=30.0, mode=None):
    
-    elif isinstance(audio_path, list):
-        results = []
-        for audio_file in audio_path:
-            result = predict_emotion(audio_file, model, feature_extractor, id2label, max_duration)
-            results.append(result)
-        return results
\ No newline at end of file
+    if session is None:
+        session = get_model("audio")
+    mode = mode or AUDIO_MODE
+
+    audio_inputs = audio_path if isinstance(audio_path, list) else [audio_path]
+    version = audio_model_version(mode, max_duration)
+    digests = [_audio_digest(audio_input) for audio_input in audio_inputs]
+    results = [audio_cache.get(content_hash(digest, version)) if digest else None for digest in digests]
+
+    # Queue every window of every uncached input before waiting, so they share batches.
+    pending = {}
+    for i, audio_input in enumerate(audio_inputs):
+        if results[i] is not None:
+            continue
+        if mode == "chunked":
+            pending[i] = _submit_chunked(audio_input, session)
+        else:
+            pending[i] = audio_batcher.submit(preprocess_audio(audio_input, session.feature_extractor, max_duration)["input_features"])
+
+    for i, submitted in pending.items():
+        if mode == "chunked":
+            results[i] = _collect_chunked(*submitted, session)
+        else:
+            results[i] = session.result(submitted.result())
+        if digests[i]:
+            # Keyed by the backend the model actually loaded with.
+            audio_cache.set(content_hash(digests[i], audio_model_version(mode, max_duration)), results[i])
+
+    return results if isinstance(audio_path, list) else results[0]
@@ -0,0 +1,148 @@
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Optional
+
+
+def current_rss() -> Optional[int]:
+    """Resident set size of this process in bytes, or None if unavailable."""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except Exception:
+        return None
+
+
+def _parameter_bytes(obj: Any) -> Optional[int]:
+    # Pipelines keep the torch module on `.model`; sessions and plain models expose it directly.
+    module = getattr(obj, "model", obj)
+    if not hasattr(module, "parameters"):
+        return None
+    try:
+        return sum(p.numel() * p.element_size() for p in module.parameters())
+    except Exception:
+        return None
+
+
+class ModelRegistry:
+    """Loads each registered model at most once per process, on first use."""
+
+    def __init__(self):
+        self._loaders: Dict[str, Callable[[], Any]] = {}
+        self._models: Dict[str, Any] = {}
+        self._stats: Dict[str, Dict[str, Any]] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str, loader: Callable[[], Any]) -> None:
+        with self._lock:
+            self._loaders[name] = loader
+            self._locks.setdefault(name, threading.Lock())
+            self._stats.setdefault(name, {"status": "registered"})
+
+    def is_loaded(self, name: str) -> bool:
+        return name in self._models
+
+    def get(self, name: str) -> Any:
+        model = self._models.get(name)
+        if model is not None:
+            return model
+
+        if name not in self._loaders:
+            raise KeyError(f"Unknown model: {name}")
+
+        with self._locks[name]:
+            model = self._models.get(name)
+            if model is not None:
+                return model
+
+            self._stats[name] = {"status": "loading"}
+            print(f"Loading model '{name}'...")
+            rss_before = current_rss()
+            start = time.perf_counter()
+            try:
+                model = self._loaders[name]()
+            except Exception as e:
+                self._stats[name] = {"status": "error", "error": str(e)}
+                raise
+            load_time = time.perf_counter() - start
+            rss_after = current_rss()
+
+            self._stats[name] = {
+                "status": "loaded",
+                "load_time_s": round(load_time, 3),
+                "rss_delta_bytes": (rss_after - rss_before) if rss_before is not None and rss_after is not None else None,
+                "parameter_bytes": _parameter_bytes(model),
+            }
+            self._models[name] = model
+            print(f"Loaded model '{name}' in {load_time:.1f}s")
+            return model
+
+    def preload(self, names: Iterable[str], background: bool = True) -> Optional[threading.Thread]:
+        names = [n for n in names if n in self._loaders]
+
+        def _load_all():
+            for name in names:
+                try:
+                    self.get(name)
+                except Exception as e:
+                    print(f"Error preloading model '{name}': {e}")
+
+        if not background:
+            _load_all()
+            return None
+
+        thread = threading.Thread(target=_load_all, name="model-preload", daemon=True)
+        thread.start()
+        return thread
+
+    def share_memory(self) -> int:
+        """Move the weights of every loaded torch model into shared memory; returns the bytes moved.
+
+        Used by serve.py --share-memory before forking: shared tensors stay single copies even if a
+        worker writes to them, and show up as shared rather than private RSS.
+        """
+        shared = 0
+        for name, model in list(self._models.items()):
+            module = getattr(model, "model", model)
+            if not hasattr(module, "share_memory") or not hasattr(module, "parameters"):
+                continue
+            try:
+                module.share_memory()
+            except Exception as e:
+                # Packed int8 weights, for example, are not regular tensors; they stay copy-on-write.
+                print(f"Could not share memory of model '{name}': {e}")
+                continue
+            shared += _parameter_bytes(module) or 0
+        return shared
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "process_rss_bytes": current_rss(),
+            "models": {name: dict(self._stats.get(name, {})) for name in self._loaders},
+        }
+
+
+registry = ModelRegistry()
+
+
+def get_model(name: str) -> Any:
+    return registry.get(name)
+
+
+def preload_from_env(background: bool = True) -> Optional[threading.Thread]:
+    """Preload the comma-separated model names in PRELOAD_MODELS ("all" for every model)."""
+    value = os.getenv("PRELOAD_MODELS", "").strip()
+    if not value:
+        return None
+    if value.lower() == "all":
+        names = list(registry.stats()["models"].keys())
+    else:
+        names = [n.strip() for n in value.split(",") if n.strip()]
+    return registry.preload(names, background=background)
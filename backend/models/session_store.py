@@ -0,0 +1,266 @@
+import abc
+import copy
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+from models.batching import env_float, env_int
+
+
+def _size_of(state: Dict[str, Any]) -> int:
+    return len(json.dumps(state, default=str))
+
+
+class SessionStore(abc.ABC):
+    """Per-session state (assessment progress, chat history) as JSON-serialisable dicts.
+
+    `get` returns a copy; callers persist changes with `set`, or with `update`
+    when other requests for the same session may have changed it meanwhile.
+    Sessions idle for longer than `idle_ttl` seconds expire, and the least
+    recently used sessions are evicted once `max_sessions` or `max_bytes` is
+    exceeded.
+    """
+
+    def __init__(self, idle_ttl: float, max_sessions: int, max_bytes: int):
+        self.idle_ttl = idle_ttl
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.evictions = 0
+        self.expirations = 0
+
+    @abc.abstractmethod
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abc.abstractmethod
+    def set(self, session_id: str, state: Dict[str, Any]) -> None:
+        ...
+
+    @abc.abstractmethod
+    def update(
+        self,
+        session_id: str,
+        mutate: Callable[[Dict[str, Any]], None],
+        default: Optional[Dict[str, Any]] = None,
+    ) -> Dict[str, Any]:
+        """Apply `mutate` to the stored state (or a copy of `default`) atomically and return the result."""
+
+    @abc.abstractmethod
+    def delete(self, session_id: str) -> None:
+        ...
+
+    def __contains__(self, session_id: str) -> bool:
+        return self.get(session_id) is not None
+
+    @abc.abstractmethod
+    def stats(self) -> Dict[str, Any]:
+        ...
+
+
+class InMemorySessionStore(SessionStore):
+
+    def __init__(self, idle_ttl: float, max_sessions: int, max_bytes: int):
+        super().__init__(idle_ttl, max_sessions, max_bytes)
+        self._sessions: "OrderedDict[str, tuple]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def _drop(self, session_id: str) -> None:
+        _, _, size = self._sessions.pop(session_id)
+        self._bytes -= size
+
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+            last_used, state, size = entry
+            if time.time() - last_used > self.idle_ttl:
+                self._drop(session_id)
+                self.expirations += 1
+                return None
+            self._sessions[session_id] = (time.time(), state, size)
+            self._sessions.move_to_end(session_id)
+            return copy.deepcopy(state)
+
+    def set(self, session_id: str, state: Dict[str, Any]) -> None:
+        state = copy.deepcopy(state)
+        with self._lock:
+            self._put(session_id, state)
+
+    def update(self, session_id, mutate, default=None):
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is not None and time.time() - entry[0] <= self.idle_ttl:
+                state = copy.deepcopy(entry[1])
+            else:
+                state = copy.deepcopy(default) if default is not None else {}
+            mutate(state)
+            self._put(session_id, state)
+            return copy.deepcopy(state)
+
+    def _put(self, session_id: str, state: Dict[str, Any]) -> None:
+        size = _size_of(state)
+        if session_id in self._sessions:
+            self._drop(session_id)
+        self._sessions[session_id] = (time.time(), state, size)
+        self._bytes += size
+        self._evict()
+
+    def _evict(self) -> None:
+        now = time.time()
+        for session_id in [sid for sid, (last_used, _, _) in self._sessions.items() if now - last_used > self.idle_ttl]:
+            self._drop(session_id)
+            self.expirations += 1
+        while self._sessions and (len(self._sessions) > self.max_sessions or self._bytes > self.max_bytes):
+            self._drop(next(iter(self._sessions)))
+            self.evictions += 1
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            if session_id in self._sessions:
+                self._drop(session_id)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "backend": "memory",
+                "sessions": len(self._sessions),
+                "bytes": self._bytes,
+                "max_sessions": self.max_sessions,
+                "max_bytes": self.max_bytes,
+                "idle_ttl_s": self.idle_ttl,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+class SQLiteSessionStore(SessionStore):
+    """Shared store for several worker processes on one machine; survives restarts."""
+
+    def __init__(self, path: str, idle_ttl: float, max_sessions: int, max_bytes: int):
+        super().__init__(idle_ttl, max_sessions, max_bytes)
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "session_id TEXT PRIMARY KEY, state TEXT NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS sessions_last_used ON sessions (last_used)")
+
+    def _connect(self) -> sqlite3.Connection:
+        # Connections are per thread and per process; they must not cross a fork().
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        conn = self._connect()
+        now = time.time()
+        row = conn.execute(
+            "SELECT state FROM sessions WHERE session_id = ? AND last_used > ?",
+            (session_id, now - self.idle_ttl),
+        ).fetchone()
+        if row is None:
+            return None
+        conn.execute("UPDATE sessions SET last_used = ? WHERE session_id = ?", (now, session_id))
+        return json.loads(row[0])
+
+    def set(self, session_id: str, state: Dict[str, Any]) -> None:
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._put(conn, session_id, state)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def update(self, session_id, mutate, default=None):
+        # BEGIN IMMEDIATE takes the write lock before the read, so concurrent
+        # updates from other threads or worker processes are serialised.
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT state FROM sessions WHERE session_id = ? AND last_used > ?",
+                (session_id, time.time() - self.idle_ttl),
+            ).fetchone()
+            state = json.loads(row[0]) if row is not None else copy.deepcopy(default or {})
+            mutate(state)
+            self._put(conn, session_id, state)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return state
+
+    def _put(self, conn: sqlite3.Connection, session_id: str, state: Dict[str, Any]) -> None:
+        payload = json.dumps(state, default=str)
+        conn.execute(
+            "INSERT OR REPLACE INTO sessions (session_id, state, size, last_used) VALUES (?, ?, ?, ?)",
+            (session_id, payload, len(payload), time.time()),
+        )
+        self._evict(conn)
+
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        expired = conn.execute("DELETE FROM sessions WHERE last_used <= ?", (time.time() - self.idle_ttl,)).rowcount
+        self.expirations += max(0, expired)
+
+        count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM sessions").fetchone()
+        if count <= self.max_sessions and total <= self.max_bytes:
+            return
+        for session_id, size in conn.execute("SELECT session_id, size FROM sessions ORDER BY last_used").fetchall():
+            if count <= self.max_sessions and total <= self.max_bytes:
+                break
+            conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+            count -= 1
+            total -= size
+            self.evictions += 1
+
+    def delete(self, session_id: str) -> None:
+        self._connect().execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    def stats(self) -> Dict[str, Any]:
+        count, total = self._connect().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM sessions").fetchone()
+        return {
+            "backend": "sqlite",
+            "path": self.path,
+            "sessions": count,
+            "bytes": total,
+            "max_sessions": self.max_sessions,
+            "max_bytes": self.max_bytes,
+            "idle_ttl_s": self.idle_ttl,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+def create_session_store() -> SessionStore:
+    """Store selected by SESSION_BACKEND ("memory" or "sqlite" at SESSION_DB_PATH)."""
+    idle_ttl = env_float("SESSION_IDLE_TTL_S", 6 * 3600.0)
+    max_sessions = env_int("SESSION_MAX", 10000)
+    max_bytes = env_int("SESSION_MAX_BYTES", 64 * 1024 * 1024)
+
+    backend = os.getenv("SESSION_BACKEND", "memory").lower()
+    if backend == "sqlite":
+        path = os.getenv("SESSION_DB_PATH", os.path.join(os.path.dirname(os.path.dirname(__file__)), "sessions.db"))
+        return SQLiteSessionStore(path, idle_ttl, max_sessions, max_bytes)
+    if backend != "memory":
+        raise ValueError(f"Unknown session backend: {backend}")
+    return InMemorySessionStore(idle_ttl, max_sessions, max_bytes)
+
+
+session_store = create_session_store()
@@ -0,0 +1,174 @@
+"""Incremental emotion analysis of audio (and camera frames) while they are recorded.
+
+The client streams raw PCM; every STREAM_HOP_S seconds of new audio the last
+STREAM_WINDOW_S seconds are classified, and the running audio estimate is the
+mean of those windows, each weighted by the new audio it covered. Only one
+window's worth of samples is kept, so a long recording needs no more memory
+than a short one, and nothing is re-analysed when the stream ends.
+"""
+import base64
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from models.batching import env_float
+from models.combine_sentiment import combine_sentiment
+from models.face_detector import FACE_DETECTION, FaceTracker, detect_faces, crop_face
+from models.image_model import image_batcher, load_image
+from models.metrics import span
+from models.open_ai_whisper import AUDIO_SAMPLING_RATE, AUDIO_SILENCE_RMS, audio_batcher
+from models.registry import get_model
+
+STREAM_WINDOW_S = env_float("STREAM_WINDOW_S", 10.0)
+STREAM_HOP_S = env_float("STREAM_HOP_S", 3.0)
+# Audio after the last window shorter than this is not classified on its own at the end.
+STREAM_MIN_TAIL_S = env_float("STREAM_MIN_TAIL_S", 1.0)
+STREAM_MAX_DURATION_S = env_float("STREAM_MAX_DURATION_S", 600.0)
+
+ENCODINGS = {"f32le": np.dtype("<f4"), "s16le": np.dtype("<i2")}
+
+
+class StreamingAnalyzer:
+    """Running audio and facial emotion estimates for one streaming session.
+
+    Samples and frames are added from the event loop; `take_window` snapshots
+    the audio to classify there, and `classify_window` / `classify_frame` run on
+    the inference pool. The caller keeps at most one audio window and one frame
+    in flight, which is also what throttles a client sending faster than the
+    models keep up.
+    """
+
+    def __init__(self, sample_rate: int = AUDIO_SAMPLING_RATE, encoding: str = "f32le",
+                 window_s: float = STREAM_WINDOW_S, hop_s: float = STREAM_HOP_S):
+        if encoding not in ENCODINGS:
+            raise ValueError(f"Unsupported audio encoding: {encoding} (expected one of {', '.join(ENCODINGS)})")
+        if not 8000 <= int(sample_rate) <= 192000:
+            raise ValueError(f"Unsupported sample rate: {sample_rate}")
+        self.sample_rate = int(sample_rate)
+        self.dtype = ENCODINGS[encoding]
+        self.window = int(window_s * self.sample_rate)
+        self.hop = max(1, int(hop_s * self.sample_rate))
+
+        self._buffer = np.zeros(0, dtype=np.float32)
+        self._partial = b""
+        self.total_samples = 0
+        self.classified_until = 0
+        self.windows: List[Tuple[float, float, np.ndarray, float]] = []
+        self._weighted_sum = None
+        self._weight = 0.0
+
+        self._tracker = FaceTracker()
+        self.frame_results: List[Dict[str, Any]] = []
+        self.frames_received = 0
+
+    @property
+    def duration_s(self) -> float:
+        return self.total_samples / self.sample_rate
+
+    def add_audio(self, data: bytes) -> None:
+        # A chunk may end mid-sample; the remainder is kept for the next one.
+        data = self._partial + bytes(data)
+        usable = len(data) - len(data) % self.dtype.itemsize
+        self._partial = data[usable:]
+        samples = np.frombuffer(data[:usable], dtype=self.dtype)
+        if self.dtype.kind == "i":
+            samples = samples.astype(np.float32) / 32768.0
+        else:
+            samples = samples.astype(np.float32)
+        self._buffer = np.concatenate([self._buffer, samples])[-self.window:]
+        self.total_samples += len(samples)
+
+    def window_due(self) -> bool:
+        return self.total_samples - self.classified_until >= self.hop
+
+    def take_window(self, final: bool = False) -> Optional[Tuple[float, float, np.ndarray, float]]:
+        """Snapshot the latest window if enough new audio arrived (any tail when `final`)."""
+        new = self.total_samples - self.classified_until
+        if new <= 0 or (final and self.windows and new < STREAM_MIN_TAIL_S * self.sample_rate):
+            return None
+        if not final and new < self.hop:
+            return None
+        samples = self._buffer.copy()
+        end = self.total_samples
+        self.classified_until = end
+        return (end - len(samples)) / self.sample_rate, end / self.sample_rate, samples, new / self.sample_rate
+
+    def classify_window(self, window) -> Optional[np.ndarray]:
+        """Emotion probabilities of one window, or None for silence (runs on the inference pool)."""
+        start, end, samples, weight = window
+        if self.windows and np.sqrt(np.mean(np.square(samples))) < AUDIO_SILENCE_RMS:
+            return None
+        session = get_model("audio")
+        target_rate = session.feature_extractor.sampling_rate
+        if self.sample_rate != target_rate:
+            import librosa
+            samples = librosa.resample(samples, orig_sr=self.sample_rate, target_sr=target_rate)
+        with span("stream_audio_window"):
+            features = session.extract_features([samples])
+            return audio_batcher.submit(features).result()
+
+    def record_window(self, window, probabilities: Optional[np.ndarray]) -> Optional[Dict[str, Any]]:
+        """Fold a classified window into the running estimate; returns the window's own result."""
+        if probabilities is None:
+            return None
+        start, end, _, weight = window
+        self.windows.append((start, end, probabilities, weight))
+        self._weighted_sum = probabilities * weight if self._weighted_sum is None else self._weighted_sum + probabilities * weight
+        self._weight += weight
+        return {"start": round(start, 2), "end": round(end, 2), **get_model("audio").result(probabilities)}
+
+    def audio_result(self) -> Optional[Dict[str, Any]]:
+        """Running audio emotion, in the shape predict_emotion returns."""
+        if not self.windows:
+            return None
+        session = get_model("audio")
+        result = session.result(self._weighted_sum / self._weight)
+        if len(self.windows) > 1:
+            result["segments"] = [
+                {"start": round(start, 2), "end": round(end, 2), 'label': session.id2label[int(np.argmax(p))], 'score': float(np.max(p))}
+                for start, end, p, _ in self.windows
+            ]
+        return result
+
+    def classify_frame(self, data) -> Optional[Dict[str, Any]]:
+        """Facial emotion of one camera frame (runs on the inference pool).
+
+        As for uploaded video, only the largest face is classified (the user at the
+        camera), frames without a face are skipped and an unchanged tracked face
+        reuses the previous frame's result.
+        """
+        if isinstance(data, str):
+            data = base64.b64decode(data.split(",", 1)[-1])
+        self.frames_received += 1
+        with span("decode_image"):
+            image = load_image(data)
+        if FACE_DETECTION:
+            frame = np.asarray(image)
+            boxes = detect_faces(frame)
+            if not boxes:
+                self._tracker.reset()
+                return None
+            face = crop_face(frame, boxes[0])
+            if self._tracker.update(boxes[0], face) and self.frame_results:
+                result = self.frame_results[-1]
+                self.frame_results.append(result)
+                return result
+            image = Image.fromarray(face)
+        result = image_batcher.submit(image).result()
+        self.frame_results.append(result)
+        return result
+
+    def estimate(self) -> Dict[str, Any]:
+        """Running per-modality and fused estimates pushed to the client."""
+        audio = self.audio_result()
+        if audio or self.frame_results:
+            combined = combine_sentiment(None, self.frame_results, audio)
+        else:
+            combined = {"final_sentiment": "neutral", "confidence": 0.0}
+        return {
+            "audio_sentiment": audio,
+            "image_sentiments_count": len(self.frame_results),
+            "combined_sentiment": combined,
+            "duration_s": round(self.duration_s, 2),
+        }
@@ -1,9 +1,150 @@
-from transformers import pipeline
+from transformers import AutoTokenizer
+import functools
+import os
+import re
+import numpy as np
+import torch
+from models.registry import registry, get_model
+from models.backends import load_model, model_backend, configure_torch_threads, resolved_backend
+from models.batching import create_batcher, env_int
+from models.cache import create_cache, content_hash
+
+TEXT_MODEL_ID = "distilbert/distilbert-base-uncased-finetuned-sst-2-english"
+
+# "sentences" classifies each sentence and length-weights them into the message
+# result; "whole" classifies the message as one (truncated) input.
+TEXT_MODE = os.getenv("TEXT_MODE", "sentences")
+TEXT_MAX_TOKENS = 512
+# Sentences without punctuation are cut into pieces of at most this many words.
+TEXT_MAX_SENTENCE_WORDS = 200
+TEXT_TOKEN_CACHE_SIZE = env_int("TEXT_TOKEN_CACHE_SIZE", 4096)
+
+def text_model_version():
+    return f"{TEXT_MODEL_ID}:{resolved_backend('text')}:scores:{TEXT_MODE}"
+
+_SENTENCE_END = re.compile(r"(?<=[.!?…])\s+|\n+")
+
+class TextInferenceSession:
+    """Fast tokenizer and sentiment model kept together.
+
+    Token ids of recently seen sentences are cached, so repeated text is only
+    padded into the batch. Called from the text batcher's single worker thread;
+    fast tokenizers must not be used from several threads at once.
+    """
+
+    def __init__(self, model, tokenizer, token_cache_size=TEXT_TOKEN_CACHE_SIZE):
+        configure_torch_threads()
+        self.backend = model_backend(model)
+        if isinstance(model, torch.nn.Module):
+            model = model.eval()
+        self.model = model
+        self.tokenizer = tokenizer
+        self.id2label = model.config.id2label
+        self.labels = [self.id2label[i] for i in range(len(self.id2label))]
+        self.encode = functools.lru_cache(maxsize=token_cache_size)(self._encode)
+
+    def _encode(self, text):
+        return tuple(self.tokenizer(text, truncation=True, max_length=TEXT_MAX_TOKENS)["input_ids"])
+
+    def forward(self, encodings):
+        """One padded forward pass over token id sequences; returns (batch, labels) probabilities."""
+        batch = self.tokenizer.pad({"input_ids": [list(ids) for ids in encodings]}, return_tensors="pt")
+        with torch.inference_mode():
+            logits = self.model(**batch).logits
+        if not isinstance(logits, torch.Tensor):
+            logits = torch.from_numpy(np.asarray(logits))
+        return torch.softmax(logits.float(), dim=-1).cpu().numpy()
+
+    def predict(self, texts):
+        encodings = [self.encode(text) for text in texts]
+        return encodings, self.forward(encodings)
+
+    def result(self, probabilities, tokens=None):
+        predicted_id = int(np.argmax(probabilities))
+        result = {
+            'label': self.id2label[predicted_id],
+            'score': float(probabilities[predicted_id]),
+            'scores': {label: float(p) for label, p in zip(self.labels, probabilities)},
+        }
+        if tokens is not None:
+            result['tokens'] = tokens
+        return result
+
+def load_text_model():
+    model = load_model(TEXT_MODEL_ID, "text-classification")
+    return TextInferenceSession(model, AutoTokenizer.from_pretrained(TEXT_MODEL_ID, use_fast=True))
+
+registry.register("text", load_text_model)
+
+def _classify_texts(texts):
+    session = get_model("text")
+    encodings, probabilities = session.predict(texts)
+    # Token counts (without [CLS]/[SEP]) are what sentences are weighted by.
+    return [session.result(p, tokens=max(1, len(ids) - 2)) for ids, p in zip(encodings, probabilities)]
+
+text_batcher = create_batcher("text", _classify_texts)
+text_cache = create_cache("text")
+
+def split_sentences(text):
+
+    sentences = []
+    for sentence in _SENTENCE_END.split(text.strip()):
+        words = sentence.split()
+        for start in range(0, len(words), TEXT_MAX_SENTENCE_WORDS):
+            sentences.append(" ".join(words[start:start + TEXT_MAX_SENTENCE_WORDS]))
+    return sentences or [text]
+
+def aggregate_sentences(sentences, results):
+    # Length-weighted mean of the sentence distributions; the top-1 of the mean is the message label.
+    labels = list(results[0]['scores'])
+    weights = np.array([r.get('tokens', 1) for r in results], dtype=np.float64)
+    distributions = np.array([[r['scores'][label] for label in labels] for r in results])
+    mean = weights @ distributions / weights.sum()
+    best = int(np.argmax(mean))
+    return {
+        'label': labels[best],
+        'score': float(mean[best]),
+        'scores': {label: float(p) for label, p in zip(labels, mean)},
+        'sentences': [
+            {'text': sentence, 'label': r['label'], 'score': r['score'], 'tokens': r.get('tokens')}
+            for sentence, r in zip(sentences, results)
+        ],
+    }
 
-text_sentiment = pipeline("text-classification", model="distilbert/distilbert-base-uncased-finetuned-sst-2-english")
 def analyze_text_sentiment(text: str):
-    
-    result = text_sentiment(text)[0]
-    
-    return result
 
+    return analyze_text_sentiments([text])[0]
+
+def analyze_text_sentiments(texts):
+    # Every sentence of every uncached message is queued before waiting, so several
+    # messages (or one long journal entry) share batched forward passes. Sentences
+    # seen before are answered from the cache.
+    version = text_model_version()
+    results = [text_cache.get(content_hash(text, version)) for text in texts]
+
+    pending = {}
+    for i, text in enumerate(texts):
+        if results[i] is not None:
+            continue
+        sentences = split_sentences(text) if TEXT_MODE == "sentences" else [text]
+        parts = []
+        for sentence in sentences:
+            cached = text_cache.get(content_hash(sentence, f"{version}:sentence"))
+            parts.append(cached if cached is not None else text_batcher.submit(sentence))
+        pending[i] = (sentences, parts)
+
+    for i, (sentences, parts) in pending.items():
+        pending[i] = (sentences, [value if isinstance(value, dict) else value.result() for value in parts], parts)
+
+    # Keys are taken again now the model is loaded, in case it fell back to another backend.
+    version = text_model_version()
+    for i, (sentences, sentence_results, parts) in pending.items():
+        for sentence, value, part in zip(sentences, sentence_results, parts):
+            if not isinstance(part, dict):
+                text_cache.set(content_hash(sentence, f"{version}:sentence"), value)
+        if TEXT_MODE == "sentences":
+            results[i] = aggregate_sentences(sentences, sentence_results)
+        else:
+            results[i] = sentence_results[0]
+        text_cache.set(content_hash(texts[i], version), results[i])
+    return results
@@ -1,40 +1,164 @@
 import cv2
-from moviepy.editor import VideoFileClip
-import os
+import numpy as np
+import subprocess
+from models.batching import env_int
+from models.face_detector import detect_faces
 
-def extract_audio(video_path, audio_output):
+def _ffmpeg_exe():
     
     try:
-        clip = VideoFileClip(video_path)
-        if clip.audio is None:  
-            print(f"Warning: No audio track found in {video_path}")
-            return None
-        clip.audio.write_audiofile(audio_output, verbose=False, logger=None)
-        clip.close()
-        return audio_output
+        import imageio_ffmpeg
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except Exception:
+        return "ffmpeg"
+
+def extract_audio_array(video_path, sampling_rate=16000):
+    """Decode the first audio track of `video_path` (a path, or the raw bytes of
+    any container ffmpeg reads) to a mono float32 array at `sampling_rate`,
+    entirely in memory. Returns None when there is no audio."""
+    
+    in_memory = isinstance(video_path, (bytes, bytearray, memoryview))
+    # Bytes are fed on stdin; a file is read directly and stdin stays closed.
+    command = [_ffmpeg_exe(), "-v", "error"] + ([] if in_memory else ["-nostdin"]) + [
+        "-i", "pipe:0" if in_memory else video_path,
+        "-map", "0:a:0?", "-vn",
+        "-ac", "1", "-ar", str(sampling_rate),
+        "-f", "f32le", "pipe:1",
+    ]
+    try:
+        proc = subprocess.run(
+            command,
+            input=bytes(video_path) if in_memory else None,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=False,
+        )
     except Exception as e:
         print(f"Error extracting audio: {e}")
         return None
 
-def extract_frames(video_path, frame_output_dir="frames", frame_rate=1):
+    if proc.returncode != 0 or not proc.stdout:
+        # ffmpeg refuses to write an output with no streams, which is how a missing track shows up.
+        print(f"Warning: No audio track found in {'uploaded data' if in_memory else video_path}")
+        return None
+
+    return np.frombuffer(proc.stdout, dtype=np.float32)
+
+VIDEO_MAX_FRAMES = env_int("VIDEO_MAX_FRAMES", 64)
+FRAME_STRATEGIES = ("uniform", "scene-change", "face-present")
+# "adaptive" (see models/adaptive_video.py) picks frames from the predictions themselves.
+
+# Above this many frames between samples it is cheaper to seek than to grab through.
+SEEK_THRESHOLD = 120
+SCENE_CHANGE_THRESHOLD = 0.3
+
+def _histogram(frame_rgb):
     
-    os.makedirs(frame_output_dir, exist_ok=True)
+    small = cv2.resize(frame_rgb, (64, 64), interpolation=cv2.INTER_AREA)
+    hsv = cv2.cvtColor(small, cv2.COLOR_RGB2HSV)
+    hist = cv2.calcHist([hsv], [0, 1], None, [16, 16], [0, 180, 0, 256])
+    return cv2.normalize(hist, hist).flatten()
+
+def iter_frames(video_path, frame_rate=1, max_frames=None, strategy="uniform", with_boxes=False):
+    """Yield sampled RGB frames (numpy uint8 arrays) without writing anything to disk.
+
+    Frames between samples are only grabbed (or skipped with a seek for long
+    gaps), never converted. `strategy` keeps every sampled frame ("uniform"),
+    only frames that differ from the last kept one ("scene-change"), or only
+    frames with a detectable face ("face-present"). With `with_boxes`, yields
+    (frame, boxes) pairs instead; boxes are the faces found while sampling, or
+    None when the strategy did not look for faces.
+    """
+    if strategy not in FRAME_STRATEGIES:
+        raise ValueError(f"Unknown frame sampling strategy: {strategy}")
+    if max_frames is None:
+        max_frames = VIDEO_MAX_FRAMES
+
     vidcap = cv2.VideoCapture(video_path)
-    fps = int(vidcap.get(cv2.CAP_PROP_FPS))
-    frame_interval = max(1, fps // frame_rate)
+    try:
+        fps = vidcap.get(cv2.CAP_PROP_FPS) or 30.0
+        total = int(vidcap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+        frame_interval = max(1, int(round(fps / frame_rate)))
+
+        # Spread a uniform sample over the whole video instead of stopping at the cap.
+        if strategy == "uniform" and max_frames and total > 0:
+            frame_interval = max(frame_interval, -(-total // max_frames))
 
-    count = 0
-    saved_frames = []
+        position = 0
+        kept = 0
+        last_hist = None
 
-    while True:
-        success, frame = vidcap.read()
+        while not max_frames or kept < max_frames:
+            if total and position >= total:
+                break
+            if not vidcap.grab():
+                break
+            success, frame = vidcap.retrieve()
+            if not success:
+                break
+
+            frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            keep = True
+            boxes = None
+            if strategy == "scene-change":
+                hist = _histogram(frame_rgb)
+                if last_hist is not None:
+                    keep = cv2.compareHist(last_hist, hist, cv2.HISTCMP_BHATTACHARYYA) > SCENE_CHANGE_THRESHOLD
+                if keep:
+                    last_hist = hist
+            elif strategy == "face-present":
+                boxes = detect_faces(frame_rgb)
+                keep = len(boxes) > 0
+
+            if keep:
+                kept += 1
+                yield (frame_rgb, boxes) if with_boxes else frame_rgb
+
+            next_position = position + frame_interval
+            if frame_interval > SEEK_THRESHOLD:
+                vidcap.set(cv2.CAP_PROP_POS_FRAMES, next_position)
+            else:
+                for _ in range(frame_interval - 1):
+                    if not vidcap.grab():
+                        return
+            position = next_position
+    finally:
+        vidcap.release()
+
+def extract_frames(video_path, frame_rate=1, max_frames=None, strategy="uniform"):
+    
+    return list(iter_frames(video_path, frame_rate=frame_rate, max_frames=max_frames, strategy=strategy))
+
+class FrameReader:
+    """Random access to single frames of a video, decoded to RGB only when asked for.
+
+    Reading indices in increasing order grabs through short gaps and seeks over
+    long ones, like iter_frames.
+    """
+
+    def __init__(self, video_path):
+        self._vidcap = cv2.VideoCapture(video_path)
+        self.fps = self._vidcap.get(cv2.CAP_PROP_FPS) or 30.0
+        self.frame_count = int(self._vidcap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+        self._position = 0
+
+    def read(self, index):
+        gap = index - self._position
+        if gap < 0 or gap > SEEK_THRESHOLD:
+            self._vidcap.set(cv2.CAP_PROP_POS_FRAMES, index)
+        else:
+            for _ in range(gap):
+                if not self._vidcap.grab():
+                    return None
+        success, frame = self._vidcap.read()
+        self._position = index + 1
         if not success:
-            break
-        if count % frame_interval == 0:
-            frame_path = os.path.join(frame_output_dir, f"frame_{count}.jpg")
-            cv2.imwrite(frame_path, frame)
-            saved_frames.append(frame_path)
-        count += 1
-
-    vidcap.release()
-    return saved_frames
+            return None
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+
+    def close(self):
+        self._vidcap.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
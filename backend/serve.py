@@ -0,0 +1,164 @@
+"""Production launcher: load the models once, then fork workers that share them.
+
+    python serve.py --workers 4 --port 8000
+
+The parent imports the app, loads the models (PRELOAD_MODELS, default all)
+and freezes the garbage collector so workers do not touch the inherited
+objects. It then binds the listening socket and forks the workers, which
+accept from that socket. fork() shares the weights copy-on-write, so N workers
+use one copy of them, plus their own activations. Each worker gets
+cpu_count // workers torch threads unless TORCH_INTRA_OP_THREADS is set.
+A worker that exits is replaced by a fresh fork of the parent.
+
+--share-memory (SHARE_MODEL_MEMORY=1) additionally moves the torch weights
+into /dev/shm, so they stay single copies even if a worker writes to them.
+It copies the weights first, raising peak RSS, and needs a /dev/shm larger
+than the models (Docker's default is 64 MB), so it is off by default.
+
+Sessions must be shared between workers: with more than one worker,
+SESSION_BACKEND=sqlite is required. Admission limits and /metrics are per
+worker.
+
+No inference runs in the parent: OpenMP and batcher threads do not survive
+fork(). ONNX Runtime sessions do not either, so with INFERENCE_BACKEND=onnx
+each worker loads its own models. `python main.py` remains the development
+server with auto-reload.
+"""
+import os
+os.environ["HF_HUB_DISABLE_SYMLINKS_WARNING"] = "1"
+os.environ["HF_HUB_DISABLE_PROGRESS_BARS"] = "1"
+import argparse
+import gc
+import signal
+import socket
+import time
+
+import uvicorn
+
+from api import app
+from models.registry import registry, current_rss
+from models.backends import INFERENCE_BACKEND, configure_torch_threads
+from models.batching import env_int
+
+# A worker dying sooner than this after its start is restarted after a pause, not at once.
+RESTART_BACKOFF_S = 1.0
+
+
+def bind_socket(host: str, port: int, backlog: int = 2048) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def preload_shared(names, share_memory=False):
+    """Load models in the parent and prepare them to be inherited by the workers."""
+    if INFERENCE_BACKEND == "onnx":
+        print("INFERENCE_BACKEND=onnx: models are loaded by each worker, not shared")
+        return
+    if names == ["all"]:
+        names = list(registry.stats()["models"].keys())
+    registry.preload(names, background=False)
+    shared = registry.share_memory() if share_memory else 0
+    # Objects that exist now are never collected in the workers, so the collector
+    # does not write to (and copy) the pages they live on.
+    gc.collect()
+    gc.freeze()
+    print(f"Preloaded {', '.join(names) or 'no models'}: {shared / 1e6:.0f} MB of weights in shared memory, "
+          f"parent RSS {(current_rss() or 0) / 1e6:.0f} MB")
+
+
+def run_worker(sock: socket.socket, threads: int, args) -> None:
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    os.environ.setdefault("TORCH_INTRA_OP_THREADS", str(threads))
+    configure_torch_threads()
+    config = uvicorn.Config(
+        app,
+        log_level=args.log_level,
+        timeout_keep_alive=args.keep_alive,
+        lifespan="on",
+    )
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the API with pre-forked workers sharing one copy of the models.")
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=env_int("PORT", 8000))
+    parser.add_argument("--workers", type=int, default=env_int("WEB_WORKERS", 2))
+    parser.add_argument("--preload", default=os.getenv("PRELOAD_MODELS") or "all",
+                        help="models to load before forking, e.g. text,image, or all")
+    parser.add_argument("--share-memory", action="store_true",
+                        default=os.getenv("SHARE_MODEL_MEMORY", "0").lower() in ("1", "true", "yes"),
+                        help="move torch weights into /dev/shm before forking")
+    parser.add_argument("--log-level", default="info")
+    parser.add_argument("--keep-alive", type=int, default=5, help="keep-alive timeout in seconds")
+    args = parser.parse_args()
+
+    workers = max(1, args.workers)
+    if workers > 1 and os.getenv("SESSION_BACKEND", "memory").lower() != "sqlite":
+        # The in-memory store is per process: a session's next request would
+        # likely land on another worker and start over.
+        parser.error("more than one worker needs SESSION_BACKEND=sqlite, so workers share sessions")
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    names = [name.strip() for name in args.preload.split(",") if name.strip()]
+
+    sock = bind_socket(args.host, args.port)
+    preload_shared(names, share_memory=args.share_memory)
+
+    children = {}
+    stopping = False
+
+    def spawn(index):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                run_worker(sock, threads, args)
+            except BaseException as e:
+                print(f"Worker {index} failed: {e}")
+                code = 1
+            finally:
+                os._exit(code)
+        children[pid] = (index, time.monotonic())
+        print(f"Started worker {index} (pid {pid}, {threads} torch threads)")
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for index in range(workers):
+        spawn(index)
+    print(f"Serving on http://{args.host}:{args.port} with {workers} workers")
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        index, started = children.pop(pid, (None, None))
+        if index is None or stopping:
+            continue
+        print(f"Worker {index} (pid {pid}) exited with status {os.waitstatus_to_exitcode(status)}; restarting")
+        if time.monotonic() - started < RESTART_BACKOFF_S:
+            time.sleep(RESTART_BACKOFF_S)
+        if not stopping:
+            spawn(index)
+
+    sock.close()
+
+
+if __name__ == "__main__":
+    main()